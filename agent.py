@@ -8,6 +8,7 @@ import dbaccess
 import misc
 import trade
 import trade_manager
+import journal
 import os
 import instrument
 import ctp
@@ -50,6 +51,8 @@ class MktDataMixin(object):
         self.cur_day = {}  		
         self.day_data_func = {}
         self.min_data_func = {}
+        # rolling buffers of the per bar functions by (inst, freq, func name), built on their first bar
+        self.data_bufs = {}
         self.daily_data_days = config.get('daily_data_days', 25)
         self.min_data_days = config.get('min_data_days', 1)
         self.db_conn = dbaccess.connect(**dbaccess.dbconfig)
@@ -101,6 +104,20 @@ class MktDataMixin(object):
             if fobj != None:
                 self.min_data_func[inst][mins].append(self.calc_func_dict[fobj.name])
             
+    def run_data_func(self, inst, freq, fobj, data):
+        key = (inst, freq, fobj.name)
+        if key not in self.data_bufs:
+            self.data_bufs[key] = data_handler.live_buffers(fobj.rfunc, data[:-1])
+        bufs = self.data_bufs[key]
+        if bufs == None:
+            fobj.rfunc(data)
+        else:
+            fobj.rfunc(data, **bufs)
+
+    def reset_data_bufs(self, inst):
+        for key in [key for key in self.data_bufs if key[0] == inst]:
+            del self.data_bufs[key]
+
     def update_min_bar(self, tick):
         inst = tick.instID
         tick_dt = tick.timestamp
@@ -178,7 +195,7 @@ class MktDataMixin(object):
                         if new_data['high'] > new_data['low']:
                             ra_m.append_by_dict(new_data)
                 for fobj in self.min_data_func[inst][m]:
-                    fobj.rfunc(self.min_data[inst][m].data)
+                    self.run_data_func(inst, m, fobj, self.min_data[inst][m].data)
         if self.save_flag:
             event1 = Event(type=EVENT_DB_WRITE, priority = 500)
             event1.dict['data'] = self.tick_data[inst]
@@ -212,7 +229,7 @@ class MktDataMixin(object):
                 new_day = { key: self.cur_day[inst][key] for key in day_data_list }
                 self.day_data[inst].append_by_dict(new_day)
                 for fobj in self.day_data_func[inst]:
-                    fobj.rfunc(self.day_data[inst].data)
+                    self.run_data_func(inst, 'd', fobj, self.day_data[inst].data)
                 if self.save_flag:
                     event = Event(type=EVENT_DB_WRITE, priority = 500)
                     event.dict['data'] = self.cur_day[inst]
@@ -267,6 +284,14 @@ class Agent(MktDataMixin):
             for mod_name in str_list[1:]:
                 gateway_class = getattr(gateway_class, mod_name)
             self.add_gateway(gateway_class, gateway_name)
+            if 'throttle' in gateway_dict[gateway_name]:
+                self.gateways[gateway_name].throttle.set_limits(gateway_dict[gateway_name]['throttle'])
+            if 'risk' in gateway_dict[gateway_name]:
+                self.gateways[gateway_name].risk.set_limits(gateway_dict[gateway_name]['risk'])
+            self.gateways[gateway_name].route_priority = gateway_dict[gateway_name].get('route_priority', 0)
+        self.exch_routes = {}
+        self.inst_routes = {}
+        self.build_routes()
         self.type2gateway = {}
         self.inst2strat = {}
         self.spread_data = {}
@@ -274,7 +299,7 @@ class Agent(MktDataMixin):
         self.inst2gateway = {}
         self.strat_list = []
         self.strategies = {}
-        self.trade_manager = trade_manager.TradeManager(self)
+        self.trade_manager = trade_manager.TradeManager(self, config.get('trade_book', 'full'))
         self.ref2order = {}
         strat_files = config.get('strat_files', [])
         for sfile in strat_files:
@@ -295,6 +320,9 @@ class Agent(MktDataMixin):
         for key in self.gateways:
             gateway = self.gateways[key]
             gateway.register_event_handler()
+            if len(gateway.route_exchanges) > 0:
+                self.eventEngine.register(EVENT_TDLOGIN + gateway.gatewayName, self.update_routes)
+                self.eventEngine.register(EVENT_TDDISCONNECTED + gateway.gatewayName, self.update_routes)
         self.eventEngine.register(EVENT_DB_WRITE, self.write_mkt_data)
         self.eventEngine.register(EVENT_LOG, self.log_handler)
         self.eventEngine.register(EVENT_TICK, self.run_tick)
@@ -321,14 +349,43 @@ class Agent(MktDataMixin):
             del self.sched_commands[0:i]
 
     def gateway_map(self, instID):
-        exch = self.instruments[instID].exchange
-        if exch in ['CZCE', 'DCE', 'SHFE', 'CFFEX']:
-            for key in self.gateways:
-                gateway = self.gateways[key]
-                gway_class = type(gateway).__name__
-                if ('ctp' in gway_class) or ('Ctp' in gway_class):
-                    return gateway
-        return None
+        return self.inst2gateway.get(instID, None)
+
+    def build_routes(self):
+        ''' exchange -> gateways able to trade it, the primary route first and then the backups '''
+        exch_routes = {}
+        for name in sorted(self.gateways, key = lambda x: (self.gateways[x].route_priority, x)):
+            for exch in self.gateways[name].route_exchanges:
+                exch_routes.setdefault(exch, []).append(self.gateways[name])
+        self.exch_routes = exch_routes
+
+    def select_route(self, instID):
+        ''' the first connected gateway on the routes of the instrument, the primary one if none is up '''
+        routes = self.inst_routes[instID]
+        for gateway in routes:
+            if gateway.tdConnected:
+                return gateway
+        return routes[0]
+
+    def route_instrument(self, instID, gateway):
+        if instID not in gateway.positions:
+            subreq = VtSubscribeReq()
+            subreq.symbol = instID
+            subreq.exchange = self.instruments[instID].exchange
+            subreq.productClass = self.instruments[instID].ptype
+            subreq.currency = self.instruments[instID].ccy
+            subreq.expiry = self.instruments[instID].expiry
+            gateway.subscribe(subreq)
+        self.inst2gateway[instID] = gateway
+
+    def update_routes(self, event = None):
+        ''' move the instruments off the gateways which have lost the trading connection '''
+        for instID in self.inst_routes:
+            gateway = self.select_route(instID)
+            if gateway is not self.inst2gateway[instID]:
+                self.logger.warning('switching the route of %s from %s to %s' % \
+                                    (instID, self.inst2gateway[instID].gatewayName, gateway.gatewayName))
+                self.route_instrument(instID, gateway)
 
     def add_instrument(self, name):
         if name not in self.instruments:
@@ -346,16 +403,10 @@ class Agent(MktDataMixin):
             if name not in self.inst2strat:
                 self.inst2strat[name] = {}
             if name not in self.inst2gateway:
-                gateway = self.gateway_map(name)
-                if gateway != None:
-                    self.inst2gateway[name] = gateway
-                    subreq = VtSubscribeReq()
-                    subreq.symbol = name
-                    subreq.exchange = self.instruments[name].exchange
-                    subreq.productClass = self.instruments[name].ptype
-                    subreq.currency = self.instruments[name].ccy
-                    subreq.expiry = self.instruments[name].expiry
-                    gateway.subscribe(subreq)
+                routes = self.exch_routes.get(self.instruments[name].exchange, [])
+                if len(routes) > 0:
+                    self.inst_routes[name] = routes
+                    self.route_instrument(name, self.select_route(name))
                 else:
                     self.logger.warning("No Gateway is assigned to instID = %s" % name)
             super(Agent, self).add_instrument(name)
@@ -417,13 +468,13 @@ class Agent(MktDataMixin):
         gateway = self.inst2gateway[iorder.instrument]
         gateway.add_order(iorder)
         if urgent:
-            gateway.sendOrder(iorder)
+            gateway.send_queued_orders()
 
     #----------------------------------------------------------------------
     def cancel_order(self, iorder):
         """对特定接口撤单"""
         if iorder.gateway != None:
-            iorder.gateway.cancelOrder(iorder)
+            iorder.gateway.cancel_order(iorder)
         else:
             self.logger.warning(u'接口不存在')
 
@@ -469,6 +520,8 @@ class Agent(MktDataMixin):
     def prepare_data_env(self, inst, mid_day = True):
         if  self.instruments[inst].ptype == instrument.ProductType.Option:
             return
+        # the data is reloaded, the buffers are rebuilt from it on the next bar
+        self.reset_data_bufs(inst)
         if self.daily_data_days > 0 or mid_day:
             #self.logger.debug('Updating historical daily data for %s' % self.scur_day.strftime('%Y-%m-%d'))
             daily_start = workdays.workday(self.scur_day, -self.daily_data_days, CHN_Holidays)
@@ -570,8 +623,8 @@ class Agent(MktDataMixin):
         if not self.eod_flag:
             self.logger.debug(u'保存执行状态.....................')
             for gway in self.gateways:
-                self.gateways[gway].save_order_list(self.scur_day)
-            self.trade_manager.save_trade_list(self.scur_day, self.trade_manager.ref2trade, self.folder)
+                self.gateways[gway].journal_orders(self.scur_day)
+            self.trade_manager.journal_trades(self.scur_day, self.folder)
     
     def run_eod(self):
         if self.eod_flag:
@@ -636,6 +689,9 @@ class Agent(MktDataMixin):
         self.instruments[inst].open_interest = tick.openInterest
         last_volume = self.instruments[inst].volume       
         if tick.volume > last_volume:
+            if self.instruments[inst].price != tick.price:
+                self.inst2gateway[inst].mark_dirty([inst])
+                self.inst2gateway[inst].risk.update_price(inst, tick.price)
             self.instruments[inst].price  = tick.price
             self.instruments[inst].volume = tick.volume
             self.instruments[inst].last_traded = curr_tick
@@ -682,6 +738,9 @@ class Agent(MktDataMixin):
         status = mytrade.refresh()
         if status in trade.Alive_Trade_Status:
             mytrade.execute()
+        for name in self.gateways:
+            if self.gateways[name].process_flag:
+                self.gateways[name].send_queued_orders()
         self.save_state()
             
     def exit(self):
@@ -690,11 +749,14 @@ class Agent(MktDataMixin):
         self.eventEngine.stop()
         self.logger.info('stopped the engine, exiting the agent ...')
         self.save_state()
+        self.trade_manager.close_journal()
         for strat_name in self.strat_list:
             strat = self.strategies[strat_name]
             strat.save_state()
+        journal.snapshot_writer.flush()
         for name in self.gateways:
             gateway = self.gateways[name]
+            gateway.close_journal()
             gateway.close()
             gateway.mdApi = None
             gateway.tdApi = None
@@ -10,6 +10,10 @@ import strategy as strat
 import dbaccess
 import misc
 import platform
+import threading
+import Queue
+import result_store
+import robustness
 
 sim_margin_dict = { 'au': 0.06, 'ag': 0.08, 'cu': 0.07, 'al':0.05,
                 'zn': 0.06, 'rb': 0.06, 'ru': 0.12, 'a': 0.05,
@@ -62,6 +66,9 @@ def get_bktest_folder():
     return folder
 
 class StratSim(object):
+    # run_loop_sim goes through run_fast_sim, only for sims whose check_data_invalid depends on the data columns alone
+    fast_loop = False
+
     def __init__(self, config):
         self.pos_update = False
         self.pos_class = None
@@ -79,6 +86,7 @@ class StratSim(object):
         self.traded_cost = 0.0
         self.traded_price = 0.0
         self.closeout_pnl = 0.0
+        self.price_shift = 0.0
         self.scur_day = None
 
     def process_config(self, config):
@@ -94,6 +102,8 @@ class StratSim(object):
         return 0
 
     def run_loop_sim(self):
+        if self.fast_loop:
+            return self.run_fast_sim()
         dra = dh.DynamicRecArray(dataframe=self.df)
         sim_data = dra.data
         nlen = len(dra)
@@ -127,9 +137,104 @@ class StratSim(object):
         out_df = pd.DataFrame(sim_data)
         return out_df, self.closed_trades
 
+    def run_fast_sim(self):
+        # the run_loop_sim bar loop with the same hooks and output, less the per bar set up: timestamps
+        # are converted once, contract roll/end flags are precomputed and the output columns are bound
+        # to array views. The loop, on_bar and the TradePos objects stay in python, so it is a modest
+        # saving (about 1.4x on the perf_bench sim), not a compiled core
+        dra = dh.DynamicRecArray(dataframe=self.df)
+        sim_data = dra.data
+        nlen = len(dra)
+        if nlen < 3:
+            return pd.DataFrame(sim_data), self.closed_trades
+        self.scur_day = sim_data['date'][0]
+        self.run_bar_range(sim_data, 1, nlen - 1, True)
+        out_df = pd.DataFrame(sim_data)
+        return out_df, self.closed_trades
+
+    def run_bar_range(self, sim_data, start, end, is_last):
+        nlen = len(sim_data)
+        timestamps = pd.to_datetime(sim_data['datetime']).to_pydatetime()
+        sdate = sim_data['date']
+        sopen = sim_data['open']
+        spos = sim_data['pos']
+        scost = sim_data['cost']
+        scloseout = sim_data['closeout']
+        straded = sim_data['traded_price']
+        cont = sim_data['contract']
+        sshift = sim_data['shift'] if 'shift' in sim_data.dtype.names else None
+        close_flag = np.zeros(nlen, dtype = bool)
+        close_flag[:-1] = (cont[:-1] != cont[1:])
+        if is_last:
+            close_flag[nlen-2:] = True
+        invalid = self.data_invalid_mask(sim_data)
+        if invalid is None:
+            invalid = [self.check_data_invalid(sim_data, n) for n in range(nlen - 1)]
+        scur_day = self.scur_day
+        for n in range(start, end):
+            self.timestamp = timestamps[n]
+            self.traded_vol = self.traded_cost = self.closeout_pnl = 0
+            self.traded_price = sopen[n]
+            if sshift is not None:
+                self.price_shift = sshift[n]
+            if not invalid[n-1]:
+                if close_flag[n]:
+                    if len(self.positions) > 0:
+                        for tradepos in self.positions:
+                            self.close_tradepos(tradepos, sopen[n])
+                        self.positions = []
+                else:
+                    self.on_bar(sim_data, n - 1)
+                    if len(self.positions) > 0:
+                        self.check_curr_pos(sim_data, n)
+            spos[n] = spos[n - 1] + self.traded_vol
+            scost[n] = self.traded_cost
+            scloseout[n] = self.closeout_pnl
+            straded[n] = self.traded_price
+            if scur_day != sdate[n+1]:
+                self.daily_initialize(sim_data, n)
+                scur_day = sdate[n + 1]
+                self.scur_day = scur_day
+
+    def run_stream_sim(self, chunks, warmup = 1000, out_cols = None):
+        # self.df holds the first chunk, chunks yields the following ones in time order.
+        # each chunk is prefixed with the last warmup bars of the previous one so the
+        # indicators from process_data see the same history, positions and day state
+        # stay on the object, and the last bar of a chunk is run with the next chunk
+        if out_cols == None:
+            out_cols = ['datetime', 'date', 'min_id', 'open', 'close', 'contract', 'pos', 'cost', 'closeout', 'traded_price']
+        warmup = max(warmup, 2)
+        out_list = []
+        sim_data = dh.DynamicRecArray(dataframe=self.df).data
+        if ('shift' in sim_data.dtype.names) and ('shift' not in out_cols):
+            out_cols = out_cols + ['shift']
+        self.scur_day = sim_data['date'][0]
+        start = 1
+        chunks = iter(chunks)
+        next_df = next(chunks, None)
+        while next_df is not None:
+            nlen = len(sim_data)
+            self.run_bar_range(sim_data, start, nlen - 1, False)
+            out_list.append(pd.DataFrame(sim_data[(start if len(out_list) > 0 else 0):(nlen - 1)][out_cols]))
+            tail = self.df.iloc[max(nlen - warmup, 0):]
+            last_pos = sim_data['pos'][nlen - 2]
+            self.process_data(pd.concat([tail[[col for col in next_df.columns if col in tail.columns]], next_df]))
+            sim_data = dh.DynamicRecArray(dataframe=self.df).data
+            start = len(tail) - 1
+            sim_data['pos'][start - 1] = last_pos
+            next_df = next(chunks, None)
+        self.run_bar_range(sim_data, start, len(sim_data) - 1, True)
+        out_list.append(pd.DataFrame(sim_data[(start if len(out_list) > 0 else 0):][out_cols]))
+        out_df = pd.concat(out_list, ignore_index = True)
+        return out_df, self.closed_trades
+
     def run_vec_sim(self):
         pass
 
+    def data_invalid_mask(self, sim_data):
+        # optional vectorized version of check_data_invalid, return a bool array or None
+        return None
+
     def check_data_invalid(self, sim_data, n):
         return False
 
@@ -144,7 +249,7 @@ class StratSim(object):
         else:
             self.traded_price = (self.traded_price * self.traded_vol - tp * tradepos.pos)/(self.traded_vol - tradepos.pos)
         self.traded_vol -= tradepos.pos
-        self.traded_cost += abs(tradepos.pos) * (self.offset + tp * self.tcost)
+        self.traded_cost += abs(tradepos.pos) * (self.offset + (tp - self.price_shift) * self.tcost)
         # print "close", self.timestamp, tp, self.traded_price, self.traded_vol
 
     def open_tradepos(self, contracts, price, traded_pos):
@@ -159,7 +264,7 @@ class StratSim(object):
         self.positions.append(new_pos)
         self.traded_price = (self.traded_price * self.traded_vol + tp * new_pos.pos)/(self.traded_vol + new_pos.pos)
         self.traded_vol += new_pos.pos
-        self.traded_cost += abs(new_pos.pos) * (self.offset + tp * self.tcost)
+        self.traded_cost += abs(new_pos.pos) * (self.offset + (tp - self.price_shift) * self.tcost)
         # print "open", self.timestamp, tp, self.traded_price, self.traded_vol
 
     def check_curr_pos(self, sim_data, n):
@@ -197,6 +302,65 @@ def get_asset_tradehrs(asset):
             hrs = [misc.night_trading_hrs[night_idx]] + hrs
     return hrs
     
+def prefetch(iterable, depth = 1):
+    # load the next items in a background thread while the caller works on the current one
+    queue = Queue.Queue(maxsize = depth)
+    def producer():
+        try:
+            for item in iterable:
+                queue.put((True, item))
+        except Exception as e:
+            queue.put((False, e))
+        queue.put((False, None))
+    thread = threading.Thread(target = producer)
+    thread.daemon = True
+    thread.start()
+    while True:
+        is_data, item = queue.get()
+        if not is_data:
+            if item != None:
+                raise item
+            break
+        yield item
+
+def nearby_chunks(prod, config, chunk_period = '3m', need_shift = True):
+    # min data in date chunks, rolls are forward adjusted (later contracts are shifted onto the
+    # earlier ones) since a back adjustment would need the future rolls to price the past
+    sdate = config['start_date']
+    offset = 0.0
+    last_close = None
+    last_cont = None
+    while sdate <= config['end_date']:
+        edate = min(misc.day_shift(sdate, chunk_period) - datetime.timedelta(days = 1), config['end_date'])
+        mdf = misc.nearby(prod, config['nearby'], sdate, edate, config['rollrule'], 'm', \
+                          need_shift = False, database = 'hist_data')
+        sdate = edate + datetime.timedelta(days = 1)
+        if (mdf is None) or (len(mdf) == 0):
+            continue
+        mdf = cleanup_mindata(mdf, prod)
+        if need_shift:
+            cont = mdf['contract'].values
+            seg_starts = np.flatnonzero(np.r_[True, cont[1:] != cont[:-1]])
+            shift = np.zeros(len(mdf))
+            for i, seg in enumerate(seg_starts):
+                if (last_cont != None) and (cont[seg] != last_cont):
+                    cnx = dbaccess.connect(**dbaccess.hist_dbconfig)
+                    tmp_df = dbaccess.load_daily_data_to_df(cnx, 'fut_daily', cont[seg], last_date, last_date)
+                    cnx.close()
+                    offset = last_close - tmp_df['close'][-1]
+                seg_end = seg_starts[i + 1] if i + 1 < len(seg_starts) else len(mdf)
+                shift[seg:seg_end] = offset
+                last_cont = cont[seg]
+                last_close = mdf['close'].values[seg_end - 1] + offset
+                last_date = mdf['date'].values[seg_end - 1]
+            for ticker in ['open', 'high', 'low', 'close']:
+                mdf[ticker] = mdf[ticker] + shift
+        else:
+            shift = 0.0
+        # the sims take the traded prices for cost and margin as the adjusted ones less this shift
+        mdf['shift'] = shift
+        yield mdf
+
 def cleanup_mindata(df, asset, index_col = 'datetime', skip_hl = True):
     cond = None
     if index_col == None:
@@ -227,7 +391,42 @@ def cleanup_mindata(df, asset, index_col = 'datetime', skip_hl = True):
 def stat_min2daily(df):
     return pd.Series([df['pnl'].sum(), df['cost'].sum(), df['margin'][-1]], index = ['pnl','cost','margin'])
 
+def trades_from_pos_changes(df):
+    pos = df['pos'].values
+    nlen = len(pos)
+    if nlen == 0:
+        return []
+    chg = np.flatnonzero(np.r_[True, pos[1:] != pos[:-1]])
+    new_pos = pos[chg]
+    prev_pos = np.r_[0, new_pos[:-1]]
+    if np.any((prev_pos * new_pos > 0) & (prev_pos != new_pos)):
+        # position scaling in/out needs the lot by lot matching of the loop version
+        return None
+    close_ev = (prev_pos != 0)
+    open_ev = (new_pos != 0)
+    tradeids = np.cumsum(close_ev.astype(int) + open_ev.astype(int))
+    tprice = df['traded_price'].values[chg]
+    conts = df['contract'].values[chg]
+    dtimes = df.index[chg]
+    open_idx = np.flatnonzero(open_ev)
+    closed_trades = []
+    for k in open_idx:
+        if k + 1 >= len(chg):
+            print "ERROR: something wrong with the backtest position management - there are unclosed positions after the test"
+            break
+        new_trade = strat.TradePos(insts = [conts[k]], volumes = [1], pos = new_pos[k], \
+                                   entry_target = tprice[k], exit_target = tprice[k])
+        new_trade.entry_tradeid = int(tradeids[k])
+        new_trade.open(tprice[k], new_pos[k], dtimes[k])
+        new_trade.close(tprice[k + 1], dtimes[k + 1])
+        new_trade.exit_tradeid = int(tradeids[k + 1] - open_ev[k + 1])
+        closed_trades.append(new_trade)
+    return closed_trades
+
 def simdf_to_trades1(df, slippage = 0):
+    closed_trades = trades_from_pos_changes(df)
+    if closed_trades is not None:
+        return closed_trades
     xdf = df[df['pos'] != df['pos'].shift(1)]
     prev_pos = 0
     tradeid = 0
@@ -324,6 +523,56 @@ def simdf_to_trades2(df, slippage = 0.0):
         print "ERROR: something wrong with the backtest position management - there are unclosed positions after the test"
     return closed_trades
     
+def shift_2d(arr, n = 1):
+    out = np.empty(arr.shape)
+    out[:n] = np.nan
+    out[n:] = arr[:-n]
+    return out
+
+def ffill_2d(arr):
+    # forward fill NaN values down each column, i.e. fillna(method='ffill') for a time x scenario array
+    row_idx = np.where(np.isnan(arr), 0, np.arange(arr.shape[0]).reshape((-1, 1)))
+    row_idx = np.maximum.accumulate(row_idx, axis = 0)
+    return arr[row_idx, np.arange(arr.shape[1])]
+
+def bars_to_min(xdata, xindex, mindex):
+    # same as mdf.join(xdata).fillna(method='ffill') for bar data indexed by the bar start time
+    xdata = np.asarray(xdata, dtype = float)
+    xdata = ffill_2d(xdata.reshape((len(xindex), -1)))
+    bar_idx = np.searchsorted(np.asarray(xindex), np.asarray(mindex), side = 'right') - 1
+    out = xdata[np.maximum(bar_idx, 0)]
+    out[bar_idx < 0] = np.nan
+    return out
+
+def vec_sim_output(base_df, pos, cost, traded_price):
+    res = []
+    for i in range(pos.shape[1]):
+        sdf = base_df.copy(deep = False)
+        sdf['pos'] = pos[:, i]
+        sdf['cost'] = cost[:, i]
+        sdf['traded_price'] = traded_price[:, i]
+        res.append((sdf, simdf_to_trades1(sdf)))
+    return res
+
+def run_scenarios(run_sim, vec_sim, mdf, config, sim_config, scenarios, scen_list):
+    def scen_config(ix):
+        conf = dict(config)
+        for key, seq in zip(sim_config['scen_keys'], scenarios[ix]):
+            conf[key] = sim_config[key][seq]
+        return conf
+    if vec_sim == None:
+        for ix in scen_list:
+            df, closed_trades = run_sim(mdf.copy(deep = True), scen_config(ix))
+            yield ix, df, closed_trades
+    else:
+        # the vectorized sims hold several time x scenario arrays, so size the scenario chunks by the data length
+        nchunk = max(1, int(sim_config.get('vec_max_cells', 5000000) / max(len(mdf), 1)))
+        for i in range(0, len(scen_list), nchunk):
+            chunk = scen_list[i:(i+nchunk)]
+            results = vec_sim(mdf, config, [scen_config(ix) for ix in chunk])
+            for ix, (df, closed_trades) in zip(chunk, results):
+                yield ix, df, closed_trades
+
 def check_bktest_bar_stop(bar, stop_price, direction = 1):
     price_traded = np.nan
     if (bar.open - stop_price)*direction <= 0:
@@ -337,56 +586,92 @@ def check_bktest_bar_stop(bar, stop_price, direction = 1):
             price_traded = compare_price
     return price_traded
     
-def get_pnl_stats(df_list, start_capital, marginrate, freq):
-    sum_pnl = pd.Series(name = 'pnl')
-    sum_margin = pd.Series(name='margin')
-    sum_cost = pd.Series(name='cost')
-    if freq == 'm':
-        index_col = ['date', 'min_id']
+def day_starts(dates):
+    dates = np.asarray(dates)
+    flag = np.ones(len(dates), dtype = bool)
+    flag[1:] = (dates[1:] != dates[:-1])
+    return np.flatnonzero(flag)
+
+def daily_aggregate(dates, pnl, cost, margin, bar_ids = None):
+    if len(dates) == 0:
+        return np.array([]), np.array([]), np.array([]), np.array([]), np.array([])
+    dates = np.asarray(dates)
+    starts = day_starts(dates)
+    ends = np.r_[starts[1:], len(dates)] - 1
+    last_bar = bar_ids[ends] if bar_ids is not None else ends
+    return dates[starts], np.add.reduceat(pnl, starts), np.add.reduceat(cost, starts), margin[ends], last_bar
+
+def sim_pnl_arrays(df, marginrate, pnl_mode = 'close'):
+    pos = df['pos'].values.astype(float)
+    close = df['close'].values.astype(float)
+    prev_pos = np.r_[0.0, pos[:-1]]
+    if pnl_mode == 'close':
+        pnl = prev_pos * np.r_[0.0, np.diff(close)]
+        if 'traded_price' in df.columns:
+            pnl = pnl + (pos - prev_pos) * (close - df['traded_price'].values)
     else:
-        index_col = ['date']
-    for df in df_list:
-        xdf = df.reset_index().set_index(index_col)
-        pnl = xdf['pos'].shift(1).fillna(0.0)*(xdf['close'] - xdf['close'].shift(1)).fillna(0.0)
-        if 'traded_price' in xdf.columns:
-            pnl = pnl + (xdf['pos'] - xdf['pos'].shift(1).fillna(0.0))*(xdf['close'] - xdf['traded_price'])
-        if len(sum_pnl) == 0:
-            sum_pnl = pd.Series(pnl, name = 'pnl')
-        else:
-            sum_pnl = sum_pnl.add(pnl, fill_value = 0)
-        margin = pd.Series(pd.concat([xdf.pos*marginrate[0]*xdf.close, -xdf.pos*marginrate[1]*xdf.close], join='outer', axis=1).max(1), name='margin')
-        if len(sum_margin) == 0:
-            sum_margin = margin
+        if 'traded_price' in df.columns:
+            px = df['traded_price'].values.astype(float)
         else:
-            sum_margin = sum_margin.add( margin, fill_value = 0)
-        if len(sum_cost) == 0:
-            sum_cost = xdf['cost']
+            px = close
+        pnl = prev_pos * np.r_[0.0, np.diff(px)]
+        if 'closeout' in df.columns:
+            pnl = pnl + df['closeout'].values
+    if 'shift' in df.columns:
+        # streamed chunks are roll adjusted, the margin is on the traded contract price
+        close = close - df['shift'].values
+    margin = np.maximum(pos * marginrate[0] * close, -pos * marginrate[1] * close)
+    cost = df['cost'].values.astype(float)
+    # NaN bars (e.g. no traded price on the first bar) are skipped like in a pandas sum
+    pnl[np.isnan(pnl)] = 0.0
+    cost = np.where(np.isnan(cost), 0.0, cost)
+    return pnl, cost, margin
+
+def calc_pnl_stats(df_list, start_capital, marginrate, freq, pnl_mode = 'close'):
+    daily_list = []
+    for df in df_list:
+        pnl, cost, margin = sim_pnl_arrays(df, marginrate, pnl_mode)
+        if freq == 'm':
+            daily_list.append(daily_aggregate(df['date'].values, pnl, cost, margin, df['min_id'].values))
         else:
-            sum_cost = sum_cost.add(xdf['cost'], fill_value = 0)
-    if freq == 'm':
-        daily_pnl = pd.Series(sum_pnl.groupby(level=0).sum(), name = 'daily_pnl')
-        daily_margin = pd.Series(sum_margin.groupby(level=0).last(), name = 'daily_margin')
-        daily_cost = pd.Series(sum_cost.groupby(level=0).sum(), name = 'daily_cost')
+            if 'date' in df.columns:
+                dates = df['date'].values
+            else:
+                dates = df.index.values
+            daily_list.append((dates, pnl, cost, margin, None))
+    if len(daily_list) == 1:
+        days, daily_pnl, daily_cost, daily_margin, _ = daily_list[0]
     else:
-        daily_pnl = sum_pnl
-        daily_margin = sum_margin
-        daily_cost = sum_cost
-    daily_pnl.name = 'daily_pnl'
-    daily_margin.name = 'daily_margin'
-    daily_cost.name = 'daily_cost'
-    cum_pnl = pd.Series(daily_pnl.cumsum() + daily_cost.cumsum() + start_capital, name = 'cum_pnl')
+        # combine the per-contract results at daily level, days are sorted like a groupby
+        all_days = np.concatenate([d[0] for d in daily_list])
+        days, day_idx = np.unique(all_days, return_inverse = True)
+        all_margin = np.concatenate([d[3] for d in daily_list])
+        if freq == 'm':
+            # daily margin is taken at the last bar of the day across all the sims,
+            # sims which stopped earlier in that day do not contribute
+            last_bar = pd.Series(np.concatenate([d[4] for d in daily_list]))
+            day_last = last_bar.groupby(day_idx).transform('max').values
+            all_margin = np.where(last_bar.values == day_last, all_margin, 0.0)
+        daily_pnl = np.bincount(day_idx, weights = np.concatenate([d[1] for d in daily_list]), minlength = len(days))
+        daily_cost = np.bincount(day_idx, weights = np.concatenate([d[2] for d in daily_list]), minlength = len(days))
+        daily_margin = np.bincount(day_idx, weights = all_margin, minlength = len(days))
+    return daily_pnl_stats(days, daily_pnl, daily_cost, daily_margin, start_capital)
+
+def daily_pnl_stats(days, daily_pnl, daily_cost, daily_margin, start_capital):
+    cum_pnl = np.cumsum(daily_pnl) + np.cumsum(daily_cost) + start_capital
     available = cum_pnl - daily_margin
+    num_days = len(daily_pnl)
     res = {}
-    res['avg_pnl'] = float(daily_pnl.mean())
-    res['std_pnl'] = float(daily_pnl.std())
+    res['avg_pnl'] = float(daily_pnl.mean()) if num_days > 0 else np.nan
+    res['std_pnl'] = float(daily_pnl.std(ddof = 1)) if num_days > 1 else np.nan
     res['tot_pnl'] = float(daily_pnl.sum())
     res['tot_cost'] = float(daily_cost.sum())
-    res['num_days'] = len(daily_pnl)
-    res['max_margin'] = float(daily_margin.max())
-    res['min_avail'] = float(available.min())
+    res['num_days'] = num_days
+    res['max_margin'] = float(daily_margin.max()) if num_days > 0 else np.nan
+    res['min_avail'] = float(available.min()) if num_days > 0 else np.nan
     if res['std_pnl'] > 0:
         res['sharp_ratio'] = float(res['avg_pnl']/res['std_pnl']*np.sqrt(252.0))
-        max_dd, max_dur = max_drawdown(cum_pnl)
+        max_dd, max_dur = calc_max_drawdown(cum_pnl, days)
         res['max_drawdown'] =  float(max_dd)
         res['max_dd_period'] =  int(max_dur)
         if abs(max_dd) > 0:
@@ -398,42 +683,48 @@ def get_pnl_stats(df_list, start_capital, marginrate, freq):
         res['max_drawdown'] = 0
         res['max_dd_period'] = 0
         res['profit_dd_ratio'] = 0
-    ts = pd.concat([cum_pnl, daily_margin, daily_cost], join='outer', axis=1)
+    ts = pd.DataFrame({'cum_pnl': cum_pnl, 'daily_margin': daily_margin, 'daily_cost': daily_cost}, \
+                      index = pd.Index(days, name = 'date'), columns = ['cum_pnl', 'daily_margin', 'daily_cost'])
     return res, ts
 
-def get_trade_stats(trade_list):
+def ts_to_daily(ts, start_capital):
+    cum_pnl = ts['cum_pnl'].values.astype(float)
+    daily_cost = ts['daily_cost'].values.astype(float)
+    daily_pnl = np.diff(np.r_[start_capital, cum_pnl]) - daily_cost
+    return ts.index.values, daily_pnl, daily_cost, ts['daily_margin'].values.astype(float)
+
+def scenario_robustness(sim_config, ts, closed_trades, start_capital):
+    # same daily pnl series as sharp_ratio in the pnl stats
+    daily_pnl = ts_to_daily(ts, start_capital)[1]
+    profits = [tradepos.profit for tradepos in closed_trades]
+    return robustness.robustness_stats(daily_pnl, profits, n_samples = sim_config['robust_samples'], \
+                                       block_size = sim_config.get('robust_block', 10), \
+                                       min_prob = sim_config.get('robust_min_prob', 0.9), \
+                                       seed = sim_config.get('robust_seed', None))
+
+def get_pnl_stats(df_list, start_capital, marginrate, freq):
+    return calc_pnl_stats(df_list, start_capital, marginrate, freq, pnl_mode = 'close')
+
+def get_trade_stats(trade_list, zero_as_loss = False):
+    profits = np.array([trade.profit for trade in trade_list], dtype = float)
+    sorted_profit = np.sort(profits)
+    ntrades = len(profits)
     res = {}
-    res['n_trades'] = len(trade_list)
-    res['all_profit'] = float(sum([trade.profit for trade in trade_list]))
-    res['win_profit'] = float(sum([trade.profit for trade in trade_list if trade.profit>0]))
-    res['loss_profit'] = float(sum([trade.profit for trade in trade_list if trade.profit<=0]))
-    sorted_profit = sorted([trade.profit for trade in trade_list])
-    if len(sorted_profit)>5:
-        res['largest_profit'] = float(sorted_profit[-1])
-    else:
-        res['largest_profit'] = 0
-    if len(sorted_profit)>4:
-        res['second largest'] = float(sorted_profit[-2])
-    else:
-        res['second largest'] = 0
-    if len(sorted_profit) > 3:
-        res['third_profit'] = float(sorted_profit[-3])
-    else:
-        res['third_profit'] = 0
-    if len(sorted_profit) > 0:
-        res['largest_loss'] = float(sorted_profit[0])
-    else:
-        res['largest_loss'] = 0
-    if len(sorted_profit) > 1:
-        res['second_loss'] = float(sorted_profit[1])
+    res['n_trades'] = ntrades
+    res['all_profit'] = float(profits.sum())
+    res['win_profit'] = float(profits[profits > 0].sum())
+    res['loss_profit'] = float(profits[profits <= 0].sum())
+    res['largest_profit'] = float(sorted_profit[-1]) if ntrades > 5 else 0
+    res['second largest'] = float(sorted_profit[-2]) if ntrades > 4 else 0
+    res['third_profit'] = float(sorted_profit[-3]) if ntrades > 3 else 0
+    res['largest_loss'] = float(sorted_profit[0]) if ntrades > 0 else 0
+    res['second_loss'] = float(sorted_profit[1]) if ntrades > 1 else 0
+    res['third_loss'] = float(sorted_profit[2]) if ntrades > 2 else 0
+    res['num_win'] = int((profits > 0).sum())
+    if zero_as_loss:
+        res['num_loss'] = int((profits <= 0).sum())
     else:
-        res['second_loss'] = 0
-    if len(sorted_profit) > 2:
-        res['third_loss'] = float(sorted_profit[2])
-    else:
-        res['third_loss'] = 0
-    res['num_win'] = len([trade.profit for trade in trade_list if trade.profit>0])
-    res['num_loss'] = len([trade.profit for trade in trade_list if trade.profit<0])
+        res['num_loss'] = int((profits < 0).sum())
     res['win_ratio'] = 0
     if res['n_trades'] > 0:
         res['win_ratio'] = float(res['num_win'])/float(res['n_trades'])
@@ -455,32 +746,28 @@ def create_drawdowns(ts):
     Returns:
     drawdown, duration - Highest peak-to-trough drawdown and duration.
     """
-
-    # Calculate the cumulative returns curve 
-    # and set up the High Water Mark
-    # Then create the drawdown and duration series
-    ts_idx = ts.index
-    drawdown = pd.Series(index = ts_idx)
-    duration = pd.Series(index = ts_idx)
-    hwm = pd.Series([0]*len(ts), index = ts_idx)
-    last_t = ts_idx[0]
-    # Loop over the index range
-    for idx, t in enumerate(ts_idx):
-        if idx > 0:
-            cur_hwm = max(hwm[last_t], ts_idx[idx])
-            hwm[t] = cur_hwm
-            drawdown[t]= hwm[t] - ts[t]
-            duration[t]= 0 if drawdown[t] == 0 else duration[last_t] + 1
-        last_t = t
+    values = np.asarray(ts, dtype = float)
+    if len(values) == 0:
+        return 0.0, 0
+    hwm = np.maximum.accumulate(values)
+    drawdown = hwm - values
+    # duration counts the bars since the last time the curve was at its high water mark
+    bar_idx = np.arange(len(values))
+    last_high = np.maximum.accumulate(np.where(drawdown == 0, bar_idx, 0))
+    duration = bar_idx - last_high
     return drawdown.max(), duration.max()
 
-def max_drawdown(ts):
-    i = np.argmax(np.maximum.accumulate(ts)-ts)
-    j = np.argmax(ts[:i])
-    max_dd = ts[i] - ts[j]
-    max_duration = (i - j).days
+def calc_max_drawdown(values, dates):
+    values = np.asarray(values, dtype = float)
+    i = np.argmax(np.maximum.accumulate(values) - values)
+    j = np.argmax(values[:(i+1)])
+    max_dd = values[i] - values[j]
+    max_duration = pd.Timedelta(dates[i] - dates[j]).days
     return max_dd, max_duration
 
+def max_drawdown(ts):
+    return calc_max_drawdown(ts.values, ts.index)
+
 def simnearby_min(config_file):
     sim_config = {}
     with open(config_file, 'r') as fp:
@@ -489,6 +776,12 @@ def simnearby_min(config_file):
     run_sim = __import__('.'.join(bktest_split[:-1]))
     for i in range(1, len(bktest_split)):
         run_sim = getattr(run_sim, bktest_split[i])
+    vec_sim = None
+    if 'vec_sim_func' in sim_config:
+        bktest_split = sim_config['vec_sim_func'].split('.')
+        vec_sim = __import__('.'.join(bktest_split[:-1]))
+        for i in range(1, len(bktest_split)):
+            vec_sim = getattr(vec_sim, bktest_split[i])
     dir_name = config_file.split('.')[0]
     dir_name = dir_name.split(os.path.sep)[-1]
     test_folder = get_bktest_folder()
@@ -518,6 +811,9 @@ def simnearby_min(config_file):
     if 'close_daily' in config and config['close_daily']:
         file_prefix = file_prefix + 'daily_'
     config['file_prefix'] = file_prefix
+    if sim_config.get('use_ind_cache', True):
+        config['ind_cache'] = dh.IndicatorCache(folder = sim_config.get('ind_cache_folder', None))
+    store_file = sim_config.get('result_store', None)
     summary_df = pd.DataFrame()
     fname = config['file_prefix'] + 'summary.csv'
     if os.path.isfile(fname):
@@ -561,21 +857,23 @@ def simnearby_min(config_file):
             if nearby > 0:
                 mdf = misc.nearby(asset, nearby, start_date, end_date, rollrule, 'm', need_shift=True, database = 'hist_data')
             mdf = cleanup_mindata(mdf, asset)
+            if config.get('ind_cache', None) != None:
+                config['ind_cache'].set_base(mdf)
             if need_daily:
                 ddf = misc.nearby(asset, nearby, start_date, end_date, rollrule, 'd', need_shift=True, database = 'hist_data')
                 config['ddf'] = ddf
-            for ix, s in enumerate(scenarios):
+            scen_list = [ix for ix in range(len(scenarios)) \
+                         if not (os.path.isfile(file_prefix + str(ix) + '_trades.csv') and \
+                                 os.path.isfile(file_prefix + str(ix) + '_dailydata.csv'))]
+            for ix, df, closed_trades in run_scenarios(run_sim, vec_sim, mdf, config, sim_config, scenarios, scen_list):
+                s = scenarios[ix]
                 fname1 = file_prefix + str(ix) + '_trades.csv'
                 fname2 = file_prefix + str(ix) + '_dailydata.csv'
-                if os.path.isfile(fname1) and os.path.isfile(fname2):
-                    continue
-                for key, seq in zip(sim_config['scen_keys'], s):
-                    config[key] = sim_config[key][seq]
-                df = mdf.copy(deep = True)
-                df, closed_trades = run_sim( df, config)
                 (res_pnl, ts) = get_pnl_stats( [df], config['capital'], config['marginrate'], 'm')
                 res_trade = get_trade_stats( closed_trades )
                 res = dict( res_pnl.items() + res_trade.items())
+                if sim_config.get('robust_samples', 0) > 0:
+                    res.update(scenario_robustness(sim_config, ts, closed_trades, config['capital']))
                 res.update(dict(zip(sim_config['scen_keys'], s)))
                 res['asset'] = asset
                 output[ix] = res
@@ -586,6 +884,11 @@ def simnearby_min(config_file):
                 trades = pd.DataFrame.from_dict(all_trades).T
                 trades.to_csv(fname1)
                 ts.to_csv(fname2)
+                if store_file != None:
+                    params = dict([(key, (seq, sim_config[key][seq])) for key, seq in zip(sim_config['scen_keys'], s)])
+                    with result_store.ResultStore(store_file) as store:
+                        store.add_run(result_store.strategy_name(run_sim), sim_config['sim_name'], asset, ix, params, res, ts, \
+                                      [all_trades[i] for i in range(len(closed_trades))])
                 fname = file_prefix + 'stats.json'
                 with open(fname, 'w') as ofile:
                     json.dump(output, ofile)
@@ -648,6 +951,8 @@ def simcontract_min(config_file):
     if 'close_daily' in config and config['close_daily']:
         file_prefix = file_prefix + 'daily_'
     config['file_prefix'] = file_prefix
+    if sim_config.get('use_ind_cache', True):
+        config['ind_cache'] = dh.IndicatorCache(folder = sim_config.get('ind_cache_folder', None))
     summary_df = pd.DataFrame()
     fname = config['file_prefix'] + 'summary.csv'
     if os.path.isfile(fname):
@@ -854,8 +1159,12 @@ class BacktestManager(object):
         for i in range(1, len(bktest_split)):
             sim_class = getattr(sim_class, bktest_split[i])
         self.sim_class = sim_class
+        self.sim_config = sim_config
+        self.config_file = config_file
         self.sim_func = sim_config['sim_func']
         self.need_shift = sim_config.get('need_shift', True)
+        self.stream_chunk = sim_config.get('stream_chunk', None)
+        self.stream_warmup = sim_config.get('stream_warmup', 1000)
         dir_name = config_file.split('.')[0]
         dir_name = dir_name.split(os.path.sep)[-1]
         test_folder = self.get_bktest_folder()
@@ -889,6 +1198,12 @@ class BacktestManager(object):
             self.config['proc_func'] = eval(sim_config['proc_func'])
         self.file_prefix = file_prefix + sim_config['sim_name']
         self.start_capital = self.config['capital']
+        if sim_config.get('use_ind_cache', True):
+            self.ind_cache = dh.IndicatorCache(folder = sim_config.get('ind_cache_folder', None))
+        else:
+            self.ind_cache = None
+        self.config['ind_cache'] = self.ind_cache
+        self.result_store_file = sim_config.get('result_store', None)
         self.min_data = {}
         self.contlist = {}
         self.exp_dates = {}
@@ -957,6 +1272,11 @@ class BacktestManager(object):
         return output
 
     def load_data(self, idx):
+        if self.ind_cache != None:
+            self.ind_cache.clear()
+        if self.stream_chunk != None:
+            # data is loaded chunk by chunk in run_scenario
+            return
         asset = self.sim_assets[idx]
         for prod in asset:
             mdf = misc.nearby(prod, self.config['nearby'], self.config['start_date'], self.config['end_date'],
@@ -972,121 +1292,56 @@ class BacktestManager(object):
     def prepare_data(self, asset_idx, cont_idx = 0):
         asset = self.sim_assets[asset_idx]
         self.config['mdf'] = self.min_data[asset[0]]
+        if self.ind_cache != None:
+            self.ind_cache.set_base(self.config['mdf'])
 
     def get_pnl_stats(self, df_list, marginrate, freq):
-        sum_pnl = pd.Series(name='pnl')
-        sum_margin = pd.Series(name='margin')
-        sum_cost = pd.Series(name='cost')
-        if freq == 'm':
-            index_col = ['date', 'min_id']
-        else:
-            index_col = ['date']
-        for df in df_list:
-            xdf = df.reset_index().set_index(index_col)
-            if 'traded_price' in xdf.columns:
-                field = 'traded_price'
-            else:
-                field  = 'close'
-            pnl = xdf['pos'].shift(1).fillna(0.0) * (xdf[field] - xdf[field].shift(1)).fillna(0.0)
-            if 'closeout' in xdf.columns:
-                pnl = pnl + xdf['closeout']
-            # pnl = pnl + (xdf['pos'] - xdf['pos'].shift(1).fillna(0.0)) * (xdf['close'] - xdf['traded_price'])
-            if len(sum_pnl) == 0:
-                sum_pnl = pd.Series(pnl, name='pnl')
-            else:
-                sum_pnl = sum_pnl.add(pnl, fill_value=0)
-            margin = pd.Series(
-                pd.concat([xdf.pos * marginrate[0] * xdf.close, -xdf.pos * marginrate[1] * xdf.close], join='outer',
-                          axis=1).max(1), name='margin')
-            if len(sum_margin) == 0:
-                sum_margin = margin
-            else:
-                sum_margin = sum_margin.add(margin, fill_value=0)
-            if len(sum_cost) == 0:
-                sum_cost = xdf['cost']
-            else:
-                sum_cost = sum_cost.add(xdf['cost'], fill_value=0)
-        if freq == 'm':
-            daily_pnl = pd.Series(sum_pnl.groupby(level=0).sum(), name='daily_pnl')
-            daily_margin = pd.Series(sum_margin.groupby(level=0).last(), name='daily_margin')
-            daily_cost = pd.Series(sum_cost.groupby(level=0).sum(), name='daily_cost')
-        else:
-            daily_pnl = sum_pnl
-            daily_margin = sum_margin
-            daily_cost = sum_cost
-        daily_pnl.name = 'daily_pnl'
-        daily_margin.name = 'daily_margin'
-        daily_cost.name = 'daily_cost'
-        cum_pnl = pd.Series(daily_pnl.cumsum() + daily_cost.cumsum() + self.start_capital, name='cum_pnl')
-        available = cum_pnl - daily_margin
-        res = {}
-        res['avg_pnl'] = float(daily_pnl.mean())
-        res['std_pnl'] = float(daily_pnl.std())
-        res['tot_pnl'] = float(daily_pnl.sum())
-        res['tot_cost'] = float(daily_cost.sum())
-        res['num_days'] = len(daily_pnl)
-        res['max_margin'] = float(daily_margin.max())
-        res['min_avail'] = float(available.min())
-        if res['std_pnl'] > 0:
-            res['sharp_ratio'] = float(res['avg_pnl'] / res['std_pnl'] * np.sqrt(252.0))
-            max_dd, max_dur = max_drawdown(cum_pnl)
-            res['max_drawdown'] = float(max_dd)
-            res['max_dd_period'] = int(max_dur)
-            if abs(max_dd) > 0:
-                res['profit_dd_ratio'] = float(res['tot_pnl'] / abs(max_dd))
-            else:
-                res['profit_dd_ratio'] = 0
-        else:
-            res['sharp_ratio'] = 0
-            res['max_drawdown'] = 0
-            res['max_dd_period'] = 0
-            res['profit_dd_ratio'] = 0
-        ts = pd.concat([cum_pnl, daily_margin, daily_cost], join='outer', axis=1)
-        return res, ts
+        return calc_pnl_stats(df_list, self.start_capital, marginrate, freq, pnl_mode = 'traded')
 
     def get_trade_stats(self, trade_list):
-        res = {}
-        res['n_trades'] = len(trade_list)
-        res['all_profit'] = float(sum([trade.profit for trade in trade_list]))
-        res['win_profit'] = float(sum([trade.profit for trade in trade_list if trade.profit > 0]))
-        res['loss_profit'] = float(sum([trade.profit for trade in trade_list if trade.profit <= 0]))
-        sorted_profit = sorted([trade.profit for trade in trade_list])
-        if len(sorted_profit) > 5:
-            res['largest_profit'] = float(sorted_profit[-1])
-        else:
-            res['largest_profit'] = 0
-        if len(sorted_profit) > 4:
-            res['second largest'] = float(sorted_profit[-2])
-        else:
-            res['second largest'] = 0
-        if len(sorted_profit) > 3:
-            res['third_profit'] = float(sorted_profit[-3])
-        else:
-            res['third_profit'] = 0
-        if len(sorted_profit) > 0:
-            res['largest_loss'] = float(sorted_profit[0])
-        else:
-            res['largest_loss'] = 0
-        if len(sorted_profit) > 1:
-            res['second_loss'] = float(sorted_profit[1])
-        else:
-            res['second_loss'] = 0
-        if len(sorted_profit) > 2:
-            res['third_loss'] = float(sorted_profit[2])
+        return get_trade_stats(trade_list, zero_as_loss = True)
+
+    def run_scenario(self, idx, ix, s, output):
+        asset = self.sim_assets[idx]
+        file_prefix = self.file_prefix + '_' + '_'.join([self.sim_mode] + asset)
+        fname1 = file_prefix + '_'+ str(ix) + '_trades.csv'
+        fname2 = file_prefix + '_'+ str(ix) + '_dailydata.csv'
+        for key, seq in zip(self.scen_keys, s):
+            self.config[key] = self.scen_param[key][seq]
+        if self.stream_chunk != None:
+            chunks = prefetch(nearby_chunks(asset[0], self.config, self.stream_chunk, self.need_shift))
+            self.config['mdf'] = next(chunks)
+            sim_strat = self.sim_class(self.config)
+            sim_df, closed_trades = sim_strat.run_stream_sim(chunks, warmup = self.stream_warmup)
         else:
-            res['third_loss'] = 0
-        res['num_win'] = len([trade.profit for trade in trade_list if trade.profit > 0])
-        res['num_loss'] = len([trade.profit for trade in trade_list if trade.profit <= 0])
-        res['win_ratio'] = 0
-        if res['n_trades'] > 0:
-            res['win_ratio'] = float(res['num_win']) / float(res['n_trades'])
-        res['profit_per_win'] = 0
-        if res['num_win'] > 0:
-            res['profit_per_win'] = float(res['win_profit'] / float(res['num_win']))
-        res['profit_per_loss'] = 0
-        if res['num_loss'] > 0:
-            res['profit_per_loss'] = float(res['loss_profit'] / float(res['num_loss']))
-        return res
+            self.prepare_data(idx, cont_idx = 0)
+            sim_strat = self.sim_class(self.config)
+            sim_df, closed_trades = getattr(sim_strat, self.sim_func)()
+        (res_pnl, ts) = self.get_pnl_stats( [sim_df], self.config['marginrate'], 'm')
+        res_trade = self.get_trade_stats(closed_trades)
+        res = dict( res_pnl.items() + res_trade.items())
+        if self.sim_config.get('robust_samples', 0) > 0:
+            res.update(scenario_robustness(self.sim_config, ts, closed_trades, self.start_capital))
+        res.update(dict(zip(self.scen_keys, s)))
+        res['asset'] = '_'.join(asset)
+        output[ix] = res
+        print 'saving results for asset = %s, scen = %s' % (asset, str(ix))
+        all_trades = {}
+        for i, tradepos in enumerate(closed_trades):
+            all_trades[i] = strat.tradepos2dict(tradepos)
+        trades = pd.DataFrame.from_dict(all_trades).T
+        trades.to_csv(fname1)
+        ts.to_csv(fname2)
+        if self.result_store_file != None:
+            params = dict([(key, (seq, self.scen_param[key][seq])) for key, seq in zip(self.scen_keys, s)])
+            # opened per run so no connection is left open, or held across the worker processes
+            with result_store.ResultStore(self.result_store_file) as store:
+                store.add_run(result_store.strategy_name(self.sim_class), self.sim_config['sim_name'], '_'.join(asset), \
+                              ix, params, res, ts, [all_trades[i] for i in range(len(closed_trades))])
+        fname = file_prefix + '_stats.json'
+        with open(fname, 'w') as ofile:
+            json.dump(output, ofile)
+        return res, ts
 
     def run_all_assets(self):
         self.restart()
@@ -1099,48 +1354,30 @@ class BacktestManager(object):
             for ix, s in enumerate(self.scenarios):
                 if str(ix) in output:
                     continue
-                file_prefix = self.file_prefix + '_' + '_'.join([self.sim_mode] + asset)
-                fname1 = file_prefix + '_'+ str(ix) + '_trades.csv'
-                fname2 = file_prefix + '_'+ str(ix) + '_dailydata.csv'
-                for key, seq in zip(self.scen_keys, s):
-                    self.config[key] = self.scen_param[key][seq]
-                self.prepare_data(idx, cont_idx = 0)
-                sim_strat = self.sim_class(self.config)
-                sim_df, closed_trades = getattr(sim_strat, self.sim_func)()
-                (res_pnl, ts) = self.get_pnl_stats( [sim_df], self.config['marginrate'], 'm')
-                res_trade = self.get_trade_stats(closed_trades)
-                res = dict( res_pnl.items() + res_trade.items())
-                res.update(dict(zip(self.scen_keys, s)))
-                res['asset'] = '_'.join(asset)
-                output[ix] = res
-                print 'saving results for asset = %s, scen = %s' % (asset, str(ix))
-                all_trades = {}
-                for i, tradepos in enumerate(closed_trades):
-                    all_trades[i] = strat.tradepos2dict(tradepos)
-                trades = pd.DataFrame.from_dict(all_trades).T
-                trades.to_csv(fname1)
-                ts.to_csv(fname2)
-                fname = file_prefix + '_stats.json'
-                with open(fname, 'w') as ofile:
-                    json.dump(output, ofile)
-            res = pd.DataFrame.from_dict(output, orient = 'index')
-            res.index.name = 'scenario'
-            res = res.sort_values(by = ['sharp_ratio'], ascending=False)
-            res = res.reset_index()
-            res.set_index(['asset', 'scenario'])
-            out_res = res[self.output_columns()]
-            if len(self.summary_df)==0:
-                self.summary_df = out_res[:30].copy(deep = True)
-            else:
-                self.summary_df = self.summary_df.append(out_res[:30])
-            fname = self.file_prefix + 'summary.csv'
-            self.summary_df.to_csv(fname)
+                self.run_scenario(idx, ix, s, output)
+            self.update_summary(output)
+
+    def update_summary(self, output):
+        res = pd.DataFrame.from_dict(output, orient = 'index')
+        res.index.name = 'scenario'
+        res = res.sort_values(by = ['sharp_ratio'], ascending=False)
+        res = res.reset_index()
+        res.set_index(['asset', 'scenario'])
+        out_res = res[self.output_columns()]
+        if len(self.summary_df)==0:
+            self.summary_df = out_res[:30].copy(deep = True)
+        else:
+            self.summary_df = self.summary_df.append(out_res[:30])
+        fname = self.file_prefix + 'summary.csv'
+        self.summary_df.to_csv(fname)
 
 class ContBktestManager(BacktestManager):
     def __init__(self, config_file):
         super(ContBktestManager, self).__init__(config_file)
 
     def load_data(self, assets):
+        if self.ind_cache != None:
+            self.ind_cache.clear()
         contlist = {}
         exp_dates = {}
         for i, prod in enumerate(assets):
@@ -1199,6 +1436,8 @@ class ContBktestManager(BacktestManager):
                 mdf.columns = ['open', 'high', 'low', 'close'] + col_list
                 mdf['contract'] = cont
         self.config['mdf'] = mdf
+        if self.ind_cache != None:
+            self.ind_cache.set_base(mdf)
 
     def run_all_assets(self):
         summary_df = pd.DataFrame()
@@ -1275,6 +1514,139 @@ class ContBktestManager(BacktestManager):
             fname = self.file_prefix + 'summary.csv'
             summary_df.to_csv(fname)
 
+def wf_folds(start_date, end_date, train_period, test_period, step_period = None, anchored = False):
+    if step_period == None:
+        step_period = test_period
+    folds = []
+    train_start = start_date
+    train_end = misc.day_shift(start_date, train_period)
+    last_end = None
+    while train_end < end_date:
+        test_end = min(misc.day_shift(train_end, test_period), end_date)
+        # a step shorter than the test period overlaps the test windows, start after the last one so no day is counted twice
+        test_start = train_end if last_end == None else max(train_end, last_end)
+        if test_start < test_end:
+            folds.append((train_start, train_end, test_start, test_end))
+            last_end = test_end
+        train_end = misc.day_shift(train_end, step_period)
+        if not anchored:
+            train_start = misc.day_shift(train_start, step_period)
+    return folds
+
+def slice_daily(daily, start, end):
+    days = daily[0]
+    sidx = np.searchsorted(days, np.datetime64(pd.Timestamp(start)), side = 'left')
+    eidx = np.searchsorted(days, np.datetime64(pd.Timestamp(end)), side = 'left')
+    return [x[sidx:eidx] for x in daily]
+
+def run_wf_asset(args):
+    config_file, idx = args
+    wf_sim = WalkForwardManager(config_file)
+    return wf_sim.run_asset(idx)
+
+class WalkForwardManager(BacktestManager):
+    def __init__(self, config_file):
+        super(WalkForwardManager, self).__init__(config_file)
+        self.wf_train = self.sim_config.get('wf_train', '12m')
+        self.wf_test = self.sim_config.get('wf_test', '3m')
+        self.wf_step = self.sim_config.get('wf_step', self.wf_test)
+        self.wf_anchored = self.sim_config.get('wf_anchored', False)
+        self.wf_objective = self.sim_config.get('wf_objective', 'sharp_ratio')
+        self.wf_min_days = self.sim_config.get('wf_min_days', 20)
+        self.wf_stale = self.sim_config.get('wf_stale', '-10b')
+        self.wf_processes = self.sim_config.get('wf_processes', 1)
+
+    def objective(self, daily):
+        res, _ = daily_pnl_stats(daily[0], daily[1], daily[2], daily[3], self.start_capital)
+        if res['num_days'] < self.wf_min_days:
+            return np.nan, res
+        return res[self.wf_objective], res
+
+    def load_scenario_daily(self, idx, ix):
+        asset = self.sim_assets[idx]
+        file_prefix = self.file_prefix + '_' + '_'.join([self.sim_mode] + asset)
+        fname = file_prefix + '_'+ str(ix) + '_dailydata.csv'
+        if not os.path.isfile(fname):
+            return None
+        ts = pd.read_csv(fname, index_col = 0, parse_dates = True)
+        if (len(ts) == 0) or (ts.index[-1].date() < misc.day_shift(self.config['end_date'], self.wf_stale)):
+            return None
+        return ts
+
+    def scenario_dailys(self, idx):
+        output = self.load_curr_results(idx)
+        dailys = {}
+        data_loaded = False
+        for ix, s in enumerate(self.scenarios):
+            ts = self.load_scenario_daily(idx, ix)
+            if ts is None:
+                if not data_loaded:
+                    self.load_data(idx)
+                    data_loaded = True
+                _, ts = self.run_scenario(idx, ix, s, output)
+            days, daily_pnl, daily_cost, daily_margin = ts_to_daily(ts, self.start_capital)
+            dailys[ix] = [pd.to_datetime(days).values, daily_pnl, daily_cost, daily_margin]
+        return dailys
+
+    def run_asset(self, idx):
+        asset = self.sim_assets[idx]
+        self.set_config(idx)
+        dailys = self.scenario_dailys(idx)
+        folds = wf_folds(self.config['start_date'], self.config['end_date'], \
+                         self.wf_train, self.wf_test, self.wf_step, self.wf_anchored)
+        fold_res = []
+        oos_list = []
+        for train_start, train_end, test_start, test_end in folds:
+            best_ix = None
+            best_score = np.nan
+            for ix in range(len(self.scenarios)):
+                score, _ = self.objective(slice_daily(dailys[ix], train_start, train_end))
+                if np.isnan(score):
+                    continue
+                if (best_ix == None) or (score > best_score):
+                    best_ix = ix
+                    best_score = score
+            if best_ix == None:
+                continue
+            oos = slice_daily(dailys[best_ix], test_start, test_end)
+            if len(oos[0]) == 0:
+                continue
+            oos_list.append(oos)
+            res, _ = daily_pnl_stats(oos[0], oos[1], oos[2], oos[3], self.start_capital)
+            row = {'train_start': train_start, 'train_end': train_end, 'test_start': test_start, \
+                   'test_end': test_end, 'scenario': best_ix, 'is_objective': best_score, \
+                   'oos_objective': res[self.wf_objective], 'oos_pnl': res['tot_pnl'], \
+                   'oos_sharp_ratio': res['sharp_ratio'], 'oos_max_drawdown': res['max_drawdown']}
+            row.update(dict([(key, self.scen_param[key][seq]) for key, seq in zip(self.scen_keys, self.scenarios[best_ix])]))
+            fold_res.append(row)
+        file_prefix = self.file_prefix + '_' + '_'.join([self.sim_mode] + asset)
+        fold_df = pd.DataFrame(fold_res)
+        fold_df.to_csv(file_prefix + '_wf_folds.csv')
+        if len(oos_list) == 0:
+            return {}
+        oos = [np.concatenate([x[i] for x in oos_list]) for i in range(4)]
+        res, ts = daily_pnl_stats(oos[0], oos[1], oos[2], oos[3], self.start_capital)
+        res['asset'] = '_'.join(asset)
+        res['num_folds'] = len(oos_list)
+        ts.to_csv(file_prefix + '_wf_dailydata.csv')
+        with open(file_prefix + '_wf_stats.json', 'w') as ofile:
+            json.dump(res, ofile)
+        print 'walk forward for asset = %s, folds = %s, oos sharp = %s' % (asset, len(oos_list), res['sharp_ratio'])
+        return res
+
+    def run_all_assets(self):
+        if self.wf_processes > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(self.wf_processes)
+            output = pool.map(run_wf_asset, [(self.config_file, idx) for idx in range(len(self.sim_assets))])
+            pool.close()
+            pool.join()
+        else:
+            output = [self.run_asset(idx) for idx in range(len(self.sim_assets))]
+        summary_df = pd.DataFrame([res for res in output if len(res) > 0])
+        summary_df.to_csv(self.file_prefix + 'wf_summary.csv')
+        return summary_df
+
 if __name__=="__main__":
     args = sys.argv[1:]
     if len(args) < 2:
@@ -1291,3 +1663,6 @@ if __name__=="__main__":
             simnearby_min(args[1])
         elif mode == 3:
             simcontract_min(args[1])
+        elif mode == 4:
+            bktest_sim = WalkForwardManager(args[1])
+            bktest_sim.run_all_assets()
@@ -11,6 +11,8 @@ import datetime
 from backtest import *
 
 class BBTrailStop(StratSim):
+    fast_loop = True
+
     def __init__(self, config):
         super(BBTrailStop, self).__init__(config)
 
@@ -72,6 +74,9 @@ class BBTrailStop(StratSim):
         return np.isnan(sim_data['band_up'][n]) or np.isnan(sim_data['chan_h'][n]) or np.isnan(sim_data['chan_l'][n])
         # or (sim_data['date'][n] != sim_data['date'][n + 1])
 
+    def data_invalid_mask(self, sim_data):
+        return np.isnan(sim_data['band_up']) | np.isnan(sim_data['chan_h']) | np.isnan(sim_data['chan_l'])
+
     def get_tradepos_exit(self, tradepos, sim_data, n):
         gap = (int((self.SL * sim_data['band_wth'][n-1]) / float(self.tick_base)) + 1) * float(self.tick_base)
         return gap
@@ -38,6 +38,7 @@ class DTChanSim(StratSim):
         self.SL = config['stoploss']
         self.min_rng = config['min_range']
         self.chan = config['chan']
+        self.ind_cache = config.get('ind_cache', None)
         self.machan = config['machan']
         self.use_chan = config['use_chan']
         self.no_trade_set = config['no_trade_set']
@@ -48,25 +49,25 @@ class DTChanSim(StratSim):
         self.combo_signal = config.get('combo', True)
      
     def process_data(self, mdf):
-        xdf = self.proc_func(mdf, **self.proc_args)
+        xdf = dh.cached_ind(self.ind_cache, self.proc_func, mdf, **self.proc_args)
         if self.win == -1:
             tr= pd.concat([xdf.high - xdf.low, abs(xdf.close - xdf.close.shift(1))],
                            join='outer', axis=1).max(axis=1)
         elif self.win == 0:
-            tr = pd.concat([(pd.rolling_max(xdf.high, 2) - pd.rolling_min(xdf.close, 2))*self.multiplier,
-                            (pd.rolling_max(xdf.close, 2) - pd.rolling_min(xdf.low, 2))*self.multiplier,
+            tr = pd.concat([(dh.rolling_max(xdf.high, 2) - dh.rolling_min(xdf.close, 2))*self.multiplier,
+                            (dh.rolling_max(xdf.close, 2) - dh.rolling_min(xdf.low, 2))*self.multiplier,
                             xdf.high - xdf.close,
                             xdf.close - xdf.low],
                             join='outer', axis=1).max(axis=1)
         else:
-            tr= pd.concat([pd.rolling_max(xdf.high, self.win) - pd.rolling_min(xdf.close, self.win),
-                           pd.rolling_max(xdf.close, self.win) - pd.rolling_min(xdf.low, self.win)],
+            tr= pd.concat([dh.rolling_max(xdf.high, self.win) - dh.rolling_min(xdf.close, self.win),
+                           dh.rolling_max(xdf.close, self.win) - dh.rolling_min(xdf.low, self.win)],
                            join='outer', axis=1).max(axis=1)
         xdf['TR'] = tr
-        xdf['chanh'] = self.chan_high(xdf['high'], self.chan, **self.chan_func['high']['args'])
-        xdf['chanl'] = self.chan_low(xdf['low'], self.chan, **self.chan_func['low']['args'])
-        xdf['ATR'] = dh.ATR(xdf, n = self.atr_len)
-        xdf['MA'] = dh.MA(xdf, n=self.atr_len, field = 'close')
+        xdf['chanh'] = dh.cached_ind(self.ind_cache, self.chan_high, xdf['high'], self.chan, **self.chan_func['high']['args'])
+        xdf['chanl'] = dh.cached_ind(self.ind_cache, self.chan_low, xdf['low'], self.chan, **self.chan_func['low']['args'])
+        xdf['ATR'] = dh.cached_ind(self.ind_cache, dh.ATR, xdf, n = self.atr_len)
+        xdf['MA'] = dh.cached_ind(self.ind_cache, dh.MA, xdf, n = self.atr_len, field = 'close')
         xdata = pd.concat([xdf['TR'].shift(1), xdf['MA'].shift(1), xdf['ATR'].shift(1),
                            xdf['chanh'].shift(1), xdf['chanl'].shift(1),
                            xdf['open']], axis=1, keys=['tr','ma', 'atr', 'chanh', 'chanl', 'dopen']).fillna(0)
@@ -82,14 +83,14 @@ class DTChanSim(StratSim):
             tr= pd.concat([xdf.high - xdf.low, abs(xdf.close - xdf.close.shift(1))], 
                           join='outer', axis=1).max(axis=1)
         elif self.win == 0:
-            tr = pd.concat([(pd.rolling_max(xdf.high, 2) - pd.rolling_min(xdf.close, 2)) * self.multiplier, 
-                            (pd.rolling_max(xdf.close, 2) - pd.rolling_min(xdf.low, 2)) * self.multiplier,
+            tr = pd.concat([(dh.rolling_max(xdf.high, 2) - dh.rolling_min(xdf.close, 2)) * self.multiplier, 
+                            (dh.rolling_max(xdf.close, 2) - dh.rolling_min(xdf.low, 2)) * self.multiplier,
                             xdf.high - xdf.close, 
                             xdf.close - xdf.low], 
                             join='outer', axis=1).max(axis=1)
         else:
-            tr= pd.concat([pd.rolling_max(xdf.high, self.win) - pd.rolling_min(xdf.close, self.win), 
-                            pd.rolling_max(xdf.close, self.win) - pd.rolling_min(xdf.low, self.win)], 
+            tr= pd.concat([dh.rolling_max(xdf.high, self.win) - dh.rolling_min(xdf.close, self.win), 
+                            dh.rolling_max(xdf.close, self.win) - dh.rolling_min(xdf.low, self.win)], 
                             join='outer', axis=1).max(axis=1)
         xdf['tr'] = tr
         xdf['chan_h'] = self.chan_high(xdf, self.chan, **self.chan_func['high']['args'])
@@ -161,8 +162,8 @@ def gen_config_file(filename):
     sim_config['pos_class'] = 'strat.TradePos'
     sim_config['proc_func'] = 'dh.day_split'
     sim_config['offset']    = 1
-    chan_func = {'high': {'func': 'pd.rolling_max', 'args':{}},
-                 'low':  {'func': 'pd.rolling_min', 'args':{}},
+    chan_func = {'high': {'func': 'dh.rolling_max', 'args':{}},
+                 'low':  {'func': 'dh.rolling_min', 'args':{}},
                  }
     config = {'capital': 10000,              
               'use_chan': True,
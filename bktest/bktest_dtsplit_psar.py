@@ -11,6 +11,8 @@ import datetime
 from backtest import *
 
 class DTStopSim(StratSim):
+    fast_loop = True
+
     def __init__(self, config):
         super(DTStopSim, self).__init__(config)
 
@@ -37,6 +39,7 @@ class DTStopSim(StratSim):
         self.SL = config['stoploss']
         self.min_rng = config['min_range']
         self.chan = config['chan']
+        self.ind_cache = config.get('ind_cache', None)
         self.use_chan = config['use_chan']
         self.no_trade_set = config['no_trade_set']
         self.pos_freq = config.get('pos_freq', 1)
@@ -45,7 +48,7 @@ class DTStopSim(StratSim):
         self.sell_trig = 0.0
      
     def process_data(self, mdf):
-        xdf = self.proc_func(mdf, **self.proc_args)
+        xdf = dh.cached_ind(self.ind_cache, self.proc_func, mdf, **self.proc_args)
         if self.win == -1:
             tr= pd.concat([xdf.high - xdf.low, abs(xdf.close - xdf.close.shift(1))],
                            join='outer', axis=1).max(axis=1)
@@ -60,10 +63,10 @@ class DTStopSim(StratSim):
                            pd.rolling_max(xdf.close, self.win) - pd.rolling_min(xdf.low, self.win)],
                            join='outer', axis=1).max(axis=1)
         xdf['TR'] = tr
-        xdf['chanh'] = self.chan_high(xdf['high'], self.chan, **self.chan_func['high']['args'])
-        xdf['chanl'] = self.chan_low(xdf['low'], self.chan, **self.chan_func['low']['args'])
-        xdf['ATR'] = dh.ATR(xdf, n = self.atr_len)
-        xdf['MA'] = dh.MA(xdf, n=self.atr_len, field = 'close')
+        xdf['chanh'] = dh.cached_ind(self.ind_cache, self.chan_high, xdf['high'], self.chan, **self.chan_func['high']['args'])
+        xdf['chanl'] = dh.cached_ind(self.ind_cache, self.chan_low, xdf['low'], self.chan, **self.chan_func['low']['args'])
+        xdf['ATR'] = dh.cached_ind(self.ind_cache, dh.ATR, xdf, n = self.atr_len)
+        xdf['MA'] = dh.cached_ind(self.ind_cache, dh.MA, xdf, n = self.atr_len, field = 'close')
         xdata = pd.concat([xdf['TR'].shift(1), xdf['MA'].shift(1), xdf['ATR'].shift(1),
                            xdf['chanh'].shift(1), xdf['chanl'].shift(1),
                            xdf['open']], axis=1, keys=['tr','ma', 'atr', 'chanh', 'chanl', 'dopen']).fillna(0)
@@ -87,6 +90,11 @@ class DTStopSim(StratSim):
         return (sim_data['ma'][n] == 0) or (sim_data['chanh'][n] == 0) or (sim_data['dopen'][n] == 0) \
                or (sim_data['date'][n] != sim_data['date'][n + 1])
 
+    def data_invalid_mask(self, sim_data):
+        day_end = np.ones(len(sim_data), dtype = bool)
+        day_end[:-1] = (sim_data['date'][:-1] != sim_data['date'][1:])
+        return (sim_data['ma'] == 0) | (sim_data['chanh'] == 0) | (sim_data['dopen'] == 0) | day_end
+
     def get_tradepos_exit(self, tradepos, sim_data, n):
         return self.SL * sim_data['atr'][n]
 
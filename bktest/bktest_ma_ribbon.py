@@ -24,6 +24,7 @@ class MARibbonSim(StratSim):
         self.pval_entry = config['param'][2]
         self.pval_exit = config['param'][3]
         self.ma_list = config['ma_list']
+        self.ind_cache = config.get('ind_cache', None)
         self.pos_update = config['pos_update']
         self.pos_class = config['pos_class']
         self.pos_args  = config['pos_args']
@@ -40,7 +41,7 @@ class MARibbonSim(StratSim):
         else:
             freq_str = str(self.freq) + "min"
             xdf = dh.conv_ohlc_freq(mdf, freq_str, extra_cols=['contract'])
-        ma_ribbon = dh.MA_RIBBON(xdf, self.ma_list)
+        ma_ribbon = dh.cached_ind(self.ind_cache, dh.MA_RIBBON, xdf, self.ma_list)
         self.df = xdf
         for malen in self.ma_list:
             self.df['EMA' + str(malen)] = ma_ribbon['EMA_CLOSE_' + str(malen)]
@@ -11,6 +11,8 @@ import datetime
 from backtest import *
 
 class RSIATRSim(StratSim):
+    fast_loop = True
+
     def __init__(self, config):
         super(RSIATRSim, self).__init__(config)
 
@@ -60,6 +62,9 @@ class RSIATRSim(StratSim):
         return np.isnan(sim_data['ATR'][n]) or np.isnan(sim_data['ATRMA'][n]) or np.isnan(sim_data['RSI'][n])
         # or (sim_data['date'][n] != sim_data['date'][n + 1])
 
+    def data_invalid_mask(self, sim_data):
+        return np.isnan(sim_data['ATR']) | np.isnan(sim_data['ATRMA']) | np.isnan(sim_data['RSI'])
+
     def get_tradepos_exit(self, tradepos, sim_data, n):
         gap = (int((self.SL * sim_data['ATRMA'][n-1]) / float(self.tick_base)) + 1) * float(self.tick_base)
         return gap
@@ -38,6 +38,7 @@ class DTStopSim(StratSim):
         self.SL = config['stoploss']
         self.min_rng = config['min_range']
         self.chan = config['chan']
+        self.ind_cache = config.get('ind_cache', None)
         self.machan = config['machan']
         self.use_chan = config['use_chan']
         self.no_trade_set = config['no_trade_set']
@@ -47,7 +48,7 @@ class DTStopSim(StratSim):
         self.sell_trig = 0.0
      
     def process_data(self, mdf):
-        xdf = self.proc_func(mdf, **self.proc_args)
+        xdf = dh.cached_ind(self.ind_cache, self.proc_func, mdf, **self.proc_args)
         if self.win == -1:
             tr= pd.concat([xdf.high - xdf.low, abs(xdf.close - xdf.close.shift(1))],
                            join='outer', axis=1).max(axis=1)
@@ -62,10 +63,10 @@ class DTStopSim(StratSim):
                            pd.rolling_max(xdf.close, self.win) - pd.rolling_min(xdf.low, self.win)],
                            join='outer', axis=1).max(axis=1)
         xdf['TR'] = tr
-        xdf['chanh'] = self.chan_high(xdf['high'], self.chan, **self.chan_func['high']['args'])
-        xdf['chanl'] = self.chan_low(xdf['low'], self.chan, **self.chan_func['low']['args'])
-        xdf['ATR'] = dh.ATR(xdf, n = self.atr_len)
-        xdf['MA'] = dh.MA(xdf, n=self.atr_len, field = 'close')
+        xdf['chanh'] = dh.cached_ind(self.ind_cache, self.chan_high, xdf['high'], self.chan, **self.chan_func['high']['args'])
+        xdf['chanl'] = dh.cached_ind(self.ind_cache, self.chan_low, xdf['low'], self.chan, **self.chan_func['low']['args'])
+        xdf['ATR'] = dh.cached_ind(self.ind_cache, dh.ATR, xdf, n = self.atr_len)
+        xdf['MA'] = dh.cached_ind(self.ind_cache, dh.MA, xdf, n = self.atr_len, field = 'close')
         xdata = pd.concat([xdf['TR'].shift(1), xdf['MA'].shift(1), xdf['ATR'].shift(1),
                            xdf['chanh'].shift(1), xdf['chanl'].shift(1),
                            xdf['open']], axis=1, keys=['tr','ma', 'atr', 'chanh', 'chanl', 'dopen']).fillna(0)
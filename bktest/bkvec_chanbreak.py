@@ -56,9 +56,58 @@ def chanbreak_sim( mdf, config):
     closed_trades = backtest.simdf_to_trades1(mdf, slippage = offset )
     return (mdf, closed_trades)
 
+def chanbreak_vecsim( mdf, config, scen_list):
+    ind_cache = config.get('ind_cache', None)
+    nscen = len(scen_list)
+    tcost = np.array([scen['trans_cost'] for scen in scen_list])
+    offset = np.array([scen['offset'] for scen in scen_list])
+    exit_min = np.array([scen.get('exit_min', 2057) for scen in scen_list])
+    close_daily = np.array([scen.get('close_daily', False) for scen in scen_list], dtype = bool)
+    stoploss = np.array([scen.get('stoploss', 2.0) for scen in scen_list])
+    mdata = np.empty((len(mdf), 5, nscen))
+    for i, scen in enumerate(scen_list):
+        upper_chan_func = eval(scen['channel_func'][0])
+        lower_chan_func = eval(scen['channel_func'][1])
+        xdf = dh.cached_ind(ind_cache, dh.conv_ohlc_freq, mdf, str(scen['freq']) + 'Min')
+        entry_chan = scen['win'][0]
+        exit_chan = scen['win'][1]
+        xdata = np.vstack([dh.cached_ind(ind_cache, upper_chan_func, xdf, entry_chan).values,
+                           dh.cached_ind(ind_cache, lower_chan_func, xdf, entry_chan).values,
+                           dh.cached_ind(ind_cache, upper_chan_func, xdf, exit_chan).values,
+                           dh.cached_ind(ind_cache, lower_chan_func, xdf, exit_chan).values,
+                           dh.cached_ind(ind_cache, dh.ATR, xdf, entry_chan).values]).T
+        mdata[:, :, i] = backtest.bars_to_min(backtest.shift_2d(xdata), xdf.index.values, mdf.index.values)
+    H1 = mdata[:, 0, :]
+    L1 = mdata[:, 1, :]
+    H2 = mdata[:, 2, :]
+    L2 = mdata[:, 3, :]
+    atr = mdata[:, 4, :]
+    mopen = mdf['open'].values.reshape((-1, 1))
+    close_ind = close_daily & (mdf['min_id'].values.reshape((-1, 1)) >= exit_min)
+    close_ind[-3:, :] = True
+    long_signal = np.empty((len(mdf), nscen))
+    long_signal[:] = np.nan
+    short_signal = np.empty((len(mdf), nscen))
+    short_signal[:] = np.nan
+    with np.errstate(invalid = 'ignore'):
+        long_signal[mopen >= H1] = 1
+        long_signal[mopen <= L2] = 0
+        long_signal[(stoploss > 0) & (mopen <= H1 - atr * stoploss)] = 0
+        short_signal[mopen <= L1] = -1
+        short_signal[mopen >= H2] = 0
+        short_signal[(stoploss > 0) & (mopen >= L1 + atr * stoploss)] = 0
+    long_signal[close_ind] = 0
+    short_signal[close_ind] = 0
+    pos = np.nan_to_num(backtest.ffill_2d(long_signal)) + np.nan_to_num(backtest.ffill_2d(short_signal))
+    dpos = pos - backtest.shift_2d(pos)
+    cost = np.nan_to_num(abs(dpos) * (offset + mopen * tcost))
+    traded_price = mopen + dpos * offset
+    return backtest.vec_sim_output(mdf, pos, cost, traded_price)
+
 def gen_config_file(filename):
     sim_config = {}
     sim_config['sim_func']  = 'bktest.bkvec_chanbreak.chanbreak_sim'
+    sim_config['vec_sim_func'] = 'bktest.bkvec_chanbreak.chanbreak_vecsim'
     sim_config['scen_keys'] = ['freq', 'win']
     sim_config['sim_name']   = 'chanbreak_'
     sim_config['products']   = ['rb', 'hc', 'i', 'j', 'jm', 'ZC', 'ru', 'ni', 'y', 'p', 'OI', 'm', 'RM', \
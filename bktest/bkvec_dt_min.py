@@ -25,13 +25,11 @@ def dual_thrust_sim( mdf, config):
     tcost = config['trans_cost']
     min_rng = config['min_range']
     chan = config['chan']
-    xdf = proc_func(mdf, **proc_args)
-    tr= pd.concat([pd.rolling_max(xdf.high, win) - pd.rolling_min(xdf.close, win), 
-                   pd.rolling_max(xdf.close, win) - pd.rolling_min(xdf.low, win)], 
-                   join='outer', axis=1).max(axis=1)
-    xdf['tr'] = tr
-    xdf['chan_h'] = chan_high(xdf, chan, **chan_func['high']['args'])
-    xdf['chan_l'] = chan_low(xdf, chan, **chan_func['low']['args'])
+    ind_cache = config.get('ind_cache', None)
+    xdf = dh.cached_ind(ind_cache, proc_func, mdf, **proc_args)
+    xdf['tr'] = dh.cached_ind(ind_cache, dh.DT_RNG, xdf, win)
+    xdf['chan_h'] = dh.cached_ind(ind_cache, chan_high, xdf, chan, **chan_func['high']['args'])
+    xdf['chan_l'] = dh.cached_ind(ind_cache, chan_low, xdf, chan, **chan_func['low']['args'])
     #sar_param = config['sar_param']
     #sar = dh.SAR(xdf, **sar_param)
     #sar_signal = pd.Series(0, index = sar.index)
@@ -66,9 +64,66 @@ def dual_thrust_sim( mdf, config):
     closed_trades = backtest.simdf_to_trades1(mdf, slippage = offset )
     return (mdf, closed_trades)
 
+def dual_thrust_vecsim( mdf, config, scen_list):
+    proc_func = config['proc_func']
+    ind_cache = config.get('ind_cache', None)
+    nscen = len(scen_list)
+    k = np.array([scen['param'][0] for scen in scen_list])
+    min_rng = np.array([scen['min_range'] for scen in scen_list])
+    offset = np.array([scen['offset'] for scen in scen_list])
+    tcost = np.array([scen['trans_cost'] for scen in scen_list])
+    close_daily = np.array([scen['close_daily'] for scen in scen_list], dtype = bool)
+    exit_min = np.array([scen.get('exit_min', 2057) for scen in scen_list])
+    xdf_list = {}
+    mdata = np.empty((len(mdf), 4, nscen))
+    for i, scen in enumerate(scen_list):
+        proc_key = repr(sorted(scen['proc_args'].items()))
+        if proc_key not in xdf_list:
+            xdf_list[proc_key] = dh.cached_ind(ind_cache, proc_func, mdf, **scen['proc_args'])
+        xdf = xdf_list[proc_key]
+        chan_func = scen['chan_func']
+        chan_high = eval(chan_func['high']['func'])
+        chan_low  = eval(chan_func['low']['func'])
+        xdata = np.vstack([dh.cached_ind(ind_cache, dh.DT_RNG, xdf, scen['param'][1]).values,
+                           dh.cached_ind(ind_cache, chan_high, xdf, scen['chan'], **chan_func['high']['args']).values,
+                           dh.cached_ind(ind_cache, chan_low, xdf, scen['chan'], **chan_func['low']['args']).values]).T
+        xdata = np.hstack([backtest.shift_2d(xdata), xdf['open'].values.reshape((-1, 1))])
+        mdata[:, :, i] = backtest.bars_to_min(xdata, xdf.index.values, mdf.index.values)
+    tr = mdata[:, 0, :]
+    chan_h = mdata[:, 1, :]
+    chan_l = mdata[:, 2, :]
+    xopen = mdata[:, 3, :]
+    mhigh = mdf['high'].values.reshape((-1, 1))
+    mlow = mdf['low'].values.reshape((-1, 1))
+    mopen = mdf['open'].values.reshape((-1, 1))
+    rng = np.fmax(min_rng * xopen, k * tr)
+    long_signal = np.empty((len(mdf), nscen))
+    long_signal[:] = np.nan
+    short_signal = np.empty((len(mdf), nscen))
+    short_signal[:] = np.nan
+    with np.errstate(invalid = 'ignore'):
+        long_signal[(mhigh >= xopen + rng) & (mhigh >= chan_h)] = 1
+        long_signal[(mlow <= xopen - rng) | (mlow <= chan_l)] = 0
+        short_signal[(mlow <= xopen - rng) & (mlow <= chan_l)] = -1
+        short_signal[(mhigh >= xopen + rng) | (mhigh >= chan_h)] = 0
+    exit_ind = close_daily & (mdf['min_id'].values.reshape((-1, 1)) >= exit_min)
+    long_signal[exit_ind] = 0
+    short_signal[exit_ind] = 0
+    long_signal = np.nan_to_num(backtest.ffill_2d(backtest.shift_2d(long_signal)))
+    short_signal = np.nan_to_num(backtest.ffill_2d(backtest.shift_2d(short_signal)))
+    if np.any((long_signal > 0) & (short_signal < 0)):
+        print "Warning: long and short signal happen at the same time"
+    pos = long_signal + short_signal
+    pos[-3:, :] = 0
+    dpos = pos - backtest.shift_2d(pos)
+    cost = np.nan_to_num(abs(dpos) * (offset + mopen * tcost))
+    traded_price = mopen + dpos * offset
+    return backtest.vec_sim_output(mdf, pos, cost, traded_price)
+
 def gen_config_file(filename):
     sim_config = {}
     sim_config['sim_func']  = 'bktest.bkvec_dt_min.dual_thrust_sim'
+    sim_config['vec_sim_func'] = 'bktest.bkvec_dt_min.dual_thrust_vecsim'
     sim_config['scen_keys'] = ['param', 'chan']
     sim_config['sim_name']   = 'DTsplit3chan_1y'
     sim_config['products']   = ['rb', 'hc', 'i', 'j', 'jm', 'ZC', 'ni', 'ru', 'm', 'RM', 'FG', \
@@ -40,7 +40,7 @@ def MA_sim( mdf, config):
     else:
         xdf['chan_high'] = pd.Series(index = xdf.index)
         xdf['chan_low'] = pd.Series(index = xdf.index)
-    ma_ribbon = dh.MA_RIBBON(xdf, ma_list)
+    ma_ribbon = dh.cached_ind(config.get('ind_cache', None), dh.MA_RIBBON, xdf, ma_list)
     ribbon_corr = ma_ribbon["MARIBBON_CORR"].shift(1)
     ribbon_pval = ma_ribbon["MARIBBON_PVAL"].shift(1)
     ribbon_dist = ma_ribbon["MARIBBON_DIST"].shift(1)
@@ -32,7 +32,8 @@ def dual_thrust_sim( mdf, config):
     min_rng = config['min_range']
     chan = config['chan']
     machan = config['machan']
-    xdf = proc_func(mdf, **proc_args)
+    ind_cache = config.get('ind_cache', None)
+    xdf = dh.cached_ind(ind_cache, proc_func, mdf, **proc_args)
     if win == -1:
         tr= pd.concat([xdf.high - xdf.low, abs(xdf.close - xdf.close.shift(1))], 
                        join='outer', axis=1).max(axis=1)
@@ -47,9 +48,9 @@ def dual_thrust_sim( mdf, config):
                        pd.rolling_max(xdf.close, win) - pd.rolling_min(xdf.low, win)], 
                        join='outer', axis=1).max(axis=1)
     xdf['tr'] = tr
-    xdf['chan_h'] = chan_high(xdf, chan, **chan_func['high']['args'])
-    xdf['chan_l'] = chan_low(xdf, chan, **chan_func['low']['args'])
-    xdf['atr'] = dh.ATR(xdf, machan)
+    xdf['chan_h'] = dh.cached_ind(ind_cache, chan_high, xdf, chan, **chan_func['high']['args'])
+    xdf['chan_l'] = dh.cached_ind(ind_cache, chan_low, xdf, chan, **chan_func['low']['args'])
+    xdf['atr'] = dh.cached_ind(ind_cache, dh.ATR, xdf, machan)
     xdf['ma'] = pd.rolling_mean(xdf.close, machan)
     xdf['rng'] = pd.DataFrame([min_rng * xdf['open'], k * xdf['tr'].shift(1)]).max()
     xdf['upper'] = xdf['open'] + xdf['rng'] * (1 + (xdf['open'] < xdf['ma'].shift(1))*f)
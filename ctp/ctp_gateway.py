@@ -63,6 +63,7 @@ TERT_QUICK = 2 #只传送登录后的流内容
 
 class CtpGateway(GrossGateway):
     """CTP接口"""
+    route_exchanges = ['CZCE', 'DCE', 'SHFE', 'CFFEX']
 
     #----------------------------------------------------------------------
     def __init__(self, agent, gatewayName='CTP', md_api = 'ctp.vnctp_gateway.VnctpMdApi', td_api = 'ctp.vnctp_gateway.VnctpTdApi'):
@@ -219,10 +220,13 @@ class CtpGateway(GrossGateway):
         if self.qryEnabled:
             self.qry_count += 1
             if self.qry_count > self.qry_trigger:
-                self.qryCount = 0
-                if len(self.qry_commands)>0:
+                self.qry_count = 0
+                if (len(self.qry_commands)>0) and self.throttle.acquire('query'):
                     self.qry_commands[0]()
                     del self.qry_commands[0]
+        # 流控延后的报单和撤单
+        if self.process_flag:
+            self.send_queued_orders()
     
     #----------------------------------------------------------------------
     def setQryEnabled(self, qryEnabled):
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from ctp_gateway import *
+from fill_model import QueueFillModel
 
 class CtpSimGateway(CtpGateway):
     def __init__(self, agent, gatewayName='CTP'):
@@ -28,6 +29,11 @@ class CtpSimGateway(CtpGateway):
             self.onLog(logContent, level = logging.WARNING)
             return
 
+        fill_setting = setting.get('fill_model', None)
+        if fill_setting != None:
+            self.tdApi.fill_model = QueueFillModel(latency = fill_setting.get('latency', 0.0), \
+                                                   cancel_latency = fill_setting.get('cancel_latency', None), \
+                                                   depth = fill_setting.get('depth', 5))
         # 创建行情和交易接口对象
         self.mdApi.connect(userID, password, brokerID, mdAddress)
         self.mdConnected = False
@@ -44,6 +50,11 @@ class CtpSimGateway(CtpGateway):
     def rsp_td_login(self, event):
         pass
 
+    def rsp_market_data(self, event):
+        super(CtpSimGateway, self).rsp_market_data(event)
+        if self.tdApi.fill_model != None:
+            self.tdApi.on_market_data(event.dict['data'])
+
         
 class SimctpTdApi(object):
     def __init__(self, gateway):
@@ -65,6 +76,9 @@ class SimctpTdApi(object):
         self.frontID = EMPTY_INT            # 前置机编号
         self.sessionID = EMPTY_INT          # 会话编号
 
+        self.fill_model = None              # None: 立即成交, 否则按排队位置撮合
+        self.sim_orders = {}
+
     def sendOrder(self, iorder):
         """发单"""
         iorder.local_id = iorder.order_ref
@@ -95,6 +109,11 @@ class SimctpTdApi(object):
 
     def reqOrderInsert(self, order, request_id):
         oid = order['OrderRef']
+        if self.fill_model != None:
+            self.sim_orders[oid] = order
+            self.fill_model.insert_order(oid, order['InstrumentID'], order['Direction'], \
+                                         order['LimitPrice'], order['VolumeTotalOriginal'])
+            return
         trade= {'InstrumentID' : order['InstrumentID'],
                 'Direction': order['Direction'],
                 'Price': order['LimitPrice'],
@@ -125,7 +144,12 @@ class SimctpTdApi(object):
         self.reqOrderAction(req, self.reqID)
 
     def reqOrderAction(self, corder, request_id):
-        local_id = int(corder['OrderRef'])
+        if (self.fill_model != None) and self.fill_model.cancel_order(corder['OrderRef']):
+            return
+        self.rtn_cancel(corder['OrderRef'])
+
+    def rtn_cancel(self, order_ref):
+        local_id = int(order_ref)
         if (local_id in self.gateway.id2order):
             myorder = self.gateway.id2order[local_id]
             myorder.on_cancel()
@@ -133,6 +157,33 @@ class SimctpTdApi(object):
             event.dict['trade_ref'] = myorder.trade_ref
             self.gateway.eventEngine.put(event)
 
+    def on_market_data(self, data):
+        for fill in self.fill_model.on_market_data(data):
+            oid = fill[1].order_ref
+            if fill[0] == 'cancel':
+                self.sim_orders.pop(oid, None)
+                self.rtn_cancel(oid)
+                continue
+            order = self.sim_orders[oid]
+            trade_id = oid + '_' + str(fill[1].num_fills)
+            trade = {'InstrumentID' : order['InstrumentID'],
+                    'ExchangeID': data.get('ExchangeID', ''),
+                    'Direction': order['Direction'],
+                    'OffsetFlag': order['CombOffsetFlag'],
+                    'Price': fill[2],
+                    'Volume': fill[3],
+                    'OrderRef': oid,
+                    'TradeID': trade_id,
+                    'OrderSysID': oid,
+                    'BrokerOrderSeq': int(oid),
+                    'OrderLocalID': oid,
+                    'TradeTime': str(data['UpdateTime']).replace(':', '')}
+            if fill[1].remaining() <= 0:
+                self.sim_orders.pop(oid, None)
+            event1 = Event(type=EVENT_RTNTRADE+self.gatewayName)
+            event1.dict['data'] = trade
+            self.gateway.eventEngine.put(event1)
+
     def reqQryTradingAccount(self,req,req_id=0):
         pass
 
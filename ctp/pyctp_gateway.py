@@ -277,6 +277,8 @@ class PyctpTdApi(py_ctp.TraderApi):
         self.connectionStatus = False
         self.loginStatus = False
         self.gateway.tdConnected = False
+        event = Event(type=EVENT_TDDISCONNECTED+self.gatewayName)
+        self.gateway.eventEngine.put(event)
 
         logContent = u'交易服务器连接断开'
         self.gateway.onLog(logContent, level = logging.INFO)
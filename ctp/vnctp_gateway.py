@@ -272,6 +272,8 @@ class VnctpTdApi(TdApi):
         self.connectionStatus = False
         self.loginStatus = False
         self.gateway.tdConnected = False
+        event = Event(type=EVENT_TDDISCONNECTED+self.gatewayName)
+        self.gateway.eventEngine.put(event)
 
         logContent = u'交易服务器连接断开'
         self.gateway.onLog(logContent, level = logging.INFO)
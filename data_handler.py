@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 import datetime
+import os
+import hashlib
+import inspect
+import functools
+import bisect
+import collections
 import talib
 import numpy as np
 import pandas as pd
 import scipy.stats as stats
 import scipy.signal as signal
+try:
+    from numba import njit
+except ImportError:
+    njit = lambda func: func
 
 def conv_date(d):
     if type(d).__name__ == 'datetime64':
@@ -82,7 +92,281 @@ class DynamicRecArray(object):
     @property
     def data(self):
         return self._data[:self.length]
-        
+
+# input columns read by the indicators and bar conversions besides their field argument and extra_cols,
+# the cache only hashes these. columns missing from the data are skipped, the function can not read them
+ind_input_fields = {'TR': ['high', 'low', 'close'], 'ATR': ['high', 'low', 'close'], 'DT_RNG': ['high', 'low', 'close'],
+                    'MA_RIBBON': ['close'], 'MA': [], 'EMA': [], 'STDEV': [], 'DONCH_H': [], 'DONCH_L': [], 'PCT_CHANNEL': [],
+                    'day_split': ['datetime', 'date', 'min_id', 'open', 'high', 'low', 'close', 'volume'],
+                    'conv_ohlc_freq': ['datetime', 'date', 'min_id', 'open', 'high', 'low', 'close', 'volume', 'openInterest'], }
+
+def ind_fields(func, args, kwargs):
+    name = getattr(func, '__name__', '')
+    if (getattr(func, '__module__', '') != __name__) or (name not in ind_input_fields):
+        return None
+    fields = list(ind_input_fields[name])
+    spec = inspect.getargspec(func)
+    if 'extra_cols' in spec.args:
+        pos = spec.args.index('extra_cols')
+        if 'extra_cols' in kwargs:
+            fields += list(kwargs['extra_cols'])
+        elif len(args) >= pos:
+            fields += list(args[pos - 1])
+    if 'field' in spec.args:
+        pos = spec.args.index('field')
+        if 'field' in kwargs:
+            fields.append(kwargs['field'])
+        elif len(args) >= pos:
+            fields.append(args[pos - 1])
+        else:
+            fields.append(spec.defaults[pos - len(spec.args)])
+    return fields
+
+class IndicatorCache(object):
+    def __init__(self, folder = None):
+        self.folder = folder
+        self.store = {}
+        self.hits = 0
+        self.misses = 0
+        self.base = None
+        self.base_hashes = {}
+        if (self.folder != None) and (not os.path.exists(self.folder)):
+            os.makedirs(self.folder)
+
+    def set_base(self, data):
+        ''' the prepared data of an asset, hashes of its columns are worked out once and reused,
+            so the prepared columns are read only for the sims, columns added later are hashed per call'''
+        if data is not self.base:
+            self.base = data
+            self.base_hashes = dict([(str(col), None) for col in data.columns] + [('index', None)])
+
+    def column_hash(self, name, values):
+        if values.dtype == object:
+            values = values.astype(str)
+        return hashlib.sha1(np.ascontiguousarray(values).tostring()).digest()
+
+    def base_hash(self, name, values):
+        if name not in self.base_hashes:
+            return self.column_hash(name, values)
+        if self.base_hashes[name] == None:
+            self.base_hashes[name] = self.column_hash(name, values)
+        return self.base_hashes[name]
+
+    def fingerprint(self, data, fields = None):
+        hasher = hashlib.sha1()
+        hasher.update(str(len(data)))
+        if isinstance(data, pd.DataFrame):
+            if fields == None:
+                fields = data.columns
+            cols = [(str(col), data[col].values) for col in fields if col in data.columns]
+        else:
+            cols = [(str(data.name), data.values)]
+        cols.append(('index', data.index.values))
+        hash_func = self.base_hash if (data is self.base) else self.column_hash
+        for name, values in cols:
+            hasher.update(name)
+            hasher.update(hash_func(name, values))
+        return hasher.hexdigest()
+
+    def cache_key(self, func, data, args, kwargs):
+        func_name = getattr(func, '__module__', '') + '.' + getattr(func, '__name__', '')
+        params = repr(args) + repr(sorted(kwargs.items()))
+        return (self.fingerprint(data, ind_fields(func, args, kwargs)), func_name, params)
+
+    def file_name(self, key):
+        return os.path.join(self.folder, hashlib.sha1(repr(key)).hexdigest() + '.pkl')
+
+    def calc(self, func, data, *args, **kwargs):
+        if getattr(func, '__name__', '<lambda>') == '<lambda>':
+            return func(data, *args, **kwargs)
+        key = self.cache_key(func, data, args, kwargs)
+        if key in self.store:
+            self.hits += 1
+            res = self.store[key]
+        else:
+            self.misses += 1
+            res = None
+            if self.folder != None:
+                fname = self.file_name(key)
+                if os.path.isfile(fname):
+                    res = pd.read_pickle(fname)
+            if res is None:
+                res = func(data, *args, **kwargs)
+                if self.folder != None:
+                    pd.to_pickle(res, self.file_name(key))
+            if isinstance(res, (pd.Series, np.ndarray)):
+                # results are shared between scenarios, so guard them against in place changes
+                values = res.values if isinstance(res, pd.Series) else res
+                values.flags.writeable = False
+            self.store[key] = res
+        if isinstance(res, pd.DataFrame):
+            res = res.copy(deep = True)
+        return res
+
+    def clear(self):
+        self.store = {}
+        self.base = None
+        self.base_hashes = {}
+
+class RollingRank(object):
+    ''' sorted buffer over the last window values, giving rank/percentile/quantile queries
+        in O(log w) plus a C level list shift per update. update with the same key as the
+        previous call replaces the last value, as when the last bar is rebuilt'''
+    def __init__(self, window, values = []):
+        self.window = window
+        self.last_key = None
+        self.buf = collections.deque()
+        self.sorted = []
+        self.nan_count = 0
+        for x in values:
+            self.update(x)
+
+    def __len__(self):
+        return len(self.buf)
+
+    def update(self, x, key = None):
+        x = float(x)
+        if (key != None) and (key == self.last_key) and (len(self.buf) > 0):
+            old = self.buf.pop()
+            if old != old:
+                self.nan_count -= 1
+            else:
+                del self.sorted[bisect.bisect_left(self.sorted, old)]
+        self.last_key = key
+        self.buf.append(x)
+        if x != x:
+            self.nan_count += 1
+        else:
+            bisect.insort(self.sorted, x)
+        if len(self.buf) > self.window:
+            old = self.buf.popleft()
+            if old != old:
+                self.nan_count -= 1
+            else:
+                del self.sorted[bisect.bisect_left(self.sorted, old)]
+
+    def rank(self, x):
+        ''' number of values strictly below and at or below x '''
+        return bisect.bisect_left(self.sorted, x), bisect.bisect_right(self.sorted, x)
+
+    def percentileofscore(self, x, kind = 'rank'):
+        # same as stats.percentileofscore over the window
+        n = len(self.buf)
+        if n == 0:
+            return np.nan
+        left, right = self.rank(x)
+        if kind == 'rank':
+            return (right + left + (1 if right > left else 0)) * 50.0/n
+        elif kind == 'strict':
+            return left * 100.0/n
+        elif kind == 'weak':
+            return right * 100.0/n
+        elif kind == 'mean':
+            return (left + right) * 50.0/n
+        else:
+            raise ValueError("kind can only be 'rank', 'strict', 'weak' or 'mean'")
+
+    def quantile(self, pct):
+        # linear interpolation as np.percentile
+        n = len(self.sorted)
+        if (n == 0) or (self.nan_count > 0):
+            return np.nan
+        pos = (n - 1) * (pct / 100.0)
+        below = int(np.floor(pos))
+        above = min(below + 1, n - 1)
+        w = pos - below
+        return self.sorted[below] * (1 - w) + self.sorted[above] * w
+
+class RollingExtrema(object):
+    ''' monotonic deques for the running max/min of the last window values, amortized O(1)
+        per update. update with the same key as the previous call replaces the last value,
+        as when the last bar is rebuilt'''
+    def __init__(self, window, values = []):
+        self.window = window
+        self.count = 0
+        self.last_key = None
+        self.vals = collections.deque()
+        self.max_q = collections.deque()
+        self.min_q = collections.deque()
+        self.nan_count = 0
+        for x in values:
+            self.update(x)
+
+    def push(self, x):
+        self.vals.append(x)
+        if x != x:
+            self.nan_count += 1
+        else:
+            while (len(self.max_q) > 0) and (self.max_q[-1][1] <= x):
+                self.max_q.pop()
+            self.max_q.append((self.count, x))
+            while (len(self.min_q) > 0) and (self.min_q[-1][1] >= x):
+                self.min_q.pop()
+            self.min_q.append((self.count, x))
+        self.count += 1
+        if len(self.vals) > self.window:
+            old = self.vals.popleft()
+            if old != old:
+                self.nan_count -= 1
+        start = self.count - self.window
+        if (len(self.max_q) > 0) and (self.max_q[0][0] < start):
+            self.max_q.popleft()
+        if (len(self.min_q) > 0) and (self.min_q[0][0] < start):
+            self.min_q.popleft()
+
+    def update(self, x, key = None):
+        x = float(x)
+        if (key != None) and (key == self.last_key) and (len(self.vals) > 0):
+            # rebuild from the raw window, the deques have dropped values the old bar dominated
+            vals = list(self.vals)[:-1] + [x]
+            self.count -= len(self.vals)
+            self.vals.clear()
+            self.max_q.clear()
+            self.min_q.clear()
+            self.nan_count = 0
+            for v in vals:
+                self.push(v)
+        else:
+            self.push(x)
+        self.last_key = key
+
+    def max(self):
+        if (len(self.max_q) == 0) or (self.nan_count > 0):
+            return np.nan
+        return self.max_q[0][1]
+
+    def min(self):
+        if (len(self.min_q) == 0) or (self.nan_count > 0):
+            return np.nan
+        return self.min_q[0][1]
+
+def rolling_extrema(ts, n, func = np.maximum):
+    ''' van Herk/Gil-Werman block scan, O(len) for any window. A nan in the window gives nan
+        and the first n-1 values are nan, same as pd.rolling_max/min'''
+    x = np.asarray(ts, dtype = float)
+    nlen = len(x)
+    out = np.empty(nlen)
+    out[:] = np.nan
+    if (n >= 1) and (n <= nlen):
+        xp = np.concatenate([x, np.zeros((-nlen) % n)]).reshape((-1, n))
+        prefix = func.accumulate(xp, axis = 1).ravel()
+        suffix = func.accumulate(xp[:, ::-1], axis = 1)[:, ::-1].ravel()
+        out[n-1:] = func(suffix[:nlen-n+1], prefix[n-1:nlen])
+    if isinstance(ts, pd.Series):
+        out = pd.Series(out, index = ts.index)
+    return out
+
+def rolling_max(ts, n):
+    return rolling_extrema(ts, n, np.maximum)
+
+def rolling_min(ts, n):
+    return rolling_extrema(ts, n, np.minimum)
+
+def cached_ind(ind_cache, func, data, *args, **kwargs):
+    if ind_cache == None:
+        return func(data, *args, **kwargs)
+    return ind_cache.calc(func, data, *args, **kwargs)
+
 def ohlcsum(df):
     return pd.Series([df.index[0], df['open'][0], df['high'].max(), df['low'].min(), df['close'][-1], df['volume'].sum()],
                   index = ['datetime', 'open','high','low','close','volume'])
@@ -101,11 +385,11 @@ def min_freq_group(mdf, freq = 5, index_col = 'datetime'):
 def day_split(mdf, minlist = [1500], index_col = 'datetime'):
     if index_col == None:
         mdf = mdf.set_index('datetime')
-    mdf['min_idx'] = 0
+    min_idx = pd.Series(0, index = mdf.index, name = 'min_idx')
     for idx, mid in enumerate(minlist):
-        mdf.loc[mdf['min_id']>=mid, 'min_idx'] = idx + 1
-    mdf['date_idx'] = mdf.date
-    xdf = mdf.groupby([mdf['date_idx'], mdf['min_idx']]).apply(ohlcsum).reset_index()
+        min_idx[(mdf['min_id']>=mid).values] = idx + 1
+    date_idx = pd.Series(mdf['date'].values, index = mdf.index, name = 'date_idx')
+    xdf = mdf.groupby([date_idx, min_idx]).apply(ohlcsum).reset_index()
     if index_col != None:
         xdf = xdf.set_index('datetime')
     return xdf
@@ -167,8 +451,8 @@ def conv_ohlc_freq(mdf, freq, index_col = 'datetime', bar_func = bar_conv_func2,
             f = int(freq[:-3])
         elif freq[-1:] in ['m', 'M']:
             f = int(freq[:-1])
-        df['grp_id'] = pd.Series((bar_func(df['min_id'])/f).astype('int'), name = 'grp_id')
-        res = df.groupby([df['date'], df['grp_id']]).apply(min_func).reset_index()
+        grp_id = pd.Series((bar_func(df['min_id'])/f).astype('int'), name = 'grp_id')
+        res = df.groupby([df['date'], grp_id]).apply(min_func).reset_index()
         res.drop('grp_id', axis = 1, inplace=True)
         if index_col == 'datetime':
             res.set_index(index_col, inplace = True)
@@ -604,36 +888,62 @@ def CHENOW_PLUNGER(df, n, atr_n = 40):
 
 #Donchian Channel
 def DONCH_H(df, n, field = 'high'):
-    DC_H = pd.rolling_max(df[field],n)
+    DC_H = rolling_max(df[field], n)
     return pd.Series(DC_H, name = 'DONCH_H' + field[0].upper() + str(n))
 
 def DONCH_L(df, n, field = 'low'):
-    DC_L = pd.rolling_min(df[field], n)
+    DC_L = rolling_min(df[field], n)
     return pd.Series(DC_L, name = 'DONCH_L'+ field[0].upper() + str(n))
 
-def donch_h(df, n, field = 'high'):
+def donch_h(df, n, field = 'high', ext_buf = None):
     key = 'DONCH_H'+ field[0].upper() + str(n)
-    df[key][-1] = max(df[field][-n:])
+    if ext_buf == None:
+        df[key][-1] = max(df[field][-n:])
+    else:
+        # ext_buf is a RollingExtrema(n) kept by the caller, keyed by the bar count
+        ext_buf.update(df[field][-1], len(df[field]))
+        df[key][-1] = ext_buf.max()
  
-def donch_l(df, n, field = 'low'):
+def donch_l(df, n, field = 'low', ext_buf = None):
     key = 'DONCH_L'+ field[0].upper() + str(n)
-    df[key][-1] = min(df[field][-n:])
+    if ext_buf == None:
+        df[key][-1] = min(df[field][-n:])
+    else:
+        ext_buf.update(df[field][-1], len(df[field]))
+        df[key][-1] = ext_buf.min()
     
 #Standard Deviation
+@njit
+def ha_kernel(sm_h, sm_l, ha_o, ha_c, ha_h, ha_l, start, period1):
+    # comparisons follow the builtin max/min, a nan in the first argument is kept
+    for idx in range(start, len(ha_c)):
+        if idx >= period1:
+            ha_o[idx] = (ha_o[idx-1] + ha_c[idx-1])/2.0
+        ha_h[idx] = sm_h[idx]
+        if ha_o[idx] > ha_h[idx]:
+            ha_h[idx] = ha_o[idx]
+        if ha_c[idx] > ha_h[idx]:
+            ha_h[idx] = ha_c[idx]
+        ha_l[idx] = sm_l[idx]
+        if ha_o[idx] < ha_l[idx]:
+            ha_l[idx] = ha_o[idx]
+        if ha_c[idx] < ha_l[idx]:
+            ha_l[idx] = ha_c[idx]
+
 def HEIKEN_ASHI(df, period1):
     SM_O = pd.rolling_mean(df['open'], period1)
     SM_H = pd.rolling_mean(df['high'], period1)
     SM_L = pd.rolling_mean(df['low'], period1)
     SM_C = pd.rolling_mean(df['close'], period1)
-    HA_C = pd.Series((SM_O + SM_H + SM_L + SM_C)/4.0, name = 'HAclose')
-    HA_O = pd.Series(SM_O, name = 'HAopen')
-    HA_H = pd.Series(SM_H, name = 'HAhigh')
-    HA_L = pd.Series(SM_L, name = 'HAlow')
-    for idx, dateidx in enumerate(HA_C.index):
-        if idx >= (period1):
-            HA_O[idx] = (HA_O[idx-1] + HA_C[idx-1])/2.0
-        HA_H[idx] = max(SM_H[idx], HA_O[idx], HA_C[idx])
-        HA_L[idx] = min(SM_L[idx], HA_O[idx], HA_C[idx])
+    ha_c = ((SM_O + SM_H + SM_L + SM_C)/4.0).values.astype(float)
+    ha_o = SM_O.values.astype(float)
+    ha_h = np.empty(len(df))
+    ha_l = np.empty(len(df))
+    ha_kernel(SM_H.values.astype(float), SM_L.values.astype(float), ha_o, ha_c, ha_h, ha_l, 0, period1)
+    HA_O = pd.Series(ha_o, index = df.index, name = 'HAopen')
+    HA_H = pd.Series(ha_h, index = df.index, name = 'HAhigh')
+    HA_L = pd.Series(ha_l, index = df.index, name = 'HAlow')
+    HA_C = pd.Series(ha_c, index = df.index, name = 'HAclose')
     return pd.concat([HA_O, HA_H, HA_L, HA_C], join='outer', axis=1)
     
 def heiken_ashi(df, period):
@@ -698,29 +1008,49 @@ def fisher(df, n, smooth_p = 0.7, smooth_i = 0.7):
     df['FISHER_I'][-1] = df['FISHER_I'][-2] * (1 - smooth_i) + smooth_i * fisher_ind
 
 def PCT_CHANNEL(df, n = 20, pct = 50, field = 'close'):
-    out = pd.Series(index=df.index, name = 'PCT%sCH%s' % (pct, n))
-    for idx, d in enumerate(df.index):
-        if idx >= n:
-            out[d] = np.percentile(df[field].iloc[max(idx-n,0):idx], pct)
-    return out
-
-def pct_channel(df, n = 20, pct = 50, field = 'close'):
+    # the window is the n bars before the current one
+    data = df[field].values
+    out = np.empty(len(df))
+    out[:] = np.nan
+    rr = RollingRank(n, data[:n])
+    for idx in range(n, len(df)):
+        out[idx] = rr.quantile(pct)
+        rr.update(data[idx])
+    return pd.Series(out, index=df.index, name = 'PCT%sCH%s' % (pct, n))
+
+def pct_channel(df, n = 20, pct = 50, field = 'close', rank_buf = None):
+    # the n bars before the last one, as PCT_CHANNEL
     key =  'PCT%sCH%s' % (pct, n)
-    df[key][-1] = np.percentile(df[field][-n:], pct)
+    if rank_buf == None:
+        df[key][-1] = np.percentile(df[field][-n-1:-1], pct)
+    else:
+        # rank_buf is a RollingRank(n) kept by the caller, it takes the bar before the last one
+        # keyed by its bar count, so calls on a rebuilt last bar leave it as it is
+        rank_buf.update(df[field][-2], len(df[field]) - 1)
+        df[key][-1] = rank_buf.quantile(pct)
 
 def COND_PCT_CHAN(df, n = 20, pct = 50, field = 'close', direction=1):
-    out = pd.Series(index=df.index, name = 'C_CH%s_PCT%s' % (n, pct))
-    for idx, d in enumerate(df.index):
-        if idx >= n:
-            ts = df[field].iloc[max(idx-n,0):idx]
-            cutoff = np.percentile(ts, pct)
-            ind = (ts*direction>=cutoff*direction)
-            filtered = ts[ind]
-            ranks = filtered.rank(ascending=False)
-            tot_s = sum([filtered[dt] * ranks[dt] * (seq + 1) for seq, dt in enumerate(filtered.index)])
-            tot_w = sum([ranks[dt] * (seq + 1) for seq, dt in enumerate(filtered.index)])    
-            out[d] = tot_s/tot_w
-    return out
+    data = df[field].values.astype(float)
+    out = np.empty(len(df))
+    out[:] = np.nan
+    rr = RollingRank(n, data[:n])
+    for idx in range(n, len(df)):
+        cutoff = rr.quantile(pct)
+        if cutoff != cutoff:
+            rr.update(data[idx])
+            continue
+        ts = data[idx-n:idx]
+        filtered = ts[ts*direction>=cutoff*direction]
+        # descending average ranks within the filtered values, read off the sorted window as all
+        # the values above a filtered one are filtered too for direction 1, below the cutoff for -1
+        sorted_ts = np.array(rr.sorted)
+        left = np.searchsorted(sorted_ts, filtered, 'left')
+        right = np.searchsorted(sorted_ts, filtered, 'right')
+        top = len(sorted_ts) if direction > 0 else len(filtered)
+        wts = (top - right + (right - left + 1) * 0.5) * np.arange(1, len(filtered) + 1)
+        out[idx] = (filtered * wts).sum()/wts.sum()
+        rr.update(data[idx])
+    return pd.Series(out, index=df.index, name = 'C_CH%s_PCT%s' % (n, pct))
    
 def VCI(df, n, rng = 8):
     if n > 7:
@@ -779,68 +1109,123 @@ def LINEAR_REG_SLOPE(ts, n):
 
 def DVO(df, w = [0.5, 0.5, 0, 0], N = 2, s = [0.5, 0.5], M = 252):
     ratio = df.close/(df.high * w[0] + df.low * w[1] + df.open * w[2] + df.close * w[3])
-    theta = pd.Series(index = df.index)
-    dvo = pd.Series(index = df.index, name='DV%s_%s' % (N, M))
-    ss = np.array(list(reversed(s)))
-    for idx, d in enumerate(ratio.index):
-        if idx >= N-1:
-            y = ratio[idx-N+1:idx+1].values
-            theta[idx] = np.dot(y, ss)
-        if idx >= M+N-2:
-            ts = theta[idx-(M-1):idx+1]
-            dvo[idx] = stats.percentileofscore(ts.values, theta[idx])
-    return dvo
-
-def PSAR(df, iaf = 0.02, maxaf = 0.2, incr = 0):
-    if incr == 0:
-        incr = iaf
-    psar = pd.Series(index = df.index, name='PSAR_VAL')
-    direction = pd.Series(index = df.index, name='PSAR_DIR')
-    bull = True
-    ep = df.low[0]
-    hp = df.high[0]
-    lp = df.low[0]
-    af = iaf
-    for idx, d in enumerate(df.index):
-        if idx == 0:
-            continue
-        if bull:
-            psar[idx] = psar[idx - 1] + af * (hp - psar[idx - 1])
-        else:
-            psar[idx] = psar[idx - 1] + af * (lp - psar[idx - 1])
+    ratio = ratio.values.astype(float)
+    theta = np.zeros(len(df))
+    for k in range(N-1, -1, -1):
+        theta[k:] += ratio[:len(df)-k] * s[k]
+    theta[:N-1] = np.nan
+    dvo = np.empty(len(df))
+    dvo[:] = np.nan
+    rr = RollingRank(M, theta[N-1:M+N-2])
+    for idx in range(M+N-2, len(df)):
+        rr.update(theta[idx])
+        dvo[idx] = rr.percentileofscore(theta[idx])
+    return pd.Series(dvo, index = df.index, name='DV%s_%s' % (N, M))
+
+def dvo_theta(df, w, N, s, nlen):
+    ''' DVO theta values of the last nlen bars '''
+    size = nlen + N - 1
+    prices = dict([(field, np.array(df[field][-size:], dtype = float)) for field in ['open', 'high', 'low', 'close']])
+    ratio = prices['close'] / (prices['high'] * w[0] + prices['low'] * w[1] + prices['open'] * w[2] + prices['close'] * w[3])
+    size = len(ratio)
+    if size < N:
+        return np.array([])
+    theta = np.zeros(size - N + 1)
+    for k in range(N):
+        theta += ratio[N-1-k:size-k] * s[k]
+    return theta
+
+def dvo(df, w = [0.5, 0.5, 0, 0], N = 2, s = [0.5, 0.5], M = 252, rank_buf = None):
+    ''' rank_buf is an optional RollingRank(M) of the theta values, kept by the caller and keyed by the bar count '''
+    key = 'DV%s_%s' % (N, M)
+    if rank_buf == None:
+        theta = dvo_theta(df, w, N, s, M)
+        df[key][-1] = stats.percentileofscore(theta, theta[-1])
+    else:
+        theta = 0.0
+        for k in range(N-1, -1, -1):
+            theta += df['close'][-1-k]/(df['high'][-1-k] * w[0] + df['low'][-1-k] * w[1] \
+                                        + df['open'][-1-k] * w[2] + df['close'][-1-k] * w[3]) * s[k]
+        rank_buf.update(theta, len(df['close']))
+        df[key][-1] = rank_buf.percentileofscore(theta)
+
+@njit
+def psar_kernel(high, low, psar, direction, af_arr, ep_arr, start, bull, af, ep, iaf, maxaf, incr):
+    # ep is the high point in an up trend and the low point in a down trend
+    for idx in range(start, len(high)):
+        psar[idx] = psar[idx - 1] + af * (ep - psar[idx - 1])
         reverse = False
         if bull:
-            if df.low[idx] < psar[idx]:
+            if low[idx] < psar[idx]:
                 bull = False
                 reverse = True
-                psar[idx] = hp
-                lp = df.low[idx]
+                psar[idx] = ep
+                ep = low[idx]
                 af = iaf
         else:
-            if df.high[idx] > psar[idx]:
+            if high[idx] > psar[idx]:
                 bull = True
                 reverse = True
-                psar[idx] = lp
-                hp = df.high[idx]
+                psar[idx] = ep
+                ep = high[idx]
                 af = iaf
         if not reverse:
             if bull:
-                if df.high[idx] > hp:
-                    hp = df.high[idx]
+                if high[idx] > ep:
+                    ep = high[idx]
                     af = min(af + incr, maxaf)
-                psar[idx] = min(psar[idx], df.low[idx - 1], df.low[idx - 2])
-
+                if low[idx - 1] < psar[idx]:
+                    psar[idx] = low[idx - 1]
+                if (idx > 1) and (low[idx - 2] < psar[idx]):
+                    psar[idx] = low[idx - 2]
             else:
-                if df.low[idx] < lp:
-                    lp = df.low[idx]
+                if low[idx] < ep:
+                    ep = low[idx]
                     af = min(af + incr, maxaf)
-                psar[idx] = max(psar[idx], df.high[idx - 1], df.high[idx - 2])
-                direction[idx] = -1
+                if high[idx - 1] > psar[idx]:
+                    psar[idx] = high[idx - 1]
+                if (idx > 1) and (high[idx - 2] > psar[idx]):
+                    psar[idx] = high[idx - 2]
         if bull:
             direction[idx] = 1
         else:
             direction[idx] = -1
-    return pd.concat([psar, direction], join='outer', axis=1)
+        af_arr[idx] = af
+        ep_arr[idx] = ep
+
+def PSAR(df, iaf = 0.02, maxaf = 0.2, incr = 0):
+    if incr == 0:
+        incr = iaf
+    high = df['high'].values.astype(float)
+    low = df['low'].values.astype(float)
+    nlen = len(df)
+    psar = np.empty(nlen)
+    direction = np.empty(nlen)
+    af_arr = np.empty(nlen)
+    ep_arr = np.empty(nlen)
+    psar[:] = np.nan
+    direction[:] = np.nan
+    if nlen > 0:
+        # starts as an up trend, the sar at the first low and the extreme point at the first high
+        psar[0] = low[0]
+        direction[0] = 1
+        af_arr[0] = iaf
+        ep_arr[0] = high[0]
+        psar_kernel(high, low, psar, direction, af_arr, ep_arr, 1, True, iaf, high[0], iaf, maxaf, incr)
+    return pd.concat([pd.Series(psar, index = df.index, name = 'PSAR_VAL'),
+                      pd.Series(direction, index = df.index, name = 'PSAR_DIR'),
+                      pd.Series(af_arr, index = df.index, name = 'PSAR_AF'),
+                      pd.Series(ep_arr, index = df.index, name = 'PSAR_EP')], join='outer', axis=1)
+
+def psar(df, iaf = 0.02, maxaf = 0.2, incr = 0):
+    if incr == 0:
+        incr = iaf
+    high = np.array(df['high'][-3:], dtype = float)
+    low = np.array(df['low'][-3:], dtype = float)
+    res = [np.array(df[key][-3:], dtype = float) for key in ['PSAR_VAL', 'PSAR_DIR', 'PSAR_AF', 'PSAR_EP']]
+    psar_kernel(high, low, res[0], res[1], res[2], res[3], 2, res[1][1] > 0, res[2][1], res[3][1], iaf, maxaf, incr)
+    for key, arr in zip(['PSAR_VAL', 'PSAR_DIR', 'PSAR_AF', 'PSAR_EP'], res):
+        df[key][-1] = arr[-1]
 
 def SAR(df, incr = 0.005, maxaf = 0.02):                                           
     sar = talib.SAR(df['high'].values, df['low'].values, acceleration=incr, maximum=maxaf)
@@ -910,6 +1295,30 @@ def ASCTREND(df, n, risk = 3, stop_ratio = 0.5, atr_mode = 0):
     stop[trend < 0] = df['high'] + stop_ratio * atr
     return pd.concat([signal, trend, stop], join='outer', axis=1)
     
+ribbon_chunk_size = 1 << 20
+
+def ribbon_spearman(ma_array):
+    ''' Spearman correlation and p-value of each row of ma_array against the ribbon order
+        len(ma_series)..1, ties get average ranks as in stats.spearmanr'''
+    ma_array = np.atleast_2d(ma_array)
+    nlen = ma_array.shape[1]
+    rx = np.empty(ma_array.shape)
+    ry = np.arange(nlen, 0, -1, dtype = float) - (nlen + 1) / 2.0
+    # the pairwise comparisons are rows x nlen x nlen, so they go in chunks of about a million
+    step = max(int(ribbon_chunk_size / (nlen * nlen)), 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        for start in range(0, len(ma_array), step):
+            chunk = ma_array[start:start + step]
+            less = (chunk[:, None, :] < chunk[:, :, None]).sum(axis = 2)
+            equal = (chunk[:, None, :] == chunk[:, :, None]).sum(axis = 2)
+            rx[start:start + step] = less + (equal + 1) / 2.0 - (nlen + 1) / 2.0
+        corr = (rx * ry).sum(axis = 1) / np.sqrt((rx * rx).sum(axis = 1) * (ry * ry).sum())
+        corr = np.clip(corr, -1.0, 1.0)
+        corr[np.isnan(ma_array).any(axis = 1)] = np.nan
+        tstat = corr * np.sqrt((nlen - 2) / ((corr + 1.0) * (1.0 - corr)))
+        pval = 2 * stats.t.sf(np.abs(tstat), nlen - 2)
+    return corr, pval
+
 def MA_RIBBON(df, ma_series):
     ma_array = np.zeros([len(df), len(ma_series)])
     ema_list = []
@@ -924,25 +1333,24 @@ def MA_RIBBON(df, ma_series):
     pval[:] = np.NAN
     dist[:] = np.NAN
     max_n = max(ma_series)
-    for idy in range(len(df)):
-        if idy >= max_n - 1:
-            corr[idy], pval[idy] = stats.spearmanr(ma_array[idy,:], range(len(ma_series), 0, -1))
-            dist[idy] = max(ma_array[idy,:]) - min(ma_array[idy,:])
+    if len(df) >= max_n:
+        corr[max_n-1:], pval[max_n-1:] = ribbon_spearman(ma_array[max_n-1:])
+        dist[max_n-1:] = ma_array[max_n-1:].max(axis = 1) - ma_array[max_n-1:].min(axis = 1)
     corr_ts = pd.Series(corr*100, index = df.index, name = "MARIBBON_CORR")
     pval_ts = pd.Series(pval*100, index = df.index, name = "MARIBBON_PVAL")
     dist_ts = pd.Series(dist, index = df.index, name = "MARIBBON_DIST")
     return pd.concat([corr_ts, pval_ts, dist_ts] + ema_list, join='outer', axis=1)
     
 def ma_ribbon(df, ma_series):
-    ma_array = np.zeros([len(df)])
+    ma_array = np.zeros([len(ma_series)])
     for idx, ma_len in enumerate(ma_series):
         key = 'EMA_CLOSE_' + str(ma_len)
         ema(df, ma_len, field = 'close')
         ma_array[idx] = df[key][-1]
-    corr, pval = stats.spearmanr(ma_array, range(len(ma_series), 0, -1))
+    corr, pval = ribbon_spearman(ma_array)
     dist = max(ma_array) - min(ma_array)
-    df["MARIBBON_CORR"][-1] = corr * 100
-    df["MARIBBON_PVAL"][-1] = pval * 100
+    df["MARIBBON_CORR"][-1] = corr[0] * 100
+    df["MARIBBON_PVAL"][-1] = pval[0] * 100
     df["MARIBBON_DIST"][-1] = dist
     
 def AROON(df, n):
@@ -958,24 +1366,64 @@ def aroon(df, n):
 
 def DT_RNG(df, win = 2, ratio = 0.7):
     if win == 0:
-        tr_ts = pd.concat([(pd.rolling_max(df['high'], 2) - pd.rolling_min(df['close'], 2))*0.5,
-                        (pd.rolling_max(df['close'], 2) - pd.rolling_min(df['low'], 2))*0.5,
+        tr_ts = pd.concat([(rolling_max(df['high'], 2) - rolling_min(df['close'], 2))*0.5,
+                        (rolling_max(df['close'], 2) - rolling_min(df['low'], 2))*0.5,
                         df['high'] - df['close'],
                         df['close'] - df['low']],
                         join='outer', axis=1).max(axis=1)
     else:
-        tr_ts = pd.concat([pd.rolling_max(df['high'], win) - pd.rolling_min(df['close'], win),
-                       pd.rolling_max(df['close'], win) - pd.rolling_min(df['low'], win)],
+        tr_ts = pd.concat([rolling_max(df['high'], win) - rolling_min(df['close'], win),
+                       rolling_max(df['close'], win) - rolling_min(df['low'], win)],
                        join='outer', axis=1).max(axis=1)
     return pd.Series(tr_ts, name = 'DTRNG%s_%s' % (win, ratio))
 
-def dt_rng(df, win = 2, ratio = 0.7):
+def dt_rng(df, win = 2, ratio = 0.7, ext_bufs = None):
+    ''' ext_bufs is an optional {'high', 'close', 'low'} dict of RollingExtrema(max(win, 2)) '''
     key = 'DTRNG%s_%s' % (win, ratio)
-    if win > 0:
-        df[key][-1] = max(max(df['high'][-win:]) - min(df['close'][-win:]),
-                                max(df['close'][-win:]) - min(df['low'][-win:]))
-    elif win == 0:
-        df[key][-1] = max(max(df['high'][-2:]) - min(df['close'][-2:]),
-                                max(df['close'][-2:]) - min(df['low'][-2:]))
+    if win < 0:
+        return
+    n = win if win > 0 else 2
+    if ext_bufs == None:
+        df[key][-1] = max(max(df['high'][-n:]) - min(df['close'][-n:]),
+                                max(df['close'][-n:]) - min(df['low'][-n:]))
+    else:
+        for field in ['high', 'close', 'low']:
+            ext_bufs[field].update(df[field][-1], len(df[field]))
+        df[key][-1] = max(ext_bufs['high'].max() - ext_bufs['close'].min(),
+                                ext_bufs['close'].max() - ext_bufs['low'].min())
+    if win == 0:
         df[key][-1] = max(df[key][-1] * 0.5, df['high'][-1] - df['close'][-1],
                                 df['close'][-1] - df['low'][-1])
+
+def live_buffers(rfunc, df):
+    ''' rolling buffers of an fcustom wrapped per bar function, built from the bars before the
+        current one as the first call adds it. None for the functions without buffers '''
+    func = rfunc
+    kwargs = {}
+    while isinstance(func, functools.partial):
+        kwargs = dict(func.keywords or {}, **kwargs)
+        func = func.func
+    name = getattr(func, '__name__', '')
+    if name not in ['donch_h', 'donch_l', 'pct_channel', 'dvo', 'dt_rng']:
+        return None
+    spec = inspect.getargspec(func)
+    args = dict(zip(spec.args[-len(spec.defaults):], spec.defaults))
+    args.update(kwargs)
+    if name in ['donch_h', 'donch_l']:
+        n = args['n']
+        bufs = {'ext_buf': RollingExtrema(n, df[args['field']][-n:])}
+    elif name == 'pct_channel':
+        n = args['n']
+        bufs = {'rank_buf': RollingRank(n, df[args['field']][-n:])}
+    elif name == 'dvo':
+        bufs = {'rank_buf': RollingRank(args['M'], dvo_theta(df, args['w'], args['N'], args['s'], args['M']))}
+    else:
+        if args['win'] < 0:
+            return None
+        n = args['win'] if args['win'] > 0 else 2
+        bufs = {'ext_bufs': dict([(field, RollingExtrema(n, df[field][-n:])) for field in ['high', 'close', 'low']])}
+    # keyed by the bar count like the updates, so a rebuilt last bar replaces its value
+    for buf in bufs.values():
+        for item in (buf.values() if isinstance(buf, dict) else [buf]):
+            item.last_key = len(df)
+    return bufs
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# queue position aware limit order fills driven by L1/L5 market data snapshots:
+# an order joins the back of the displayed queue at its price after the insert latency,
+# the queue ahead is consumed by the traded volume at that price and shrinks with cancels,
+# marketable orders take the displayed depth and the rest stays in the book
+BUY = '0'
+SELL = '1'
+
+def md_seconds(data):
+    hh, mm, ss = [int(x) for x in str(data['UpdateTime']).split(':')]
+    return hh * 3600 + mm * 60 + ss + data.get('UpdateMillisec', 0) / 1000.0
+
+def md_levels(data, side, depth = 5):
+    price_key = 'BidPrice' if side == BUY else 'AskPrice'
+    vol_key = 'BidVolume' if side == BUY else 'AskVolume'
+    levels = []
+    for i in range(1, depth + 1):
+        price = data.get(price_key + str(i), 0)
+        vol = data.get(vol_key + str(i), 0)
+        if (vol > 0) and (0 < price < 1e+20):
+            levels.append([price, vol])
+    return levels
+
+class SimLimitOrder(object):
+    def __init__(self, order_ref, instrument, direction, price, volume, active_time):
+        self.order_ref = order_ref
+        self.instrument = instrument
+        self.direction = direction
+        self.price = price
+        self.volume = volume
+        self.filled = 0
+        self.queue_ahead = None
+        self.active_time = active_time
+        self.cancel_time = None
+        self.num_fills = 0
+        self.live = False
+
+    def remaining(self):
+        return self.volume - self.filled
+
+    def is_better(self, price):
+        ''' whether the order price is more aggressive than the price '''
+        if self.direction == BUY:
+            return self.price > price
+        else:
+            return self.price < price
+
+    def crosses(self, price):
+        if self.direction == BUY:
+            return self.price >= price
+        else:
+            return self.price <= price
+
+class QueueFillModel(object):
+    def __init__(self, latency = 0.0, cancel_latency = None, depth = 5):
+        self.latency = latency
+        self.cancel_latency = latency if cancel_latency == None else cancel_latency
+        self.depth = depth
+        self.orders = {}
+        self.inst_orders = {}
+        self.last_md = {}
+        self.last_time = {}
+        self.day_offset = {}
+
+    def now(self, instrument):
+        return self.last_time.get(instrument, 0.0)
+
+    def md_time(self, data):
+        inst = data['InstrumentID']
+        curr = md_seconds(data) + self.day_offset.get(inst, 0.0)
+        if curr < self.last_time.get(inst, 0.0) - 43200:
+            # night session passing midnight
+            self.day_offset[inst] = self.day_offset.get(inst, 0.0) + 86400
+            curr += 86400
+        return curr
+
+    def insert_order(self, order_ref, instrument, direction, price, volume):
+        order = SimLimitOrder(order_ref, instrument, direction, price, volume, self.now(instrument) + self.latency)
+        self.orders[order_ref] = order
+        self.inst_orders.setdefault(instrument, []).append(order)
+        return order
+
+    def cancel_order(self, order_ref):
+        if order_ref not in self.orders:
+            return False
+        order = self.orders[order_ref]
+        if order.cancel_time == None:
+            order.cancel_time = self.now(order.instrument) + self.cancel_latency
+        return True
+
+    def remove_order(self, order):
+        self.orders.pop(order.order_ref, None)
+        self.inst_orders[order.instrument].remove(order)
+
+    def fill(self, order, price, volume, fills):
+        volume = min(volume, order.remaining())
+        if volume <= 0:
+            return 0
+        order.filled += volume
+        order.num_fills += 1
+        fills.append(('trade', order, price, volume))
+        return volume
+
+    def activate(self, order, data, fills):
+        opp_side = SELL if order.direction == BUY else BUY
+        for level in md_levels(data, opp_side, self.depth):
+            if (order.remaining() <= 0) or (not order.crosses(level[0])):
+                break
+            self.fill(order, level[0], level[1], fills)
+        if order.remaining() > 0:
+            order.queue_ahead = self.displayed_volume(order, data)
+
+    def displayed_volume(self, order, data):
+        levels = md_levels(data, order.direction, self.depth)
+        if (len(levels) == 0) or order.is_better(levels[0][0]):
+            return 0
+        for price, vol in levels:
+            if price == order.price:
+                return vol
+        if (len(levels) < self.depth) or order.is_better(levels[-1][0]):
+            # inside the visible book at an empty level
+            return 0
+        return None
+
+    def match_resting(self, order, data, traded_vol, fills):
+        opp_side = SELL if order.direction == BUY else BUY
+        last_price = data['LastPrice']
+        opp_levels = md_levels(data, opp_side, self.depth)
+        if (traded_vol > 0) and order.is_better(last_price):
+            # the market traded through the order price, the whole queue at the level is gone
+            order.queue_ahead = 0
+            self.fill(order, order.price, order.remaining(), fills)
+            return
+        if (len(opp_levels) > 0) and order.crosses(opp_levels[0][0]):
+            order.queue_ahead = 0
+            for price, vol in opp_levels:
+                if not order.crosses(price):
+                    break
+                self.fill(order, order.price, vol, fills)
+            if order.remaining() <= 0:
+                return
+        shown = self.displayed_volume(order, data)
+        if order.queue_ahead == None:
+            order.queue_ahead = shown
+            return
+        if (traded_vol > 0) and (last_price == order.price):
+            left = traded_vol - order.queue_ahead
+            order.queue_ahead = max(order.queue_ahead - traded_vol, 0)
+            if left > 0:
+                self.fill(order, order.price, left, fills)
+        if (shown != None) and (shown < order.queue_ahead):
+            # orders ahead were cancelled
+            order.queue_ahead = shown
+
+    def on_market_data(self, data):
+        ''' returns a list of ('trade', order, price, volume) and ('cancel', order) '''
+        inst = data['InstrumentID']
+        curr_time = self.md_time(data)
+        prev = self.last_md.get(inst, None)
+        self.last_md[inst] = data
+        self.last_time[inst] = curr_time
+        fills = []
+        if len(self.inst_orders.get(inst, [])) == 0:
+            return fills
+        traded_vol = max(data['Volume'] - prev['Volume'], 0) if prev != None else 0
+        for order in list(self.inst_orders[inst]):
+            if order.active_time > curr_time:
+                continue
+            if (order.cancel_time != None) and (order.cancel_time <= order.active_time):
+                fills.append(('cancel', order))
+                self.remove_order(order)
+                continue
+            if not order.live:
+                order.live = True
+                self.activate(order, data, fills)
+            else:
+                self.match_resting(order, data, traded_vol, fills)
+            if order.remaining() <= 0:
+                self.remove_order(order)
+            elif (order.cancel_time != None) and (order.cancel_time <= curr_time):
+                fills.append(('cancel', order))
+                self.remove_order(order)
+        return fills
@@ -2,19 +2,31 @@
 import pandas as pd
 import time
 import os
+import heapq
+import itertools
 import instrument
 import csv
 import workdays
 import json
 import order
 import position
+import journal
+import throttle
+import risk
 from misc import *
 from eventEngine import *
 from vtConstant import *
 
+order_header = ['order_ref', 'local_id', 'sysID', 'inst', 'volume',
+                'filledvolume', 'filledprice', 'filledorders',
+                'action_type', 'direction', 'price_type',
+                'limitprice', 'order_time', 'status', 'order_class', 'trade_ref']
+
 ########################################################################
 class Gateway(object):
+    route_exchanges = []    # exchanges the gateway can route orders to
     """交易接口"""
+    margin_recon_interval = 500
 
     #----------------------------------------------------------------------
     def __init__(self, agent, gatewayName = 'Gateway'):
@@ -28,7 +40,15 @@ class Gateway(object):
         self.id2order = {}
         self.positions = {}
         self.instruments = []      # 已订阅合约代码
-        self.working_orders = []
+        self.working_orders = set()
+        self.order_queue = []   # heap of (priority, seq, msg_type, local_id)
+        self.queue_seq = itertools.count()
+        self.throttle = throttle.Throttle()
+        self.risk = risk.PreTradeRisk(self)
+        self.route_priority = 0
+        self.tdConnected = True
+        self.updated_orders = set()
+        self.order_journal = None
         self.process_flag = False
         self.eod_report = True
         self.account_info = {'available': 0,
@@ -41,6 +61,9 @@ class Gateway(object):
                             'tday_pnl': 0,
                             }
         self.pl_by_product = {}
+        self.dirty_insts = set()
+        self.dependents = {}
+        self.num_margin_updates = 0
         self.order_stats = {'total_submit': 0, 'total_failure': 0, 'total_cancel':0 }
         self.order_constraints = {	'total_submit': 2000, 'total_cancel': 2000, 'total_failure':500, \
                                     'submit_limit': 200,  'cancel_limit': 200,  'failure_limit': 200 }
@@ -60,6 +83,8 @@ class Gateway(object):
             return True
             
     def day_finalize(self, tday):
+        self.journal_orders(tday)
+        self.close_journal()
         self.save_local_positions(tday)
         if self.eod_report:
             self.process_eod_report(tday)
@@ -68,7 +93,8 @@ class Gateway(object):
             pos = self.positions[inst]
             eod_pos[inst] = [pos.curr_pos.long, pos.curr_pos.short]
         self.id2order  = {}
-        self.working_orders = []
+        self.working_orders = set()
+        self.order_queue = []
         self.positions = {}
         self.order_stats = {'total_submit': 0, 'total_failure': 0, 'total_cancel':0 }
         for inst in self.instruments:
@@ -79,6 +105,7 @@ class Gateway(object):
             self.positions[inst].pos_yday.short = eod_pos[inst][1]
             self.positions[inst].re_calc()
         self.account_info['prev_capital'] = self.account_info['curr_capital']
+        self.mark_dirty()
 
     def get_pos_class(self, inst):
         return (position.GrossPosition, {})
@@ -92,6 +119,11 @@ class Gateway(object):
             self.order_stats[instID] = {'submit': 0, 'cancel':0, 'failure': 0, 'status': True }
         if instID not in self.qry_pos:
             self.qry_pos[instID]   = {'tday': [0, 0], 'yday': [0, 0]}
+        self.risk.add_instrument(instID)
+        inst = self.agent.instruments[instID]
+        if inst.ptype == instrument.ProductType.Option:
+            self.dependents.setdefault(inst.underlying, set()).add(instID)
+        self.dirty_insts.add(instID)
 
     def event_subscribe(self):
         pass
@@ -185,57 +217,78 @@ class Gateway(object):
         event1.dict['data'] = contract
         self.eventEngine.put(event1)        
     
+    def get_order_journal(self, tday):
+        filename = self.file_prefix + 'order_' + tday.strftime('%y%m%d') + '.csv'
+        if (self.order_journal == None) or (self.order_journal.filename != filename):
+            self.close_journal()
+            self.order_journal = journal.StateJournal(filename, order_header)
+            self.order_journal.load()
+        return self.order_journal
+
+    def close_journal(self):
+        if self.order_journal != None:
+            self.order_journal.close()
+            self.order_journal = None
+
     def load_order_list(self, tday):
-        logfile = self.file_prefix + 'order_' + tday.strftime('%y%m%d') + '.csv'
-        if not os.path.isfile(logfile):
+        rows = self.get_order_journal(tday).load()
+        if len(rows) == 0:
             return {}
         self.id2order = {}
-        with open(logfile, 'rb') as f:
-            reader = csv.reader(f)
-            for idx, row in enumerate(reader):
-                if idx > 0:
-                    inst = row[3]
-                    order_class = eval('order.' + str(row[14]))
-                    filled_orders = {}
-                    if ':' not in row[7]:
-                        continue
-                    filled_str = row[7].split('|')                                        
-                    for fstr in filled_str:
-                        if (':' not in fstr) or ('_' not in fstr):
-                            continue
-                        forder = fstr.split(':')
-                        pair_str = forder[1].split('_')
-                        filled_orders[forder[0]] = [float(pair_str[0]), int(pair_str[1])]
-                    iorder = order_class(instID = inst, limit_price = float(row[11]), \
-                            volume = int(float(row[4])), order_time = int(float(row[12])), \
-                            action_type = row[8], direction = row[9], price_type = row[10], \
-                            trade_ref = int(float(row[15])), order_ref = int(row[0]), \
-                            sys_id = row[1], status = int(row[13]), \
-                            local_id = row[2], filled_orders = filled_orders, \
-                            filled_volume = int(float(row[5])), filled_price = float(row[6]))
-                    self.add_order(iorder)
+        for row in rows:
+            inst = row[3]
+            order_class = order.order_class_map[row[14]]
+            filled_orders = {}
+            if ':' not in row[7]:
+                continue
+            filled_str = row[7].split('|')                                        
+            for fstr in filled_str:
+                if (':' not in fstr) or ('_' not in fstr):
+                    continue
+                forder = fstr.split(':')
+                pair_str = forder[1].split('_')
+                filled_orders[forder[0]] = [float(pair_str[0]), int(pair_str[1])]
+            iorder = order_class(instID = inst, limit_price = float(row[11]), \
+                    volume = int(float(row[4])), order_time = int(float(row[12])), \
+                    action_type = row[8], direction = row[9], price_type = row[10], \
+                    trade_ref = int(float(row[15])), order_ref = int(row[0]), \
+                    sys_id = row[2], status = int(row[13]), \
+                    local_id = int(row[1]), filled_orders = filled_orders, \
+                    filled_volume = int(float(row[5])), filled_price = float(row[6]))
+            self.add_order(iorder)
+        self.updated_orders = set()
+
+    def order_row(self, iorder):
+        forders = [ str(key) + ':' + '_'.join([str(s) for s in iorder.filled_orders[key]]) for key in iorder.filled_orders if len(str(key))>0 ]
+        filled_str = '|'.join(forders)
+        return [iorder.order_ref, iorder.local_id, iorder.sys_id, iorder.instrument, iorder.volume,
+                iorder.filled_volume, iorder.filled_price, filled_str,
+                iorder.action_type, iorder.direction, iorder.price_type,
+                iorder.limit_price, iorder.start_tick, iorder.status, iorder.type, iorder.trade_ref]
+
+    def journal_orders(self, tday):
+        ''' append the orders changed since the last call, the working orders are checked for status changes '''
+        order_journal = self.get_order_journal(tday)
+        for local_id in self.updated_orders.union(self.working_orders):
+            if local_id in self.id2order:
+                order_journal.update(self.order_row(self.id2order[local_id]))
+        self.updated_orders = set()
 
     def save_order_list(self, tday):
         orders = self.id2order.keys()
         if len(self.id2order) > 1:
             orders.sort()
-        order_list = [self.id2order[key] for key in orders]
-        filename = self.file_prefix + 'order_' + tday.strftime('%y%m%d') + '.csv'
-        with open(filename, 'wb') as log_file:
-            file_writer = csv.writer(log_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL);
-            file_writer.writerow(
-                ['order_ref', 'local_id', 'sysID', 'inst', 'volume',
-                 'filledvolume', 'filledprice', 'filledorders',
-                 'action_type', 'direction', 'price_type',
-                 'limitprice', 'order_time', 'status', 'order_class', 'trade_ref'])
-            for iorder in order_list:
-                forders = [ str(key) + ':' + '_'.join([str(s) for s in iorder.filled_orders[key]]) for key in iorder.filled_orders if len(str(key))>0 ]
-                filled_str = '|'.join(forders)
-                file_writer.writerow(
-                    [iorder.order_ref, iorder.local_id, iorder.sys_id, iorder.instrument, iorder.volume,
-                     iorder.filled_volume, iorder.filled_price, filled_str,
-                     iorder.action_type, iorder.direction, iorder.price_type,
-                     iorder.limit_price, iorder.start_tick, iorder.status, iorder.type, iorder.trade_ref])
+        order_journal = self.get_order_journal(tday)
+        for key in orders:
+            order_journal.update(self.order_row(self.id2order[key]))
+        order_journal.compact()
+        self.updated_orders = set()
+
+    def on_order_update(self, iorder):
+        self.updated_orders.add(iorder.local_id)
+        if iorder.status not in order.Alive_Order_Status:
+            self.working_orders.discard(iorder.local_id)
+        self.mark_dirty(iorder.instIDs)
 
     def add_orders(self, orders):
         for iorder in orders:
@@ -244,25 +297,73 @@ class Gateway(object):
     def add_order(self, iorder):
         iorder.set_gateway(self)
         iorder.add_pos()
+        self.on_order_update(iorder)
         self.id2order[iorder.local_id] = iorder
         if (iorder.status in order.Alive_Order_Status) and (iorder.local_id not in self.working_orders):
-            self.working_orders.append(iorder.local_id)
-            self.process_flag = True
+            self.working_orders.add(iorder.local_id)
+            if iorder.status == order.OrderStatus.Ready:
+                self.queue_order('insert', iorder)
+
+    def queue_order(self, msg_type, iorder):
+        ''' cancels go first, then the closing orders, then the new entries '''
+        if msg_type == 'cancel':
+            priority = 0
+        elif iorder.action_type != OF_OPEN:
+            priority = 1
+        else:
+            priority = 2
+        heapq.heappush(self.order_queue, (priority, next(self.queue_seq), msg_type, iorder.local_id))
+        self.process_flag = True
+
+    def cancel_order(self, iorder):
+        self.queue_order('cancel', iorder)
+
+    def cancel_local(self, iorder):
+        ''' cancel an order which has not been sent out '''
+        iorder.on_cancel()
+        if iorder.trade_ref > 0:
+            event = Event(type=EVENT_ETRADEUPDATE)
+            event.dict['trade_ref'] = iorder.trade_ref
+            self.eventEngine.put(event)
 
     def send_queued_orders(self):
-        alive_orders = []
-        for local_id in self.working_orders:
-            iorder = self.id2order[local_id]
-            if iorder.status == order.OrderStatus.Ready:
+        ''' send the queued messages by priority as far as the throttle allows, the rest wait for the next call '''
+        deferred = []
+        while len(self.order_queue) > 0:
+            item = heapq.heappop(self.order_queue)
+            msg_type, local_id = item[2], item[3]
+            iorder = self.id2order.get(local_id, None)
+            if iorder == None:
+                continue
+            if msg_type == 'insert':
+                if iorder.status != order.OrderStatus.Ready:
+                    continue
+                reason = self.risk.check_order(iorder)
+                if reason != None:
+                    self.risk.on_reject(iorder, reason)
+                    self.cancel_local(iorder)
+                    self.onLog('rejected order local_id=%s by pre-trade risk: %s' % (iorder.local_id, reason), level = logging.WARNING)
+                    continue
+            elif iorder.status == order.OrderStatus.Ready:
+                # still in the queue, drop it without a message to the exchange
+                self.cancel_local(iorder)
+                continue
+            elif iorder.status not in order.Alive_Order_Status:
+                continue
+            if not self.throttle.acquire(msg_type, iorder.exchange, iorder.instrument):
+                deferred.append(item)
+                continue
+            if msg_type == 'insert':
                 self.sendOrder(iorder)
-                alive_orders.append(local_id)
-            elif iorder.status in [order.OrderStatus.Sent, order.OrderStatus.Waiting]:
-                alive_orders.append(local_id)
-        self.working_orders = alive_orders
-        self.process_flag = False
+            else:
+                self.cancelOrder(iorder)
+        for item in deferred:
+            heapq.heappush(self.order_queue, item)
+        self.process_flag = (len(self.order_queue) > 0)
         
     def remove_order(self, iorder):
         iorder.remove_pos()
+        self.mark_dirty(iorder.instIDs)
         self.id2order.pop(iorder.local_id, None)        
 
     def load_local_positions(self, tday):
@@ -301,8 +402,7 @@ class Gateway(object):
             with open(logfile,'wb') as log_file:
                 file_writer = csv.writer(log_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL);
                 for inst in self.positions:
-                    pos = self.positions[inst]
-                    pos.re_calc()
+                    self.positions[inst].reconcile()
                 self.calc_margin()
                 file_writer.writerow(['capital', self.account_info['curr_capital']])
                 for inst in self.positions:
@@ -322,36 +422,74 @@ class Gateway(object):
                             direction = direction, price_type = price_type, trade_ref = trade_ref) \
                             for (action_type, v) in order_offsets]
         self.add_orders(new_orders)
-        self.positions[instID].re_calc()
         return new_orders
 
-    def calc_margin(self):
-        for instID in self.positions:
-            inst = self.agent.instruments[instID]
-            pos = self.positions[instID]
-            under_price = 0.0
-            if (inst.ptype == instrument.ProductType.Option):
-                under_price = self.agent.instruments[inst.underlying].price
-            self.pl_by_product[instID] = {}
-            self.pl_by_product[instID]['yday_mark'] = inst.prev_close
-            self.pl_by_product[instID]['tday_mark'] = inst.price
-            self.pl_by_product[instID]['new_long']  = pos.tday_pos.long
-            self.pl_by_product[instID]['new_short'] = pos.tday_pos.short
-            self.pl_by_product[instID]['new_long_avg'] = pos.tday_avp.long
-            self.pl_by_product[instID]['new_short_avg'] = pos.tday_avp.short
-            self.pl_by_product[instID]['locked_margin'] =  pos.locked_pos.long * inst.calc_margin_amount(ORDER_BUY, under_price)
-            self.pl_by_product[instID]['locked_margin'] += pos.locked_pos.short * inst.calc_margin_amount(ORDER_SELL, under_price) 
-            self.pl_by_product[instID]['used_margin'] =  pos.curr_pos.long * inst.calc_margin_amount(ORDER_BUY, under_price)
-            self.pl_by_product[instID]['used_margin'] += pos.curr_pos.short * inst.calc_margin_amount(ORDER_SELL, under_price)
-            self.pl_by_product[instID]['yday_pos'] = pos.pos_yday.long - pos.pos_yday.short
-            self.pl_by_product[instID]['yday_pnl'] = (pos.pos_yday.long - pos.pos_yday.short) * (inst.price - inst.prev_close) * inst.multiple
-            self.pl_by_product[instID]['tday_pnl'] =  pos.tday_pos.long * (inst.price-pos.tday_avp.long) * inst.multiple
-            self.pl_by_product[instID]['tday_pnl'] -= pos.tday_pos.short * (inst.price-pos.tday_avp.short) * inst.multiple            
-        for key in ['locked_margin', 'used_margin', 'yday_pnl', 'tday_pnl']:
-            self.account_info[key] = sum([self.pl_by_product[instID][key] for instID in self.positions])
+    def mark_dirty(self, instIDs = None):
+        ''' flag the margin and pnl of the instruments (all if None) and the options on them for recalculation '''
+        if instIDs == None:
+            self.dirty_insts.update(self.positions.keys())
+            return
+        for instID in instIDs:
+            if instID in self.positions:
+                self.dirty_insts.add(instID)
+            if instID in self.dependents:
+                self.dirty_insts.update(self.dependents[instID])
+
+    def calc_product_pl(self, instID):
+        inst = self.agent.instruments[instID]
+        pos = self.positions[instID]
+        under_price = 0.0
+        if (inst.ptype == instrument.ProductType.Option):
+            under_price = self.agent.instruments[inst.underlying].price
+        long_margin = inst.calc_margin_amount(ORDER_BUY, under_price)
+        short_margin = inst.calc_margin_amount(ORDER_SELL, under_price)
+        res = {}
+        res['yday_mark'] = inst.prev_close
+        res['tday_mark'] = inst.price
+        res['new_long']  = pos.tday_pos.long
+        res['new_short'] = pos.tday_pos.short
+        res['new_long_avg'] = pos.tday_avp.long
+        res['new_short_avg'] = pos.tday_avp.short
+        res['locked_margin'] = pos.locked_pos.long * long_margin + pos.locked_pos.short * short_margin
+        res['used_margin'] = pos.curr_pos.long * long_margin + pos.curr_pos.short * short_margin
+        res['yday_pos'] = pos.pos_yday.long - pos.pos_yday.short
+        res['yday_pnl'] = (pos.pos_yday.long - pos.pos_yday.short) * (inst.price - inst.prev_close) * inst.multiple
+        res['tday_pnl'] =  pos.tday_pos.long * (inst.price-pos.tday_avp.long) * inst.multiple
+        res['tday_pnl'] -= pos.tday_pos.short * (inst.price-pos.tday_avp.short) * inst.multiple
+        return res
+
+    def update_margin(self):
+        ''' recalculate the dirty instruments only and apply the changes to the account sums '''
+        if len(self.dirty_insts) == 0:
+            return self.account_info
+        sum_keys = ['locked_margin', 'used_margin', 'yday_pnl', 'tday_pnl']
+        for instID in self.dirty_insts:
+            if instID not in self.positions:
+                continue
+            curr = self.calc_product_pl(instID)
+            prev = self.pl_by_product.get(instID, None)
+            for key in sum_keys:
+                self.account_info[key] += curr[key] - (prev[key] if prev != None else 0)
+            self.pl_by_product[instID] = curr
+        self.num_margin_updates += len(self.dirty_insts)
+        self.dirty_insts = set()
+        if self.num_margin_updates >= max(self.margin_recon_interval, len(self.positions)):
+            # re-sum to clear the rounding drift of the running sums
+            for key in sum_keys:
+                self.account_info[key] = sum([self.pl_by_product[instID][key] for instID in self.positions])
+            self.num_margin_updates = 0
         self.account_info['pnl_total'] = self.account_info['yday_pnl'] + self.account_info['tday_pnl']
         self.account_info['curr_capital'] = self.account_info['prev_capital'] + self.account_info['pnl_total']
         self.account_info['available'] = self.account_info['curr_capital'] - self.account_info['locked_margin']
+        return self.account_info
+
+    def calc_margin(self):
+        self.pl_by_product = {}
+        for key in ['locked_margin', 'used_margin', 'yday_pnl', 'tday_pnl']:
+            self.account_info[key] = 0
+        self.num_margin_updates = 0
+        self.mark_dirty()
+        self.update_margin()
 
     #----------------------------------------------------------------------
     def connect(self):
@@ -435,8 +573,6 @@ class GrossGateway(Gateway):
                             direction = direction, price_type = price_type, \
                             trade_ref = trade_ref)
         self.add_order(new_order)
-        for inst in instIDs:
-            self.positions[inst].re_calc()
         return [new_order]
         
 ########################################################################
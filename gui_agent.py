@@ -365,7 +365,8 @@ class MainApp(object):
                 res[field] = {'total': sum_risk, 'strats': risk_dict }
             elif field == 'Account':
                 gateway = self.agent.gateways[field_list[1]]
-                res[field][gateway.gatewayName] = dict([(variable2field(var), gateway.account_info[var]) for var in gateway.account_info])
+                account_info = gateway.update_margin()
+                res[field][gateway.gatewayName] = dict([(variable2field(var), account_info[var]) for var in account_info])
             elif field ==' Orderstats':
                 gateway = self.agent.gateways[field_list[1]]
                 res[field][gateway.gatewayName] = dict([(variable2field(var), gateway.order_stats[var]) for var in gateway.order_stats])
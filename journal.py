@@ -0,0 +1,183 @@
+#-*- coding:utf-8 -*-
+import os
+import csv
+import time
+import Queue
+import logging
+import threading
+from collections import OrderedDict
+
+def write_csv_file(filename, rows, header = None):
+    ''' write to a temp file and rename it, so a crash never leaves a partial file '''
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'wb') as log_file:
+        file_writer = csv.writer(log_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+        if header != None:
+            file_writer.writerow(header)
+        for row in rows:
+            file_writer.writerow(row)
+        log_file.flush()
+        os.fsync(log_file.fileno())
+    if os.name == 'nt' and os.path.isfile(filename):
+        os.remove(filename)
+    os.rename(tmp_file, filename)
+
+def read_csv_rows(filename, ncols = None):
+    rows = []
+    if not os.path.isfile(filename):
+        return rows
+    with open(filename, 'rb') as f:
+        reader = csv.reader(f, delimiter=',', quotechar='|')
+        for row in reader:
+            # a row cut short by a crash in the middle of a write is dropped
+            if (ncols == None) or (len(row) == ncols):
+                rows.append(row)
+    return rows
+
+class RowBuffer(list):
+    ''' stands in for a csv writer to collect the rows in memory '''
+    def writerow(self, row):
+        self.append(list(row))
+
+class StateJournal(object):
+    ''' keeps the latest row of each key in a csv snapshot plus an append only journal of the changed rows.
+        The rows are written and fsync-ed in batches by a writer thread, and the journal is compacted into
+        the snapshot once it grows past compact_size. Recovery replays the snapshot and then the journal.'''
+    def __init__(self, filename, header, key_col = 0, sync_batch = 50, sync_interval = 1.0, compact_size = 5000):
+        self.filename = filename
+        self.journal_file = filename + '.jnl'
+        self.header = header
+        self.key_col = key_col
+        self.sync_batch = sync_batch
+        self.sync_interval = sync_interval
+        self.compact_size = compact_size
+        self.rows = OrderedDict()
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+        self.thread = None
+
+    def load(self):
+        ''' returns the latest rows, the journal left by an interrupted compaction is replayed first '''
+        ncols = len(self.header)
+        rows = OrderedDict()
+        snapshot = read_csv_rows(self.filename, ncols)
+        for row in snapshot[1:] + read_csv_rows(self.journal_file + '.old', ncols) + read_csv_rows(self.journal_file, ncols):
+            rows[row[self.key_col]] = row
+        with self.lock:
+            self.rows = rows
+        return rows.values()
+
+    def update(self, row):
+        ''' queue the row if it has changed since the last update of its key '''
+        row = ['' if x is None else (repr(x) if type(x) == float else str(x)) for x in row]
+        key = row[self.key_col]
+        with self.lock:
+            if self.rows.get(key, None) == row:
+                return False
+            self.rows[key] = row
+        self.put(('row', row))
+        return True
+
+    def compact(self):
+        self.put(('compact', None))
+
+    def put(self, cmd):
+        if self.thread == None:
+            self.thread = threading.Thread(target = self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put(cmd)
+
+    def close(self):
+        ''' write out the queued rows, compact and stop the writer thread '''
+        if self.thread != None:
+            self.queue.put(('compact', None))
+            self.queue.put(('stop', None))
+            self.thread.join()
+            self.thread = None
+
+    def write_snapshot(self):
+        journal_old = self.journal_file + '.old'
+        if os.path.isfile(self.journal_file):
+            if os.name == 'nt' and os.path.isfile(journal_old):
+                os.remove(journal_old)
+            os.rename(self.journal_file, journal_old)
+        with self.lock:
+            rows = self.rows.values()
+        write_csv_file(self.filename, rows, self.header)
+        if os.path.isfile(journal_old):
+            os.remove(journal_old)
+
+    def run(self):
+        log_file = open(self.journal_file, 'ab')
+        file_writer = csv.writer(log_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+        num_unsynced = 0
+        num_rows = 0
+        last_sync = time.time()
+        while True:
+            try:
+                cmd, row = self.queue.get(timeout = self.sync_interval)
+            except Queue.Empty:
+                cmd, row = ('sync', None)
+            if cmd == 'row':
+                file_writer.writerow(row)
+                num_unsynced += 1
+                num_rows += 1
+            if (num_unsynced > 0) and ((cmd != 'row') or (num_unsynced >= self.sync_batch) \
+                                       or (time.time() - last_sync >= self.sync_interval)):
+                log_file.flush()
+                os.fsync(log_file.fileno())
+                num_unsynced = 0
+                last_sync = time.time()
+            if (cmd == 'compact') or (num_rows >= self.compact_size):
+                log_file.close()
+                try:
+                    self.write_snapshot()
+                except (IOError, OSError) as e:
+                    logging.warning('failed to compact the journal %s: %s' % (self.journal_file, e))
+                log_file = open(self.journal_file, 'ab')
+                file_writer = csv.writer(log_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+                num_rows = 0
+            if cmd == 'stop':
+                break
+        log_file.close()
+
+class SnapshotWriter(object):
+    ''' rewrites whole files from a writer thread, only the latest pending rows of a file are written '''
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.cond = threading.Condition()
+        self.busy = False
+        self.thread = None
+
+    def write(self, filename, rows, header = None):
+        with self.cond:
+            self.pending[filename] = (rows, header)
+            if self.thread == None:
+                self.thread = threading.Thread(target = self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify_all()
+
+    def flush(self):
+        ''' block until all the pending files are written '''
+        with self.cond:
+            while (len(self.pending) > 0) or self.busy:
+                self.cond.wait(1.0)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while len(self.pending) == 0:
+                    self.cond.wait()
+                filename, (rows, header) = self.pending.popitem(last = False)
+                self.busy = True
+            try:
+                write_csv_file(filename, rows, header)
+            except (IOError, OSError) as e:
+                logging.warning('failed to write %s: %s' % (filename, e))
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+
+snapshot_writer = SnapshotWriter()
@@ -10,6 +10,7 @@ import csv
 import pyktlib
 import dbaccess
 import trade
+import journal
 import instrument
 import pandas as pd
 import data_handler as dh
@@ -68,16 +69,16 @@ class OptionStrategy(object):
     def save_state(self):
         filename = self.folder + 'strat_status.csv'
         self.on_log('save state for strat = %s' % self.name, level = logging.DEBUG)
-        with open(filename,'wb') as log_file:
-            file_writer = csv.writer(log_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL);
-            for i in range(len(self.risk_table)):
-                file_writer.writerow([self.risk_table.data['name'][i], \
-                                      self.risk_table.data['pos_long'][i], self.risk_table.data['pos_short'][i], \
-                                      self.risk_table.data['out_long'][i], self.risk_table.data['out_short'][i]])
+        rows = [[self.risk_table.data['name'][i], \
+                  self.risk_table.data['pos_long'][i], self.risk_table.data['pos_short'][i], \
+                  self.risk_table.data['out_long'][i], self.risk_table.data['out_short'][i]] \
+                 for i in range(len(self.risk_table))]
+        journal.snapshot_writer.write(filename, rows)
             
     def load_state(self):
         self.on_log('load state for strat = %s' % self.name, level = logging.DEBUG)
         filename = self.folder + 'strat_status.csv'
+        journal.snapshot_writer.flush()
         if not os.path.isfile(filename):
             return
         with open(filename, 'rb') as f:
@@ -40,6 +40,7 @@ class Order(object):
         self.positions = []
         self.status = kwargs.get('status', OrderStatus.Ready)
         self.gateway = None
+        self.xtrade = None
 
     def set_gateway(self, gateway):
         self.gateway = gateway
@@ -47,16 +48,21 @@ class Order(object):
         self.exchange = gateway.agent.instruments[self.instIDs[0]].exchange
 
     def recalc_pos(self):
+        ''' push the latest fill/cancel state to the positions and the parent trade '''
         for pos in self.positions:
-            pos.re_calc()
+            pos.update_order(self)
+        if self.gateway != None:
+            self.gateway.on_order_update(self)
+        if self.xtrade != None:
+            self.xtrade.update_order(self)
 
     def add_pos(self):
         for pos in self.positions:
-            pos.orders.append(self)
+            pos.add_order(self)
             
     def remove_pos(self):
         for pos in self.positions:
-            pos.orders.remove(self)
+            pos.remove_order(self)
 
     def on_trade(self, price, volume, trade_id):
         ''' 返回是否完全成交
@@ -85,8 +91,8 @@ class Order(object):
             self.filled_volume = volume
             if self.filled_volume == self.volume:
                 self.status = OrderStatus.Done
-                self.recalc_pos()
-                return True
+            self.recalc_pos()
+            return self.status == OrderStatus.Done
         return False
 
     def on_cancel(self):    #已经撤单
@@ -125,13 +131,21 @@ class SpreadOrder(Order):
                                    filled_price = 0)
             self.sub_orders.append(sorder)
 
+    def recalc_pos(self):
+        for pos, sorder in zip(self.positions, self.sub_orders):
+            pos.update_order(sorder)
+        if self.gateway != None:
+            self.gateway.on_order_update(self)
+        if self.xtrade != None:
+            self.xtrade.update_order(self)
+
     def add_pos(self):
         for pos, sorder in zip(self.positions, self.sub_orders):
-            pos.orders.append(sorder)
+            pos.add_order(sorder)
 
     def remove_pos(self):
         for pos, sorder in zip(self.positions, self.sub_orders):
-            pos.orders.remove(sorder)        
+            pos.remove_order(sorder)        
 
     def update(self):
         super(SpreadOrder, self).update()
@@ -142,3 +156,5 @@ class SpreadOrder(Order):
             sorder.filled_price = p
             curr_p += p * unit
         self.sub_orders[0].filled_price -= (curr_p - self.filled_price)/self.units[0]
+
+order_class_map = {'Order': Order, 'SpreadOrder': SpreadOrder}
@@ -0,0 +1,256 @@
+import sys
+import os
+import json
+import datetime
+import numpy as np
+import pandas as pd
+import backtest
+
+class RandomSampler(object):
+    def __init__(self, dims, seed = None):
+        self.dims = list(dims)
+        self.size = int(np.prod(self.dims))
+        self.rng = np.random.RandomState(seed)
+
+    def candidates(self, excluded, max_num = 20000):
+        if self.size <= max_num:
+            flat = np.arange(self.size)
+        else:
+            flat = np.unique(self.rng.randint(0, self.size, max_num))
+        if len(excluded) > 0:
+            flat = np.setdiff1d(flat, np.array(list(excluded)))
+        return flat
+
+    def propose(self, n, history, excluded):
+        cands = self.candidates(excluded)
+        if len(cands) <= n:
+            return list(cands)
+        return list(self.rng.choice(cands, n, replace = False))
+
+class LHSampler(RandomSampler):
+    def propose(self, n, history, excluded):
+        out = []
+        for i in range(3):
+            strata = [(self.rng.permutation(n) + self.rng.uniform(size = n)) / n for dim in self.dims]
+            pts = [np.minimum((u * dim).astype(int), dim - 1) for u, dim in zip(strata, self.dims)]
+            flat = np.ravel_multi_index(pts, self.dims)
+            out = [ix for ix in pd.unique(np.r_[out, flat].astype(int)) if ix not in excluded]
+            if len(out) >= n:
+                break
+        if len(out) < n:
+            rest = super(LHSampler, self).propose(n - len(out), history, excluded.union(out))
+            out = out + rest
+        return out[:n]
+
+class SurrogateSampler(RandomSampler):
+    def __init__(self, dims, seed = None, length_scale = 0.25, kappa = 2.0, noise = 0.1):
+        super(SurrogateSampler, self).__init__(dims, seed)
+        self.length_scale = length_scale
+        self.kappa = kappa
+        self.noise = noise
+        self.init_sampler = LHSampler(dims, seed)
+
+    def coords(self, flat):
+        scale = np.array([max(dim - 1, 1) for dim in self.dims], dtype = float)
+        return np.array(np.unravel_index(np.asarray(flat, dtype = int), self.dims), dtype = float).T / scale
+
+    def kernel(self, xa, xb):
+        d2 = ((xa[:, None, :] - xb[None, :, :]) ** 2).sum(axis = 2)
+        return np.exp(-0.5 * d2 / self.length_scale ** 2)
+
+    def propose(self, n, history, excluded):
+        keys = [ix for ix in history if np.isfinite(history[ix])]
+        if len(keys) < 2 * len(self.dims) + 1:
+            return self.init_sampler.propose(n, history, excluded)
+        cands = self.candidates(excluded)
+        if len(cands) <= n:
+            return list(cands)
+        x_cand = self.coords(cands)
+        x_train = self.coords(keys)
+        y = np.array([history[ix] for ix in keys], dtype = float)
+        y_std = y.std() if y.std() > 0 else 1.0
+        y_train = (y - y.mean()) / y_std
+        out = []
+        for i in range(n):
+            K = self.kernel(x_train, x_train) + self.noise * np.eye(len(x_train))
+            K_inv = np.linalg.inv(K)
+            k_star = self.kernel(x_cand, x_train)
+            mean = k_star.dot(K_inv.dot(y_train))
+            var = np.maximum(1.0 - (k_star.dot(K_inv) * k_star).sum(axis = 1), 0.0)
+            acq = mean + self.kappa * np.sqrt(var)
+            acq[np.in1d(cands, out)] = -np.inf
+            best = int(np.argmax(acq))
+            out.append(int(cands[best]))
+            # kriging believer, the pick is added at its predicted mean so the batch spreads out
+            x_train = np.vstack([x_train, x_cand[best:best+1]])
+            y_train = np.r_[y_train, mean[best]]
+        return out
+
+sampler_map = {'random': RandomSampler,
+               'lhs': LHSampler,
+               'surrogate': SurrogateSampler,}
+
+class ParamSearchManager(backtest.BacktestManager):
+    def __init__(self, config_file):
+        super(ParamSearchManager, self).__init__(config_file)
+        self.scen_dim = [len(self.scen_param[key]) for key in self.scen_keys]
+        self.search_method = self.sim_config.get('search_method', 'lhs')
+        self.search_budget = self.sim_config.get('search_budget', 100)
+        self.search_batch = self.sim_config.get('search_batch', 10)
+        self.search_objective = self.sim_config.get('search_objective', 'sharp_ratio')
+        self.search_seed = self.sim_config.get('search_seed', None)
+        self.search_patience = self.sim_config.get('search_patience', 0)
+        self.prune_level = self.sim_config.get('search_prune_level', None)
+        self.prune_radius = self.sim_config.get('search_prune_radius', 1)
+        self.halving_eta = self.sim_config.get('halving_eta', 3)
+        self.halving_rungs = self.sim_config.get('halving_rungs', 3)
+
+    def score(self, res):
+        val = res.get(self.search_objective, np.nan)
+        if (val == None) or (not np.isfinite(val)):
+            return -np.inf
+        return float(val)
+
+    def neighbours(self, ix):
+        center = np.array(np.unravel_index(ix, self.scen_dim))
+        steps = [range(-self.prune_radius, self.prune_radius + 1)] * len(self.scen_dim)
+        out = []
+        for shift in np.ndindex(*[len(x) for x in steps]):
+            pt = center + np.array(shift) - self.prune_radius
+            if np.all(pt >= 0) and np.all(pt < np.array(self.scen_dim)):
+                out.append(int(np.ravel_multi_index(pt, self.scen_dim)))
+        return out
+
+    def eval_full(self, idx, ix, output):
+        s = [int(seq) for seq in np.unravel_index(ix, self.scen_dim)]
+        res, _ = self.run_scenario(idx, ix, s, output)
+        return self.score(res)
+
+    def eval_partial(self, idx, ix, start_date):
+        s = [int(seq) for seq in np.unravel_index(ix, self.scen_dim)]
+        for key, seq in zip(self.scen_keys, s):
+            self.config[key] = self.scen_param[key][seq]
+        if self.stream_chunk != None:
+            # no min data is held in stream mode, stream the shorter period instead
+            sdate = self.config['start_date']
+            self.config['start_date'] = start_date
+            try:
+                chunks = backtest.prefetch(backtest.nearby_chunks(self.sim_assets[idx][0], self.config, \
+                                                                  self.stream_chunk, self.need_shift))
+                self.config['mdf'] = next(chunks)
+                sim_strat = self.sim_class(self.config)
+                sim_df, closed_trades = sim_strat.run_stream_sim(chunks, warmup = self.stream_warmup)
+            finally:
+                self.config['start_date'] = sdate
+        else:
+            self.prepare_data(idx, cont_idx = 0)
+            mdf = self.config['mdf']
+            self.config['mdf'] = mdf[mdf['date'] >= start_date]
+            sim_strat = self.sim_class(self.config)
+            sim_df, closed_trades = getattr(sim_strat, self.sim_func)()
+            self.config['mdf'] = mdf
+        (res_pnl, ts) = self.get_pnl_stats([sim_df], self.config['marginrate'], 'm')
+        return self.score(res_pnl)
+
+    def run_sampler(self, idx, output):
+        history = dict([(int(ix), self.score(res)) for ix, res in output.items()])
+        excluded = set(history.keys())
+        sampler = sampler_map[self.search_method](self.scen_dim, self.search_seed)
+        best = max(history.values()) if len(history) > 0 else -np.inf
+        no_improve = 0
+        num_eval = len(history)
+        while num_eval < self.search_budget:
+            batch = sampler.propose(min(self.search_batch, self.search_budget - num_eval), history, excluded)
+            if len(batch) == 0:
+                break
+            for ix in batch:
+                ix = int(ix)
+                history[ix] = self.eval_full(idx, ix, output)
+                excluded.add(ix)
+                num_eval += 1
+                if (self.prune_level != None) and (history[ix] < self.prune_level):
+                    excluded.update(self.neighbours(ix))
+            batch_best = max([history[int(ix)] for ix in batch])
+            if batch_best > best:
+                best = batch_best
+                no_improve = 0
+            else:
+                no_improve += 1
+            if (self.search_patience > 0) and (no_improve >= self.search_patience):
+                print 'search stopped early for asset = %s after %s sims' % (self.sim_assets[idx], num_eval)
+                break
+        return history
+
+    def halving_file(self, idx):
+        asset = self.sim_assets[idx]
+        return self.file_prefix + '_' + '_'.join([self.sim_mode] + asset) + '_halving.json'
+
+    def load_halving(self, idx):
+        fname = self.halving_file(idx)
+        state = {}
+        if os.path.isfile(fname):
+            with open(fname, 'r') as fp:
+                state = json.load(fp)
+        return state
+
+    def save_halving(self, idx, state):
+        with open(self.halving_file(idx), 'w') as fp:
+            json.dump(state, fp)
+
+    def run_halving(self, idx, output):
+        # the candidates left after each rung are saved, so an interrupted run picks up at the last rung
+        state = self.load_halving(idx)
+        if 'cands' in state:
+            cands = [int(ix) for ix in state['cands']]
+            start_rung = state['rung']
+        else:
+            sampler = LHSampler(self.scen_dim, self.search_seed)
+            excluded = set([int(ix) for ix in output.keys()])
+            cands = [int(ix) for ix in sampler.propose(self.search_budget, {}, excluded)]
+            start_rung = self.halving_rungs - 1
+            self.save_halving(idx, {'rung': start_rung, 'cands': cands})
+        end_date = self.config['end_date']
+        start_date = self.config['start_date']
+        num_days = (end_date - start_date).days
+        for rung in range(start_rung, 0, -1):
+            if len(cands) <= 1:
+                break
+            rung_start = end_date - datetime.timedelta(days = int(num_days / (self.halving_eta ** rung)))
+            scores = dict([(ix, self.eval_partial(idx, ix, rung_start)) for ix in cands])
+            ranked = sorted(cands, key = lambda ix: scores[ix], reverse = True)
+            cands = ranked[:max(int(len(ranked) / self.halving_eta), 1)]
+            if self.prune_level != None:
+                cands = [ix for ix in cands if scores[ix] >= self.prune_level] or ranked[:1]
+            self.save_halving(idx, {'rung': rung - 1, 'cands': cands})
+        history = dict([(int(ix), self.score(res)) for ix, res in output.items()])
+        for ix in cands:
+            if ix not in history:
+                history[ix] = self.eval_full(idx, ix, output)
+        self.save_halving(idx, {'rung': 0, 'cands': cands, 'done': True})
+        return history
+
+    def run_all_assets(self):
+        self.restart()
+        for idx, asset in enumerate(self.sim_assets):
+            output = self.load_curr_results(idx)
+            if self.search_method == 'halving':
+                if self.load_halving(idx).get('done', False):
+                    continue
+            elif len(output.keys()) >= min(self.search_budget, len(self.scenarios)):
+                continue
+            self.set_config(idx)
+            self.load_data(idx)
+            if self.search_method == 'halving':
+                self.run_halving(idx, output)
+            else:
+                self.run_sampler(idx, output)
+            if len(output) > 0:
+                self.update_summary(output)
+
+if __name__=="__main__":
+    args = sys.argv[1:]
+    if len(args) < 1:
+        print "need to input a file name for parameter search"
+    else:
+        search = ParamSearchManager(args[0])
+        search.run_all_assets()
@@ -0,0 +1,298 @@
+#-*- coding:utf-8 -*-
+import sys
+import os
+import gc
+import json
+import time
+import datetime
+import platform
+import tempfile
+import subprocess
+import traceback
+import numpy as np
+import pandas as pd
+import data_handler as dh
+import backtest
+import strategy as strat
+import bsopt
+
+bench_days = 120
+# the results file and the agent case files go here, not into the working folder
+bench_folder = os.environ.get('PERF_FOLDER', os.path.join(tempfile.gettempdir(), 'perf_bench'))
+
+def synthetic_min_data(n_days = bench_days, seed = 0, start_date = datetime.date(2016, 1, 4), roll_days = 40):
+    rng = np.random.RandomState(seed)
+    days = pd.bdate_range(start_date, periods = n_days)
+    mins = [(9, m) for m in range(0, 135)] + [(13, 30 + m) for m in range(0, 90)]
+    offsets = np.array([h * 60 + m for h, m in mins], dtype = 'timedelta64[m]')
+    idx = pd.DatetimeIndex((days.values[:, None] + offsets[None, :]).ravel())
+    nlen = len(idx)
+    close = 3000.0 * np.exp(np.cumsum(rng.randn(nlen) * 0.0008))
+    xopen = np.r_[close[0], close[:-1]] * (1 + rng.randn(nlen) * 0.0002)
+    spread = np.abs(rng.randn(nlen)) * 2.0 + 1.0
+    df = pd.DataFrame({'open': xopen, 'close': close}, index = idx)
+    df['high'] = np.maximum(xopen, close) + spread
+    df['low'] = np.minimum(xopen, close) - spread
+    df['volume'] = rng.randint(100, 2000, nlen)
+    df['openInterest'] = 100000 + np.cumsum(rng.randint(-50, 50, nlen))
+    df['date'] = idx.date
+    df['min_id'] = (idx.hour + 6) * 100 + idx.minute
+    day_no = np.repeat(np.arange(n_days), len(mins))
+    df['contract'] = ['rb%s' % (1605 + 5 * (d / roll_days)) for d in day_no]
+    df.index.name = 'datetime'
+    return df[['open', 'high', 'low', 'close', 'volume', 'openInterest', 'date', 'min_id', 'contract']]
+
+def synthetic_ticks(n_ticks = 20000, seed = 0, inst = 'rb1710', tday = '20170601', tick_size = 1.0):
+    rng = np.random.RandomState(seed)
+    mid = 3000 + np.round(np.cumsum(rng.randn(n_ticks) * 0.5))
+    volume = np.cumsum(rng.randint(0, 40, n_ticks))
+    ticks = []
+    for i in range(n_ticks):
+        secs = 9 * 3600 + i / 2
+        ticks.append({'InstrumentID': inst, 'ExchangeID': 'SHFE', 'TradingDay': tday,
+                      'UpdateTime': '%02d:%02d:%02d' % (secs / 3600, (secs / 60) % 60, secs % 60),
+                      'UpdateMillisec': 500 * (i % 2), 'LastPrice': mid[i], 'Volume': int(volume[i]),
+                      'OpenInterest': 100000, 'OpenPrice': mid[0], 'HighestPrice': mid[:i+1].max(),
+                      'LowestPrice': mid[:i+1].min(), 'PreClosePrice': mid[0], 'UpperLimitPrice': mid[0] * 1.1,
+                      'LowerLimitPrice': mid[0] * 0.9, 'BidPrice1': mid[i] - tick_size, 'BidVolume1': int(rng.randint(1, 200)),
+                      'AskPrice1': mid[i] + tick_size, 'AskVolume1': int(rng.randint(1, 200))})
+    return ticks
+
+class BenchSim(backtest.StratSim):
+    def process_config(self, config):
+        self.pos_class = strat.TradePos
+        self.unit = 1
+        self.tcost = 0.0001
+        self.offset = 1
+        self.win = config.get('win', 20)
+        self.SL = config.get('stoploss', 2.0)
+        self.pos_update = True
+
+    def process_data(self, mdf):
+        self.df = mdf.copy()
+        self.df['datetime'] = self.df.index
+        self.df['chan_h'] = dh.DONCH_H(self.df, self.win).shift(1)
+        self.df['chan_l'] = dh.DONCH_L(self.df, self.win).shift(1)
+        self.df['atr'] = dh.ATR(self.df, self.win).shift(1)
+        self.df['pos'] = 0.0
+        self.df['cost'] = 0.0
+        self.df['closeout'] = 0.0
+        self.df['traded_price'] = self.df['open']
+
+    def daily_initialize(self, sim_data, n):
+        pass
+
+    def check_data_invalid(self, sim_data, n):
+        return np.isnan(sim_data['chan_h'][n]) or np.isnan(sim_data['chan_l'][n]) or np.isnan(sim_data['atr'][n])
+
+    def get_tradepos_exit(self, tradepos, sim_data, n):
+        return self.SL * sim_data['atr'][n]
+
+    def on_bar(self, sim_data, n):
+        curr_pos = self.positions[0].pos if len(self.positions) > 0 else 0
+        target = 0
+        if sim_data['close'][n] > sim_data['chan_h'][n]:
+            target = 1
+        elif sim_data['close'][n] < sim_data['chan_l'][n]:
+            target = -1
+        if (target == 0) or (target * curr_pos > 0):
+            return
+        for tradepos in self.positions:
+            self.close_tradepos(tradepos, sim_data['open'][n + 1])
+        self.positions = []
+        self.open_tradepos([sim_data['contract'][n]], sim_data['open'][n + 1], target)
+
+def indicator_cases(mdf):
+    xdf = dh.conv_ohlc_freq(mdf.copy(), '15min')
+    ddf = dh.conv_ohlc_freq(mdf.copy(), 'd')
+    ind_list = [('MA', lambda: dh.MA(xdf, 20)),
+                ('EMA', lambda: dh.EMA(xdf, 20)),
+                ('MACD', lambda: dh.MACD(xdf, 12, 26, 9)),
+                ('TEMA', lambda: dh.TEMA(xdf['close'], 20)),
+                ('ATR', lambda: dh.ATR(xdf, 20)),
+                ('STDEV', lambda: dh.STDEV(xdf, 20)),
+                ('BBANDS', lambda: dh.BBANDS(xdf, 20, 2)),
+                ('KELCH', lambda: dh.KELCH(xdf, 20)),
+                ('DT_RNG', lambda: dh.DT_RNG(ddf, 4)),
+                ('RSI', lambda: dh.RSI(xdf, 14)),
+                ('CCI', lambda: dh.CCI(xdf, 20)),
+                ('ADX', lambda: dh.ADX(xdf, 14)),
+                ('DVO', lambda: dh.DVO(ddf, M = 60)),
+                ('DONCH', lambda: [dh.DONCH_H(xdf, 20), dh.DONCH_L(xdf, 20)]),
+                ('PCT_CHANNEL', lambda: dh.PCT_CHANNEL(xdf, 20, 50)),
+                ('COND_PCT_CHAN', lambda: dh.COND_PCT_CHAN(xdf, 20, 50)),
+                ('PSAR', lambda: dh.PSAR(xdf)),
+                ('SAR', lambda: dh.SAR(xdf)),
+                ('HEIKEN_ASHI', lambda: dh.HEIKEN_ASHI(xdf, 2)),
+                ('MA_RIBBON', lambda: dh.MA_RIBBON(xdf, [10, 20, 30, 40, 50])),]
+    return dict([('ind_' + name, func) for name, func in ind_list])
+
+def sweep_case(mdf, vectorized = False):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bktest'))
+    import bkvec_dt_min
+    config = {'close_daily': False, 'offset': 1, 'proc_func': dh.day_split, 'proc_args': {'minlist': [1500]},
+              'chan_func': {'high': {'func': 'dh.DONCH_H', 'args': {}}, 'low': {'func': 'dh.DONCH_L', 'args': {}}},
+              'trans_cost': 0.0001, 'min_range': 0.002, 'exit_min': 2057, 'capital': 10000}
+    scens = []
+    for param in [(0.5, 1), (0.8, 1), (0.3, 2), (0.45, 4)]:
+        for chan in [5, 20]:
+            scen = dict(config)
+            scen['param'] = param
+            scen['chan'] = chan
+            scens.append(scen)
+    if vectorized:
+        def run():
+            config['ind_cache'] = dh.IndicatorCache()
+            return bkvec_dt_min.dual_thrust_vecsim(mdf.copy(), config, scens)
+    else:
+        def run():
+            return [bkvec_dt_min.dual_thrust_sim(mdf.copy(), scen) for scen in scens]
+    return run
+
+def agent_tick_case(ticks):
+    import agent
+    from eventEngine import Event
+    from eventType import EVENT_MARKETDATA
+    folder = os.path.join(bench_folder, 'bench_agent') + os.path.sep
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    config = {'folder': folder, 'gateway': {'CTP': {'class': 'ctp.ctpsim_gateway.CtpSimGateway'}}}
+    bench_agent = agent.Agent('bench_agent', tday = datetime.date(2017, 6, 1), config = config)
+    bench_agent.add_instrument(ticks[0]['InstrumentID'])
+    bench_agent.register_event_handler()
+    gway = bench_agent.gateways['CTP']
+    engine = bench_agent.eventEngine
+    def run():
+        for data in ticks:
+            event = Event(type = EVENT_MARKETDATA + gway.gatewayName)
+            event.dict['data'] = data
+            gway.rsp_market_data(event)
+            while not engine.queue.empty():
+                engine.process(engine.queue.get())
+    return run
+
+def option_chain_case(n_strikes = 41, n_expiries = 6, implied = False):
+    fwd = 3000.0
+    strikes = fwd * np.linspace(0.8, 1.2, n_strikes)
+    texps = np.linspace(0.05, 1.0, n_expiries)
+    def price_chain():
+        return [[bsopt.BSFwd(1 if k >= fwd else 0, fwd, k, 0.25, t, 0.03) for k in strikes] for t in texps]
+    if not implied:
+        return price_chain
+    prices = price_chain()
+    def run():
+        return [[bsopt.BSImpVol(1 if k >= fwd else 0, fwd, k, t, 0.0, 0.0, p) for k, p in zip(strikes, row)] \
+                for t, row in zip(texps, prices)]
+    return run
+
+def bench_cases(n_days = bench_days, n_ticks = 20000):
+    mdf = synthetic_min_data(n_days)
+    # the bar functions add helper columns to the input, each run gets a fresh copy
+    cases = {'bar_ohlc_15min': lambda: dh.conv_ohlc_freq(mdf.copy(), '15min'),
+             'bar_daily': lambda: dh.conv_ohlc_freq(mdf.copy(), 'd'),
+             'bar_day_split': lambda: dh.day_split(mdf.copy(), minlist = [1500, 1900]),
+             'sim_loop': lambda: BenchSim({'mdf': mdf}).run_loop_sim(),
+             'sim_fast': lambda: BenchSim({'mdf': mdf}).run_fast_sim(),
+             'sweep_bkvec': sweep_case(mdf),
+             'sweep_bkvec_vec': sweep_case(mdf, vectorized = True),
+             'opt_chain_price': option_chain_case(),
+             'opt_chain_impvol': option_chain_case(implied = True),}
+    cases.update(indicator_cases(mdf))
+    # the agent case needs the product/instrument tables, it is built lazily
+    cases['agent_run_tick'] = lambda: agent_tick_case(synthetic_ticks(n_ticks))
+    return cases
+
+lazy_cases = ['agent_run_tick']
+
+def time_case(func, repeat = 3):
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return times
+
+def run_bench(names = None, repeat = 3, n_days = bench_days):
+    cases = bench_cases(n_days)
+    if (names == None) or (len(names) == 0):
+        names = sorted(cases.keys())
+    results = {}
+    for name in names:
+        try:
+            func = cases[name]() if name in lazy_cases else cases[name]
+            times = time_case(func, repeat)
+            results[name] = {'best': min(times), 'mean': float(np.mean(times)), 'status': 'ok'}
+        except Exception as e:
+            results[name] = {'best': None, 'mean': None, 'status': 'error: %s' % repr(e)}
+            traceback.print_exc()
+        print '%-20s %s' % (name, results[name]['best'] if results[name]['status'] == 'ok' else results[name]['status'])
+    return results
+
+def git_commit():
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = folder).strip()
+        dirty = len(subprocess.check_output(['git', 'status', '--porcelain', '-uno'], cwd = folder).strip()) > 0
+    except (OSError, subprocess.CalledProcessError):
+        return '', False
+    return commit, dirty
+
+def save_results(results, fname, n_days = bench_days, repeat = 3):
+    commit, dirty = git_commit()
+    record = {'commit': commit, 'dirty': dirty, 'time': datetime.datetime.now().strftime('%Y%m%d %H:%M:%S'),
+              'host': platform.node(), 'python': platform.python_version(), 'numpy': np.__version__,
+              'pandas': pd.__version__, 'n_days': n_days, 'repeat': repeat, 'results': results}
+    folder = os.path.dirname(os.path.abspath(fname))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(fname, 'a') as ofile:
+        ofile.write(json.dumps(record) + '\n')
+    return record
+
+def load_results(fname):
+    records = []
+    if os.path.isfile(fname):
+        with open(fname, 'r') as fp:
+            records = [json.loads(line) for line in fp if len(line.strip()) > 0]
+    return records
+
+def compare_results(fname, base = None, target = None, threshold = 0.1):
+    ''' compares the latest runs of two commits (default: the last two records), ratio > 1 is slower '''
+    records = load_results(fname)
+    def find(commit, default_idx):
+        if commit == None:
+            return records[default_idx] if len(records) >= abs(default_idx) else None
+        matches = [rec for rec in records if rec['commit'].startswith(commit)]
+        return matches[-1] if len(matches) > 0 else None
+    new_rec = find(target, -1)
+    old_rec = find(base, -2)
+    if (new_rec == None) or (old_rec == None):
+        print 'not enough benchmark records to compare in %s' % fname
+        return pd.DataFrame()
+    rows = []
+    for name in sorted(set(new_rec['results'].keys()) | set(old_rec['results'].keys())):
+        old = old_rec['results'].get(name, {}).get('best', None)
+        new = new_rec['results'].get(name, {}).get('best', None)
+        ratio = new / old if (old and new) else np.nan
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'slower'
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        rows.append({'case': name, 'base': old, 'target': new, 'ratio': ratio, 'flag': flag})
+    out = pd.DataFrame(rows, columns = ['case', 'base', 'target', 'ratio', 'flag']).set_index('case')
+    print 'base = %s (%s), target = %s (%s)' % (old_rec['commit'], old_rec['time'], new_rec['commit'], new_rec['time'])
+    print out
+    return out
+
+if __name__=="__main__":
+    args = sys.argv[1:]
+    fname = os.environ.get('PERF_RESULTS', os.path.join(bench_folder, 'perf_results.jsonl'))
+    if (len(args) == 0) or (args[0] not in ['run', 'compare']):
+        print "usage: perf_bench.py run [case ...] | compare [base_commit] [target_commit]"
+    elif args[0] == 'run':
+        results = run_bench(args[1:])
+        save_results(results, fname)
+    else:
+        compare_results(fname, *args[1:3])
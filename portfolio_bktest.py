@@ -0,0 +1,180 @@
+import sys
+import os
+import json
+import copy
+import datetime
+import numpy as np
+import pandas as pd
+import backtest
+import dbaccess
+
+class PortfolioBacktest(object):
+    def __init__(self, config_file):
+        with open(config_file, 'r') as fp:
+            port_config = json.load(fp)
+        self.name = port_config.get('name', 'portfolio')
+        self.start_date = datetime.datetime.strptime(port_config['start_date'], '%Y%m%d').date()
+        self.end_date = datetime.datetime.strptime(port_config['end_date'], '%Y%m%d').date()
+        self.capital = port_config['capital']
+        self.max_margin_ratio = port_config.get('max_margin_ratio', 1.0)
+        self.scaling = port_config.get('scaling', 'fixed')
+        self.round_lots = port_config.get('round_lots', True)
+        self.contract_margin = port_config.get('contract_margin', True)
+        self.components = port_config['components']
+        for i, comp in enumerate(self.components):
+            if 'name' not in comp:
+                comp['name'] = 'comp%s' % i
+        self.file_prefix = port_config.get('folder', backtest.get_bktest_folder()) + self.name
+        self.managers = {}
+        self.min_data = {}
+        self.comp_data = {}
+
+    def get_manager(self, config_file):
+        if config_file not in self.managers:
+            mgr = backtest.BacktestManager(config_file)
+            mgr.start_date = self.start_date
+            mgr.end_date = self.end_date
+            mgr.min_data = self.min_data
+            self.managers[config_file] = mgr
+        return self.managers[config_file]
+
+    def contract_marginrate(self, contracts, marginrate):
+        ''' long and short margin rates of each bar from the traded contract, like Future.calc_margin_amount,
+            the sim marginrate is kept for contracts with no rate in the contract list'''
+        long_rate = np.empty(len(contracts))
+        short_rate = np.empty(len(contracts))
+        for cont in pd.unique(contracts):
+            cnx = dbaccess.connect(**dbaccess.dbconfig)
+            rate = dbaccess.load_inst_marginrate(cont, cnx)
+            if max(rate) <= 0:
+                rate = marginrate
+            flag = (contracts == cont)
+            long_rate[flag] = rate[0]
+            short_rate[flag] = rate[1]
+        return long_rate, short_rate
+
+    def run_component(self, comp):
+        ''' runs the component strategy at one lot, the portfolio scales its daily pnl, cost and margin
+            by the lots of the day. This is a linear approximation: the sim signals do not depend on the
+            size held, and fills and costs are taken to scale with the lots, with no market impact'''
+        mgr = self.get_manager(comp['config_file'])
+        asset = comp['asset'] if type(comp['asset']).__name__ == 'list' else [comp['asset']]
+        idx = mgr.sim_assets.index(asset)
+        mgr.set_config(idx)
+        if len([prod for prod in asset if prod not in self.min_data]) > 0:
+            mgr.load_data(idx)
+        mgr.prepare_data(idx, cont_idx = 0)
+        # the manager is shared by the components on the same config file, so the scenario and params
+        # go to a copy of its config, the min data and the indicator cache stay shared
+        shared = dict([(key, mgr.config[key]) for key in ['mdf', 'ind_cache'] if key in mgr.config])
+        cfg = copy.deepcopy(dict([(key, val) for key, val in mgr.config.items() if key not in shared]))
+        cfg.update(shared)
+        if 'scenario' in comp:
+            scen = mgr.scenarios[comp['scenario']]
+            for key, seq in zip(mgr.scen_keys, scen):
+                cfg[key] = mgr.scen_param[key][seq]
+        cfg.update(comp.get('params', {}))
+        sim_strat = mgr.sim_class(cfg)
+        sim_df, closed_trades = getattr(sim_strat, mgr.sim_func)()
+        if 'multiple' in comp:
+            multiple = comp['multiple']
+        else:
+            multiple = dbaccess.load_product_info(asset[0])['lot_size']
+        marginrate = comp.get('marginrate', cfg['marginrate'])
+        if ('marginrate' not in comp) and self.contract_margin and ('contract' in sim_df.columns):
+            marginrate = self.contract_marginrate(sim_df['contract'].values, marginrate)
+        pnl, cost, margin = backtest.sim_pnl_arrays(sim_df, marginrate, pnl_mode = 'traded')
+        dates = sim_df['date'].values
+        days, dpnl, dcost, dmargin, last_bar = backtest.daily_aggregate(dates, pnl, cost, margin)
+        if len(dates) == 0:
+            return days, dpnl, dcost, dmargin, np.array([]), np.array([])
+        peak_margin = np.maximum.reduceat(margin, backtest.day_starts(dates))
+        # margin of one lot at the last close before the day, the first day takes its first open
+        shift = sim_df['shift'].values if 'shift' in sim_df.columns else 0.0
+        unit_rate = np.maximum(marginrate[0], marginrate[1]) * np.ones(len(dates))
+        close_margin = (sim_df['close'].values - shift) * unit_rate
+        open_margin = (sim_df['open'].values - shift) * unit_rate
+        lot_margin = np.r_[open_margin[0], close_margin[last_bar[:-1]]]
+        return days, dpnl * multiple, dcost * multiple, dmargin * multiple, peak_margin * multiple, lot_margin * multiple
+
+    def load_components(self):
+        for comp in self.components:
+            if comp['name'] not in self.comp_data:
+                self.comp_data[comp['name']] = self.run_component(comp)
+
+    def align_components(self):
+        comp_list = [self.comp_data[comp['name']] for comp in self.components]
+        days = np.unique(np.concatenate([pd.to_datetime(c[0]).values for c in comp_list]))
+        ncomp = len(comp_list)
+        pnl = np.zeros((len(days), ncomp))
+        cost = np.zeros((len(days), ncomp))
+        margin = np.empty((len(days), ncomp))
+        margin[:] = np.nan
+        peak_margin = margin.copy()
+        lot_margin = margin.copy()
+        for i, c in enumerate(comp_list):
+            day_idx = np.searchsorted(days, pd.to_datetime(c[0]).values)
+            pnl[day_idx, i] = c[1]
+            cost[day_idx, i] = c[2]
+            margin[day_idx, i] = c[3]
+            peak_margin[day_idx, i] = c[4]
+            lot_margin[day_idx, i] = c[5]
+        # margin is held through the days a component has no bars
+        margin = pd.DataFrame(margin).ffill().fillna(0.0).values
+        peak_margin = pd.DataFrame(peak_margin).ffill().fillna(0.0).values
+        lot_margin = pd.DataFrame(lot_margin).ffill().fillna(0.0).values
+        return days, pnl, cost, margin, peak_margin, lot_margin
+
+    def run_portfolio(self):
+        self.load_components()
+        days, pnl, cost, margin, peak_margin, lot_margin = self.align_components()
+        base_lots = np.array([comp.get('lots', 1.0) for comp in self.components], dtype = float)
+        ndays, ncomp = pnl.shape
+        lots = np.zeros((ndays, ncomp))
+        equity = self.capital
+        for d in range(ndays):
+            if self.scaling == 'equity':
+                day_lots = base_lots * max(equity, 0.0) / self.capital
+            else:
+                day_lots = base_lots.copy()
+            # the lots are set before the day trades, so they are capped on the peak margin of the day
+            # before, at least one lot's margin at the last close in case the component was flat
+            prev_peak = peak_margin[d-1] if d > 0 else np.zeros(ncomp)
+            req_margin = (day_lots * np.maximum(prev_peak, lot_margin[d])).sum()
+            margin_limit = self.max_margin_ratio * max(equity, 0.0)
+            if req_margin > margin_limit:
+                day_lots = day_lots * (margin_limit / req_margin)
+            if self.round_lots:
+                day_lots = np.floor(day_lots)
+            lots[d] = day_lots
+            # sim costs are positive amounts, they are charged against the shared equity
+            equity += (day_lots * (pnl[d] - cost[d])).sum()
+        port_pnl = (lots * pnl).sum(axis = 1)
+        port_cost = -(lots * cost).sum(axis = 1)
+        port_margin = (lots * margin).sum(axis = 1)
+        res, ts = backtest.daily_pnl_stats(days, port_pnl, port_cost, port_margin, self.capital)
+        res['max_peak_margin'] = float((lots * peak_margin).sum(axis = 1).max()) if ndays > 0 else 0.0
+        for i, comp in enumerate(self.components):
+            ts[comp['name'] + '_lots'] = lots[:, i]
+            res[comp['name'] + '_pnl'] = float((lots[:, i] * pnl[:, i]).sum())
+        return res, ts
+
+    def run(self):
+        res, ts = self.run_portfolio()
+        folder = os.path.dirname(self.file_prefix)
+        if (len(folder) > 0) and (not os.path.exists(folder)):
+            os.makedirs(folder)
+        ts.to_csv(self.file_prefix + '_dailydata.csv')
+        with open(self.file_prefix + '_stats.json', 'w') as ofile:
+            json.dump(res, ofile)
+        print 'portfolio = %s, sharp = %s, tot_pnl = %s, max_margin = %s' % \
+              (self.name, res['sharp_ratio'], res['tot_pnl'], res['max_margin'])
+        return res, ts
+
+if __name__=="__main__":
+    args = sys.argv[1:]
+    if len(args) < 1:
+        print "need to input a portfolio config file"
+    else:
+        port = PortfolioBacktest(args[0])
+        port.run()
@@ -12,6 +12,20 @@ class Position(object):
     def re_calc(self):
         pass
 
+    def add_order(self, mo):
+        self.orders.append(mo)
+        self.update_order(mo)
+
+    def remove_order(self, mo):
+        self.orders.remove(mo)
+        self.re_calc()
+
+    def update_order(self, mo):
+        self.re_calc()
+
+    def reconcile(self):
+        self.re_calc()
+
     def __str__(self):
         return unicode(self).encode('utf-8')
     
@@ -19,6 +33,7 @@ class Position(object):
         return '%s' % (self.instrument.name)
         
 class GrossPosition(Position):
+    recon_interval = 500
     def __init__(self, instrument, gateway = 'CTP', intraday_close_ratio = 1):
         super(GrossPosition, self).__init__(instrument, gateway)
         self.tday_pos = BaseObject(long=0, short=0) 
@@ -31,6 +46,21 @@ class GrossPosition(Position):
         self.can_close  = BaseObject(long=0, short=0)
         self.can_open = BaseObject(long=0, short=0)
         self.intraday_close_ratio = intraday_close_ratio
+        # running sums of the orders, each order's last applied (volume, filled, filled amount) is kept
+        # so that a fill or cancel only applies its delta
+        self.order_stats = {}
+        self.num_updates = 0
+        self.reset_sums()
+
+    def reset_sums(self):
+        self.tday_opened = BaseObject(long=0, short=0)
+        self.tday_o_locked = BaseObject(long=0, short=0)
+        self.tday_closed = BaseObject(long=0,short=0)
+        self.tday_c_locked = BaseObject(long=0,short=0)
+        self.yday_closed = BaseObject(long=0,short=0)
+        self.yday_c_locked = BaseObject(long=0,short=0)
+        self.tday_amount = BaseObject(long=0.0, short=0.0)
+        self.order_stats = {}
     
     def set_intraday_close_ratio(self, ratio):
         self.intraday_close_ratio = ratio
@@ -40,56 +70,84 @@ class GrossPosition(Position):
         self.can_yclose.short = 0
         self.can_close.long  = max(self.pos_yday.short + int(tday_opened.short * self.intraday_close_ratio) - tday_c_locked.long, 0) 
         self.can_close.short = max(self.pos_yday.long  + int(tday_opened.long * self.intraday_close_ratio)  - tday_c_locked.short,0) 
-        
-    def re_calc(self): #
-        tday_opened = BaseObject(long=0, short=0)
-        tday_o_locked = BaseObject(long=0, short=0)
-        tday_closed = BaseObject(long=0,short=0)
-        tday_c_locked = BaseObject(long=0,short=0)
-        yday_closed = BaseObject(long=0,short=0)
-        yday_c_locked = BaseObject(long=0,short=0)
 
+    def order_sums(self, action_type):
+        if action_type == OF_OPEN:
+            return (self.tday_opened, self.tday_o_locked)
+        elif (action_type == OF_CLOSE) or (action_type == OF_CLOSE_TDAY):
+            return (self.tday_closed, self.tday_c_locked)
+        elif action_type == OF_CLOSE_YDAY:
+            return (self.yday_closed, self.yday_c_locked)
+        return None
+
+    def apply_order(self, mo, stats, sign = 1):
+        side = 'long' if mo.direction == ORDER_BUY else 'short'
+        sums = self.order_sums(mo.action_type)
+        if sums != None:
+            filled, locked = sums
+            setattr(filled, side, getattr(filled, side) + sign * stats[1])
+            setattr(locked, side, getattr(locked, side) + sign * stats[0])
+        setattr(self.tday_amount, side, getattr(self.tday_amount, side) + sign * stats[2])
+
+    def update_order(self, mo):
+        stats = (mo.volume, mo.filled_volume, mo.filled_price * mo.filled_volume)
+        prev = self.order_stats.get(id(mo), None)
+        if prev == stats:
+            return
+        if prev != None:
+            self.apply_order(mo, prev, -1)
+        self.apply_order(mo, stats)
+        self.order_stats[id(mo)] = stats
+        self.update_pos()
+        self.num_updates += 1
+        if self.num_updates >= max(self.recon_interval, len(self.orders)):
+            self.reconcile()
+
+    def remove_order(self, mo):
+        self.orders.remove(mo)
+        prev = self.order_stats.pop(id(mo), None)
+        if prev != None:
+            self.apply_order(mo, prev, -1)
+        self.update_pos()
+
+    def reconcile(self):
+        ''' rebuild the running sums from the order list, log if the incremental state has drifted '''
+        curr = [(x.long, x.short) for x in [self.curr_pos, self.locked_pos, self.tday_pos]]
+        self.re_calc()
+        if curr != [(x.long, x.short) for x in [self.curr_pos, self.locked_pos, self.tday_pos]]:
+            logging.warning('position of %s is out of sync with its orders, reset to %s' % (self.instrument.name, \
+                                [(x.long, x.short) for x in [self.curr_pos, self.locked_pos, self.tday_pos]]))
+
+    def re_calc(self): #
+        self.reset_sums()
         for mo in self.orders:
-            logging.debug(str(mo))
-            if mo.action_type == OF_OPEN:
-                if mo.direction == ORDER_BUY:
-                    tday_opened.long += mo.filled_volume
-                    tday_o_locked.long += mo.volume
-                else:
-                    tday_opened.short += mo.filled_volume
-                    tday_o_locked.short += mo.volume            
-            elif (mo.action_type == OF_CLOSE) or (mo.action_type == OF_CLOSE_TDAY):
-                if mo.direction == ORDER_BUY:
-                    tday_closed.long  += mo.filled_volume
-                    tday_c_locked.long += mo.volume
-                else: 
-                    tday_closed.short += mo.filled_volume
-                    tday_c_locked.short += mo.volume
-            elif mo.action_type == OF_CLOSE_YDAY:
-                if mo.direction == ORDER_BUY:
-                    yday_closed.long  += mo.filled_volume
-                    yday_c_locked.long += mo.volume
-                else:
-                    yday_closed.short += mo.filled_volume
-                    yday_c_locked.short += mo.volume
-
-        self.update_can_close(tday_opened, tday_c_locked, yday_c_locked)
+            stats = (mo.volume, mo.filled_volume, mo.filled_price * mo.filled_volume)
+            self.apply_order(mo, stats)
+            self.order_stats[id(mo)] = stats
+        self.num_updates = 0
+        self.update_pos()
+
+    def update_pos(self):
+        tday_opened = self.tday_opened
+        tday_closed = self.tday_closed
+        yday_closed = self.yday_closed
+        self.update_can_close(tday_opened, self.tday_c_locked, self.yday_c_locked)
         self.tday_pos.long  = tday_opened.long + tday_closed.long + yday_closed.long
         self.tday_pos.short = tday_opened.short + tday_closed.short + yday_closed.short
 
         if self.tday_pos.long > 0:
-            self.tday_avp.long = sum([o.filled_price*o.filled_volume for o in self.orders if o.direction == ORDER_BUY])/self.tday_pos.long
+            self.tday_avp.long = self.tday_amount.long/self.tday_pos.long
         else:
             self.tday_avp.long = 0.0
         if self.tday_pos.short > 0:
-            self.tday_avp.short= sum([o.filled_price*o.filled_volume for o in self.orders if o.direction == ORDER_SELL])/self.tday_pos.short
+            self.tday_avp.short= self.tday_amount.short/self.tday_pos.short
         else:
             self.tday_avp.short = 0.0
 
         self.curr_pos.long = tday_opened.long - tday_closed.short + self.pos_yday.long - yday_closed.short
         self.curr_pos.short =tday_opened.short- tday_closed.long  + self.pos_yday.short- yday_closed.long
-        self.locked_pos.long = self.pos_yday.long -yday_closed.short+ tday_o_locked.long - tday_closed.short
-        self.locked_pos.short =self.pos_yday.short-yday_closed.long + tday_o_locked.short- tday_closed.long
+        self.locked_pos.long = self.pos_yday.long -yday_closed.short+ self.tday_o_locked.long - tday_closed.short
+        self.locked_pos.short =self.pos_yday.short-yday_closed.long + self.tday_o_locked.short- tday_closed.long
         self.can_open.long  = max(self.instrument.max_holding[0] - self.locked_pos.long,0)
         self.can_open.short = max(self.instrument.max_holding[1] - self.locked_pos.short,0)
 
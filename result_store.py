@@ -0,0 +1,143 @@
+import json
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+
+store_tables = ['''create table if not exists runs (
+                       run_id integer primary key autoincrement,
+                       strategy text, sim_name text, asset text, scenario integer,
+                       params text, created text,
+                       unique (strategy, sim_name, asset, scenario))''',
+                '''create table if not exists run_params (
+                       run_id integer, name text, idx integer, value real, value_text text)''',
+                '''create table if not exists run_stats (
+                       run_id integer, name text, value real)''',
+                '''create table if not exists daily_pnl (
+                       run_id integer, date text, cum_pnl real, daily_margin real, daily_cost real)''',
+                '''create table if not exists trades (
+                       run_id integer, trade_no integer, entry_time text, exit_time text, pos real,
+                       entry_price real, exit_price real, profit real, data text)''',
+                'create index if not exists idx_runs_asset on runs (asset, strategy)',
+                'create index if not exists idx_runs_strategy on runs (strategy, sim_name)',
+                'create index if not exists idx_params on run_params (name, value, run_id)',
+                'create index if not exists idx_params_run on run_params (run_id)',
+                'create index if not exists idx_stats on run_stats (name, value, run_id)',
+                'create index if not exists idx_stats_run on run_stats (run_id)',
+                'create index if not exists idx_daily_run on daily_pnl (run_id)',
+                'create index if not exists idx_trades_run on trades (run_id)',]
+
+trade_columns = ['entry_time', 'exit_time', 'pos', 'entry_price', 'exit_price', 'profit']
+
+def strategy_name(sim_obj):
+    ''' the strategy column, module and name of the sim class or function, the bktest package
+        prefix is dropped as the config files name the sims both with and without it'''
+    return sim_obj.__module__.split('.')[-1] + '.' + sim_obj.__name__
+
+def to_float(value):
+    try:
+        out = float(value)
+    except (TypeError, ValueError):
+        return None
+    if np.isfinite(out):
+        return out
+    return None
+
+class ResultStore(object):
+    def __init__(self, dbfile, timeout = 60.0):
+        self.dbfile = dbfile
+        self.cnx = sqlite3.connect(dbfile, timeout = timeout)
+        # WAL lets the readers run while parallel sim workers append
+        self.cnx.execute('pragma journal_mode=wal')
+        self.cnx.execute('pragma synchronous=normal')
+        with self.cnx:
+            for stmt in store_tables:
+                self.cnx.execute(stmt)
+
+    def close(self):
+        self.cnx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def add_run(self, strategy, sim_name, asset, scenario, params, stats, ts = None, trades = None):
+        ''' params is {key: (index, value)}, trades is a list of tradepos2dict outputs'''
+        with self.cnx:
+            cursor = self.cnx.cursor()
+            cursor.execute('select run_id from runs where strategy=? and sim_name=? and asset=? and scenario=?',
+                           (strategy, sim_name, asset, scenario))
+            row = cursor.fetchone()
+            if row != None:
+                for tbl in ['runs', 'run_params', 'run_stats', 'daily_pnl', 'trades']:
+                    cursor.execute('delete from %s where run_id=?' % tbl, (row[0],))
+            cursor.execute('insert into runs (strategy, sim_name, asset, scenario, params, created) values (?,?,?,?,?,?)',
+                           (strategy, sim_name, asset, scenario, json.dumps(dict([(k, v[1]) for k, v in params.items()])),
+                            datetime.datetime.now().strftime('%Y%m%d %H:%M:%S')))
+            run_id = cursor.lastrowid
+            cursor.executemany('insert into run_params values (?,?,?,?,?)',
+                               [(run_id, key, int(idx), to_float(value), json.dumps(value)) \
+                                for key, (idx, value) in params.items()])
+            cursor.executemany('insert into run_stats values (?,?,?)',
+                               [(run_id, key, to_float(value)) for key, value in stats.items() \
+                                if to_float(value) != None])
+            if ts is not None:
+                dates = [str(d)[:10] for d in ts.index]
+                cursor.executemany('insert into daily_pnl values (?,?,?,?,?)',
+                                   zip([run_id] * len(ts), dates, ts['cum_pnl'].astype(float),
+                                       ts['daily_margin'].astype(float), ts['daily_cost'].astype(float)))
+            if trades != None:
+                cursor.executemany('insert into trades values (?,?,?,?,?,?,?,?,?)',
+                                   [(run_id, i) + tuple([trade.get(col) for col in trade_columns]) + (json.dumps(trade),) \
+                                    for i, trade in enumerate(trades)])
+        return run_id
+
+    def query_runs(self, strategy = None, sim_name = None, asset = None, params = {}, stats = {}, \
+                   order_by = 'sharp_ratio', ascending = False, limit = None):
+        ''' params/stats filters are {name: value} or {name: (low, high)}, returns a run table with
+            parameter values and stats as columns'''
+        conds = []
+        args = []
+        for col, val in [('strategy', strategy), ('sim_name', sim_name), ('asset', asset)]:
+            if val != None:
+                conds.append('r.%s = ?' % col)
+                args.append(val)
+        for tbl, filters in [('run_params', params), ('run_stats', stats)]:
+            for key, val in filters.items():
+                if type(val).__name__ in ['tuple', 'list']:
+                    conds.append('r.run_id in (select run_id from %s where name = ? and value between ? and ?)' % tbl)
+                    args += [key, val[0], val[1]]
+                else:
+                    conds.append('r.run_id in (select run_id from %s where name = ? and value = ?)' % tbl)
+                    args += [key, val]
+        stmt = 'select r.run_id, r.strategy, r.sim_name, r.asset, r.scenario, r.params from runs r'
+        if order_by != None:
+            stmt += ' left join run_stats o on o.run_id = r.run_id and o.name = ?'
+            args = [order_by] + args
+        if len(conds) > 0:
+            stmt += ' where ' + ' and '.join(conds)
+        if order_by != None:
+            stmt += ' order by o.value is null, o.value %s' % ('asc' if ascending else 'desc')
+        if limit != None:
+            stmt += ' limit %s' % int(limit)
+        runs = pd.read_sql_query(stmt, self.cnx, params = args)
+        if len(runs) == 0:
+            return runs
+        id_list = ','.join([str(int(x)) for x in runs['run_id']])
+        stats_df = pd.read_sql_query('select run_id, name, value from run_stats where run_id in (%s)' % id_list, self.cnx)
+        stats_df = stats_df.pivot(index = 'run_id', columns = 'name', values = 'value')
+        param_df = pd.DataFrame([json.loads(p) for p in runs['params']], index = runs['run_id'])
+        runs = runs.drop('params', axis = 1).set_index('run_id', drop = False)
+        return runs.join(param_df).join(stats_df, rsuffix = '_stat')
+
+    def load_daily(self, run_id):
+        df = pd.read_sql_query('select date, cum_pnl, daily_margin, daily_cost from daily_pnl where run_id = ? order by date',
+                               self.cnx, params = [run_id])
+        df['date'] = pd.to_datetime(df['date'])
+        return df.set_index('date')
+
+    def load_trades(self, run_id):
+        cursor = self.cnx.execute('select data from trades where run_id = ? order by trade_no', (run_id,))
+        return pd.DataFrame([json.loads(row[0]) for row in cursor])
@@ -0,0 +1,138 @@
+#-*- coding:utf-8 -*-
+import array
+import copy
+import collections
+from misc import *
+
+# limits by scope, the '' entry is the default of the scope and a named entry overrides it, None is no limit
+default_limits = {'instrument': {'': {'max_vol': None, 'max_pos': None, 'max_notional': None, 'price_band': None}},
+                  'strategy':   {'': {'max_vol': None, 'max_notional': None}},
+                  'account':    {'min_available': None}, }
+
+inst_fields = ['max_vol', 'max_pos', 'max_notional', 'price_band']
+strat_fields = ['max_vol', 'max_notional']
+
+no_limit = float('inf')
+
+def limit_value(value):
+    return no_limit if value == None else float(value)
+
+class PreTradeRisk(object):
+    ''' pre-trade checks of the order inserts against the instrument, strategy and account limits.
+        The limits and the last traded prices sit in flat arrays by instrument and strategy slot.'''
+    def __init__(self, gateway, limits = None):
+        self.gateway = gateway
+        self.limits = copy.deepcopy(default_limits)
+        self.inst_idx = {}
+        self.inst_arrays = dict([(field, array.array('d')) for field in inst_fields + ['last_price', 'multiple']])
+        self.strat_idx = {}
+        self.strat_arrays = dict([(field, array.array('d')) for field in strat_fields])
+        self.min_available = -no_limit
+        self.check_strat = False
+        self.num_rejects = collections.defaultdict(int)
+        self.rejects = collections.deque(maxlen = 1000)
+        if limits != None:
+            self.set_limits(limits)
+
+    def set_limits(self, limits):
+        for scope in ['instrument', 'strategy']:
+            for name in limits.get(scope, {}):
+                self.limits[scope][name] = dict(self.limits[scope].get(name, {}), **limits[scope][name])
+        self.limits['account'].update(limits.get('account', {}))
+        for instID, idx in self.inst_idx.items():
+            self.fill_slot(self.inst_arrays, inst_fields, self.limits['instrument'], instID, idx)
+        for name, idx in self.strat_idx.items():
+            self.fill_slot(self.strat_arrays, strat_fields, self.limits['strategy'], name, idx)
+        min_avail = self.limits['account']['min_available']
+        self.min_available = -no_limit if min_avail == None else float(min_avail)
+        self.check_strat = any([lim.get(field, None) != None for lim in self.limits['strategy'].values() for field in strat_fields])
+
+    def fill_slot(self, arrays, fields, scope_limits, name, idx):
+        lim = dict(scope_limits[''], **scope_limits.get(name, {}))
+        for field in fields:
+            value = limit_value(lim.get(field, None))
+            if idx < len(arrays[field]):
+                arrays[field][idx] = value
+            else:
+                arrays[field].append(value)
+
+    def add_instrument(self, instID):
+        if instID in self.inst_idx:
+            return self.inst_idx[instID]
+        idx = len(self.inst_idx)
+        self.fill_slot(self.inst_arrays, inst_fields, self.limits['instrument'], instID, idx)
+        inst = self.gateway.agent.instruments[instID]
+        self.inst_arrays['last_price'].append(float(getattr(inst, 'price', 0.0)))
+        self.inst_arrays['multiple'].append(float(getattr(inst, 'multiple', 1)))
+        self.inst_idx[instID] = idx
+        return idx
+
+    def get_strat_idx(self, strat_name):
+        if strat_name not in self.strat_idx:
+            idx = len(self.strat_idx)
+            self.fill_slot(self.strat_arrays, strat_fields, self.limits['strategy'], strat_name, idx)
+            self.strat_idx[strat_name] = idx
+        return self.strat_idx[strat_name]
+
+    def update_price(self, instID, price):
+        idx = self.inst_idx.get(instID, None)
+        if idx != None:
+            self.inst_arrays['last_price'][idx] = price
+
+    def check_order(self, iorder):
+        ''' returns the reason to reject the order insert, None if it passes '''
+        vol = iorder.volume
+        arrays = self.inst_arrays
+        is_open = False
+        nlegs = len(iorder.instIDs)
+        if nlegs == 1:
+            legs = [(iorder.instrument, 1, iorder.action_type)]
+        else:
+            legs = zip(iorder.instIDs, iorder.units, iorder.action_type)
+        for instID, unit, action_type in legs:
+            idx = self.inst_idx.get(instID, None)
+            if idx == None:
+                continue
+            leg_vol = vol * abs(unit)
+            if leg_vol > arrays['max_vol'][idx]:
+                return 'volume %s of %s over the limit %s' % (leg_vol, instID, arrays['max_vol'][idx])
+            if action_type != OF_OPEN:
+                continue
+            is_open = True
+            # the order is already in the locked position since it was booked
+            pos = self.gateway.positions[instID]
+            if (iorder.direction == ORDER_BUY) == (unit > 0):
+                locked = pos.locked_pos.long
+            else:
+                locked = pos.locked_pos.short
+            if locked > arrays['max_pos'][idx]:
+                return 'position %s of %s over the limit %s' % (locked, instID, arrays['max_pos'][idx])
+        notional = 0.0
+        if nlegs == 1:
+            idx = self.inst_idx.get(iorder.instrument, None)
+            if idx != None:
+                last_price = arrays['last_price'][idx]
+                price = iorder.limit_price
+                if (iorder.price_type == OPT_LIMIT_ORDER) and (last_price > 0) and \
+                        (abs(price - last_price) > arrays['price_band'][idx] * last_price):
+                    return 'price %s of %s out of the band around %s' % (price, iorder.instrument, last_price)
+                notional = vol * (price if price > 0 else last_price) * arrays['multiple'][idx]
+                if notional > arrays['max_notional'][idx]:
+                    return 'notional %s of %s over the limit %s' % (notional, iorder.instrument, arrays['max_notional'][idx])
+        if self.check_strat and (iorder.trade_ref > 0):
+            xtrade = self.gateway.agent.trade_manager.get_trade(iorder.trade_ref)
+            if xtrade != None:
+                sidx = self.get_strat_idx(xtrade.strategy)
+                if vol > self.strat_arrays['max_vol'][sidx]:
+                    return 'volume %s over the limit %s of %s' % (vol, self.strat_arrays['max_vol'][sidx], xtrade.strategy)
+                if notional > self.strat_arrays['max_notional'][sidx]:
+                    return 'notional %s over the limit %s of %s' % (notional, self.strat_arrays['max_notional'][sidx], xtrade.strategy)
+        if is_open and (self.min_available > -no_limit):
+            available = self.gateway.update_margin()['available']
+            if available < self.min_available:
+                return 'available %s below the margin headroom %s' % (available, self.min_available)
+        return None
+
+    def on_reject(self, iorder, reason):
+        self.num_rejects[iorder.instrument] += 1
+        self.rejects.append((iorder.local_id, iorder.instrument, reason))
@@ -0,0 +1,74 @@
+import numpy as np
+
+def block_bootstrap_index(n, block_size, n_samples, rng):
+    ''' circular block bootstrap, returns a (n_samples, n) index array '''
+    block_size = max(min(int(block_size), n), 1)
+    n_blocks = int(np.ceil(float(n) / block_size))
+    starts = rng.randint(0, n, size = (n_samples, n_blocks))
+    idx = (starts[:, :, None] + np.arange(block_size)[None, None, :]) % n
+    return idx.reshape((n_samples, n_blocks * block_size))[:, :n]
+
+def shuffle_index(n, n_samples, rng):
+    return np.argsort(rng.rand(n_samples, n), axis = 1)
+
+def path_max_drawdown(paths, start = 0.0):
+    ''' max drawdown of each row of a (n_samples, n) pnl array '''
+    cum = np.cumsum(paths, axis = 1) + start
+    hwm = np.maximum(np.maximum.accumulate(cum, axis = 1), start)
+    return (cum - hwm).min(axis = 1)
+
+def tail_loss(paths, alpha = 0.05):
+    ''' per row value at risk and expected shortfall of the pnl at level alpha '''
+    n = paths.shape[1]
+    k = max(int(np.floor(alpha * n)), 1)
+    tail = np.partition(paths, k - 1, axis = 1)[:, :k]
+    return tail.max(axis = 1), tail.mean(axis = 1)
+
+def bands(samples, quantiles):
+    return np.percentile(samples, [q * 100.0 for q in quantiles])
+
+def bootstrap_pnl(daily_pnl, n_samples = 1000, block_size = 10, alpha = 0.05, \
+                  quantiles = (0.05, 0.5, 0.95), seed = None):
+    pnl = np.asarray(daily_pnl, dtype = float)
+    pnl = pnl[np.isfinite(pnl)]
+    res = {}
+    if len(pnl) < 2:
+        return res
+    rng = np.random.RandomState(seed)
+    paths = pnl[block_bootstrap_index(len(pnl), block_size, n_samples, rng)]
+    std = paths.std(axis = 1, ddof = 1)
+    sharp = np.where(std > 0, paths.mean(axis = 1) / np.where(std > 0, std, 1.0) * np.sqrt(252.0), 0.0)
+    max_dd = path_max_drawdown(paths)
+    var, cvar = tail_loss(paths, alpha)
+    for name, samples in [('sharp', sharp), ('max_dd', max_dd), ('var', var), ('cvar', cvar)]:
+        for q, val in zip(quantiles, bands(samples, quantiles)):
+            res['bs_%s_%s' % (name, int(round(q * 100)))] = float(val)
+    res['bs_prob_profit'] = float((sharp > 0).mean())
+    return res
+
+def shuffle_trades(profits, n_samples = 1000, quantiles = (0.05, 0.5, 0.95), seed = None):
+    profits = np.asarray(profits, dtype = float)
+    profits = profits[np.isfinite(profits)]
+    res = {}
+    if len(profits) < 2:
+        return res
+    rng = np.random.RandomState(seed)
+    paths = profits[shuffle_index(len(profits), n_samples, rng)]
+    max_dd = path_max_drawdown(paths)
+    for q, val in zip(quantiles, bands(max_dd, quantiles)):
+        res['mc_max_dd_%s' % int(round(q * 100))] = float(val)
+    losses = (paths < 0).astype(int)
+    # longest run of losing trades, a zero in the cumulative count resets the run
+    run_start = np.maximum.accumulate(np.where(losses == 0, np.arange(len(profits))[None, :] + 1, 0), axis = 1)
+    streak = (np.arange(len(profits))[None, :] + 1 - run_start).max(axis = 1)
+    res['mc_loss_streak_%s' % int(round(quantiles[-1] * 100))] = float(bands(streak, quantiles[-1:])[0])
+    return res
+
+def robustness_stats(daily_pnl, trade_profits = None, n_samples = 1000, block_size = 10, \
+                     min_prob = 0.9, seed = None):
+    res = bootstrap_pnl(daily_pnl, n_samples = n_samples, block_size = block_size, seed = seed)
+    if trade_profits is not None:
+        res.update(shuffle_trades(trade_profits, n_samples = n_samples, seed = seed))
+    if 'bs_prob_profit' in res:
+        res['overfit'] = int(res['bs_prob_profit'] < min_prob)
+    return res
@@ -5,6 +5,7 @@ from eventType import *
 from eventEngine import Event
 import data_handler
 import trade
+import journal
 from trade_executor import *
 import copy
 import datetime
@@ -190,6 +191,8 @@ class Strategy(object):
         self.tradables = self.underliers
         self.underlying = [None] * num_assets
         self.positions  = dict([(idx, []) for idx in range(num_assets)])
+        self.risk_dirty = True
+        self.inst_exposure = {}
         self.submitted_trades = dict([(idx, []) for idx in range(num_assets)])
         self.agent = agent
         self.folder = ''
@@ -278,6 +281,7 @@ class Strategy(object):
                             multiple = multiple, **self.pos_args)
         tradepos.entry_tradeid = idx
         self.positions[idx].append(tradepos)
+        self.risk_dirty = True
         tradepos.open(price, vol, datetime.datetime.now())               
         self.close_tradepos(idx, tradepos, price)        
         
@@ -327,6 +331,7 @@ class Strategy(object):
             xtrade.status = trade.TradeStatus.StratConfirm
             self.num_exits[idx] += 1
         self.positions[idx] = [ tradepos for tradepos in self.positions[idx] if not tradepos.is_closed]
+        self.risk_dirty = True
         self.submitted_trades[idx] = [xtrade for xtrade in self.submitted_trades[idx] if xtrade.status!= trade.TradeStatus.StratConfirm]
         self.save_state()
 
@@ -412,6 +417,7 @@ class Strategy(object):
         tradepos.entry_tradeid = xtrade.id
         self.submit_trade(idx, xtrade)
         self.positions[idx].append(tradepos)        
+        self.risk_dirty = True
 
     def submit_trade(self, idx, xtrade):
         xtrade.book = str(idx)
@@ -447,22 +453,25 @@ class Strategy(object):
     def save_state(self):
         filename = self.folder + 'strat_status.csv'
         self.on_log('save state for strat = %s' % self.name, level = logging.DEBUG)
-        with open(filename,'wb') as log_file:
-            file_writer = csv.writer(log_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
-            for key in sorted(self.positions.keys()):
-                if key == self.unwind_key[0]:
-                    header = self.unwind_key[1]
-                else:
-                    header = 'tradepos'
-                for tradepos in self.positions[key]:
-                    tradedict = tradepos2dict(tradepos)
-                    row = [header] + [tradedict[itm] for itm in tradepos_header]
-                    file_writer.writerow(row)
-            self.save_local_variables(file_writer)
+        # the rows are built here and the file is rewritten by the writer thread
+        file_writer = journal.RowBuffer()
+        for key in sorted(self.positions.keys()):
+            if key == self.unwind_key[0]:
+                header = self.unwind_key[1]
+            else:
+                header = 'tradepos'
+            for tradepos in self.positions[key]:
+                tradedict = tradepos2dict(tradepos)
+                row = [header] + [tradedict[itm] for itm in tradepos_header]
+                file_writer.writerow(row)
+        self.save_local_variables(file_writer)
+        journal.snapshot_writer.write(filename, file_writer)
 
     def load_state(self):
         logfile = self.folder + 'strat_status.csv'
         positions  = dict([(idx, []) for idx in range(len(self.underliers))])
+        self.risk_dirty = True
+        journal.snapshot_writer.flush()
         if not os.path.isfile(logfile):
             self.positions  = positions
             return
@@ -530,21 +539,21 @@ class Strategy(object):
             tradedict = tradepos2dict(tradepos)
             file_writer.writerow([tradedict[itm] for itm in tradepos_header])
 
-    def risk_agg(self, risk_list):
-        sum_risk = {}
-        inst_risk = {}
-        for inst in self.instIDs:
-            inst_risk[inst] = dict([(risk, 0) for risk in risk_list])
-            sum_risk[inst] = dict([(risk, 0) for risk in risk_list])
-            for risk in risk_list:
-                try:
-                    prisk = risk[1:]
-                    inst_risk[inst][risk] = getattr(self.agent.instruments[inst], prisk)
-                except:
-                    continue
+    def update_exposure(self):
+        exposure = dict([(inst, 0) for inst in self.instIDs])
         for idx, under in enumerate(self.tradables):
             pos = sum([tp.pos for tp in self.positions[idx]])
             for instID, v in zip(self.tradables[idx], self.volumes[idx]):
-                for risk in risk_list:
-                    sum_risk[instID][risk] += pos * v * inst_risk[instID][risk]
+                exposure[instID] += pos * v
+        self.inst_exposure = exposure
+        self.risk_dirty = False
+
+    def risk_agg(self, risk_list):
+        ''' the position exposure is only rebuilt after the positions change '''
+        if self.risk_dirty:
+            self.update_exposure()
+        sum_risk = {}
+        for inst in self.instIDs:
+            inst_obj = self.agent.instruments[inst]
+            sum_risk[inst] = dict([(risk, self.inst_exposure[inst] * getattr(inst_obj, risk[1:], 0)) for risk in risk_list])
         return sum_risk
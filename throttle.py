@@ -0,0 +1,63 @@
+#-*- coding:utf-8 -*-
+import time
+
+# [rate per second, burst] of each message type at each scope, a scope missing here is not limited.
+# nothing is limited by default, the limits come from the 'throttle' entry of the gateway config
+default_limits = {'insert': {}, 'cancel': {}, 'query': {}, }
+
+# a starting point for the 'throttle' entry of a CTP gateway, close to the front end flow control
+ctp_limits = {'insert': {'account': [6, 6], 'exchange': [6, 6], 'instrument': [2, 4]},
+              'cancel': {'account': [6, 6], 'exchange': [6, 6], 'instrument': [2, 4]},
+              'query':  {'account': [1, 1]}, }
+
+class TokenBucket(object):
+    def __init__(self, rate, burst, now = 0.0):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last_time = now
+
+    def refill(self, now):
+        if now > self.last_time:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+            self.last_time = now
+        return self.tokens
+
+class Throttle(object):
+    ''' token buckets of the insert, cancel and query messages at the account, exchange and instrument levels,
+        a message goes out only if every bucket on its path has a token left '''
+    def __init__(self, limits = None, clock = time.time):
+        self.clock = clock
+        self.limits = dict([(msg_type, dict(lim)) for msg_type, lim in (default_limits if limits == None else limits).items()])
+        self.buckets = {}
+        self.num_throttled = dict([(msg_type, 0) for msg_type in self.limits])
+
+    def set_limits(self, limits):
+        for msg_type in limits:
+            self.limits[msg_type] = dict(self.limits.get(msg_type, {}), **limits[msg_type])
+            self.num_throttled.setdefault(msg_type, 0)
+        self.buckets = {}
+
+    def get_buckets(self, msg_type, exchange = None, instID = None):
+        keys = [(msg_type, 'account', ''), (msg_type, 'exchange', exchange), (msg_type, 'instrument', instID)]
+        limits = self.limits.get(msg_type, {})
+        res = []
+        for key in keys:
+            if (key[2] == None) or (key[1] not in limits):
+                continue
+            if key not in self.buckets:
+                rate, burst = limits[key[1]]
+                self.buckets[key] = TokenBucket(rate, burst, self.clock())
+            res.append(self.buckets[key])
+        return res
+
+    def acquire(self, msg_type, exchange = None, instID = None, num = 1):
+        now = self.clock()
+        buckets = self.get_buckets(msg_type, exchange, instID)
+        for bucket in buckets:
+            if bucket.refill(now) < num:
+                self.num_throttled[msg_type] = self.num_throttled.get(msg_type, 0) + 1
+                return False
+        for bucket in buckets:
+            bucket.tokens -= num
+        return True
@@ -23,6 +23,7 @@ class XTrade(object):
     # instances = weakref.WeakSet()
     id_generator = itertools.count(int(datetime.datetime.strftime(datetime.datetime.now(), '%d%H%M%S')))
     def __init__(self, **kwargs):
+        self.manager = None
         self.id = kwargs.get('id', next(self.id_generator))
         self.instIDs = kwargs['instIDs']
         self.units = kwargs['units']
@@ -35,6 +36,8 @@ class XTrade(object):
         self.book = kwargs.get('book', '0')
         self.status = kwargs.get('status', TradeStatus.Ready)
         self.order_dict = kwargs.get('order_dict', {})
+        self.order_stats = {}
+        self.order_snap = {}
         self.working_vol = kwargs.get('working_vol', 0)
         self.remaining_vol = self.vol - self.filled_vol - self.working_vol
         self.aggressive_level = kwargs.get('aggressiveness', 1.0)
@@ -44,6 +47,17 @@ class XTrade(object):
         self.agent = None
         self.underlying = None
 
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        old = getattr(self, '_status', None)
+        self._status = value
+        if (self.manager != None) and (old != value):
+            self.manager.on_trade_status(self, old)
+
     def set_agent(self, agent):
         self.agent = agent
         self.underlying = agent.get_underlying(self.instIDs, self.units, self.price_unit)
@@ -52,6 +66,8 @@ class XTrade(object):
     def set_algo(self, algo):
         self.algo = algo
         self.algo.set_agent(self.agent)
+        if self.manager != None:
+            self.manager.schedule_trade(self)
 
     def save(self):
         return json.dumps(self, skipkeys = True)
@@ -70,30 +86,73 @@ class XTrade(object):
         else:            
             return self.underlying.price(prices=filled_prices)
             
-    def refresh(self):
-        if self.status not in Alive_Trade_Status:
-            return self.status        
+    def add_orders(self, instID, orders):
+        if instID not in self.order_dict:
+            self.order_dict[instID] = []
+        for iorder in orders:
+            self.order_dict[instID].append(iorder)
+            iorder.xtrade = self
+            self.update_order(iorder, instID)
+
+    def update_order(self, iorder, instID = None):
+        ''' apply the change of one order since its last update to the working order sums '''
+        key = id(iorder)
+        stats = (iorder.volume, iorder.filled_volume, iorder.filled_price * iorder.filled_volume)
+        if key in self.order_snap:
+            instID, prev = self.order_snap[key]
+            if prev == stats:
+                return
+        else:
+            prev = (0, 0, 0.0)
+            if instID == None:
+                instID = iorder.instrument
+        inst_stats = self.order_stats.setdefault(instID, [0, 0, 0.0])
+        for i in range(3):
+            inst_stats[i] += stats[i] - prev[i]
+        self.order_snap[key] = (instID, stats)
+
+    def set_orders(self, order_dict):
+        ''' rebuild the working order sums from the order lists '''
+        self.clear_orders()
+        for instID in order_dict:
+            self.add_orders(instID, order_dict[instID])
+
+    def clear_orders(self):
+        for instID in self.order_dict:
+            for iorder in self.order_dict[instID]:
+                if getattr(iorder, 'xtrade', None) == self:
+                    iorder.xtrade = None
+        self.order_dict = {}
+        self.order_stats = {}
+        self.order_snap = {}
+        self.order_filled = []
+
+    def order_sums(self):
         filled_vol = []
         open_vol = 0
         total_vol = 0
+        for instID, unit in zip(self.instIDs, self.units):
+            full_vol, fill_vol, _ = self.order_stats.get(instID, (0, 0, 0.0))
+            open_vol += full_vol - fill_vol
+            total_vol += abs(unit * self.working_vol)
+            filled_vol.append(fill_vol)
+        return filled_vol, open_vol, total_vol
+
+    def refresh(self):
+        if self.status not in Alive_Trade_Status:
+            return self.status        
         if len(self.order_dict)>0:
-            for instID, unit in zip(self.instIDs, self.units):
-                if instID in self.order_dict:
-                    fill_vol = sum([o.filled_volume for o in self.order_dict[instID]])
-                    full_vol = sum([o.volume for o in self.order_dict[instID]])
-                else:
-                    fill_vol = 0
-                    full_vol = 0
-                open_vol += full_vol - fill_vol
-                total_vol += abs(unit * self.working_vol)
-                filled_vol.append(fill_vol)
+            filled_vol, open_vol, total_vol = self.order_sums()
+            if sum(filled_vol) >= total_vol:
+                # recount from the orders before booking the fill
+                self.set_orders(self.order_dict)
+                filled_vol, open_vol, total_vol = self.order_sums()
             self.order_filled = filled_vol
             if sum(filled_vol) >= total_vol:
                 working_price = self.calc_filled_price(self.order_dict)
                 working_vol = self.working_vol
                 self.working_vol = 0
-                self.order_dict = {}
-                self.order_filled = []
+                self.clear_orders()
                 if self.status != TradeStatus.Cancelled:
                     self.status = TradeStatus.Ready
                 self.on_trade(working_price, working_vol)                
@@ -123,8 +182,7 @@ class XTrade(object):
         self.status = TradeStatus.Done
         self.remaining_vol = 0
         self.working_vol = 0
-        self.order_dict = {}
-        self.order_filled = []
+        self.clear_orders()
         self.algo = None
         self.update_strat()
 
@@ -135,3 +193,5 @@ class XTrade(object):
     def execute(self):
         if self.algo:
             self.algo.execute()
+            if self.manager != None:
+                self.manager.schedule_trade(self)
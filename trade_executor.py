@@ -34,6 +34,11 @@ class ExecAlgoBase(object):
     def on_partial_cancel(self):
         pass
 
+    def wake_conditions(self):
+        ''' returns (timer, stop_price), the algo runs again once tick_id passes the timer or the price hits
+            the stop, None for no condition. They are read again after each run and status change.'''
+        return -1, None
+
     def execute(self):
         pass
 
@@ -56,6 +61,8 @@ class ExecAlgo1DFixT(ExecAlgoBase):
         self.inst_objs = [self.xtrade.underlying]
         self.timer_period = time_period
         self.next_timer = self.agent.tick_id
+        # tick of the last cancels, None once new orders go out
+        self.cancel_timer = None
         self.price_type = price_type
         self.tick_num = tick_num
 
@@ -78,6 +85,7 @@ class ExecAlgo1DFixT(ExecAlgoBase):
         if stop_flag:
             status = self.xtrade.status = trade.TradeStatus.Cancelled
         if cancel_flag:
+            self.cancel_timer = self.agent.tick_id
             return status        
         if status == trade.TradeStatus.Cancelled:
             self.on_partial_cancel()
@@ -97,15 +105,32 @@ class ExecAlgo1DFixT(ExecAlgoBase):
             if len(traded_prices) > 0:
                 next_price = max(next_price, traded_prices[-1]) if next_vol > 0 else min(next_price, traded_prices[-1])
         if next_vol != 0:
-            gway = self.agent.gateway_map(self.instIDs[0])
+            # spread orders go to the gateway of the first leg
+            gway = self.agent.gateway_map(self.xtrade.instIDs[0])
             new_orders = getattr(gway, self.book_func)(self.instIDs[0], next_vol, self.price_type, next_price, trade_ref = self.xtrade.id, **self.book_args)
-            if self.instIDs[0] not in self.xtrade.order_dict:
-                self.xtrade.order_dict[self.instIDs[0]] = []
-            self.xtrade.order_dict[self.instIDs[0]] += new_orders
+            self.xtrade.add_orders(self.instIDs[0], new_orders)
             self.next_timer += self.timer_period
+            self.cancel_timer = None
             status = self.xtrade.status = trade.TradeStatus.OrderSent
         return status
-    
+
+    def wake_conditions(self):
+        status = self.xtrade.status
+        stop_price = self.stop_price if self.stop_price else None
+        if status == trade.TradeStatus.PFilled:
+            return self.agent.tick_id - 1, None
+        elif status in [trade.TradeStatus.OrderSent, trade.TradeStatus.Cancelled] and (self.agent.tick_id > self.next_timer):
+            if self.cancel_timer == None:
+                # the timer ran out before any cancel, as after a late send, cancel on the next tick
+                return self.agent.tick_id - 1, None
+            # the cancels are out and the order updates run the trade, resend them if nothing comes back
+            return self.agent.tick_id + self.timer_period, None
+        elif status in [trade.TradeStatus.Ready, trade.TradeStatus.OrderSent]:
+            return self.next_timer, stop_price
+        elif status == trade.TradeStatus.Cancelled:
+            return self.next_timer, None
+        return None, None
+
     def on_partial_cancel(self):
         curr_vol = self.xtrade.order_filled[0]
         if curr_vol != 0 :
@@ -120,6 +145,8 @@ class ExecAlgoFixTimer(ExecAlgoBase):
         super(ExecAlgoFixTimer, self).__init__(xtrade, stop_price = stop_price, max_vol = max_vol, inst_order = inst_order)
         self.timer_period = time_period
         self.next_timer = self.agent.tick_id
+        # tick of the last cancels, None once new orders go out
+        self.cancel_timer = None
         self.price_type = price_type
         self.order_num = 3 if order_offset else 1
         self.tick_num = tick_num
@@ -144,6 +171,7 @@ class ExecAlgoFixTimer(ExecAlgoBase):
         if stop_flag:
             status = self.xtrade.status = trade.TradeStatus.Cancelled
         if cancel_flag:
+            self.cancel_timer = self.agent.tick_id
             return status
         if status == trade.TradeStatus.Cancelled:
             self.on_partial_cancel()
@@ -172,19 +200,35 @@ class ExecAlgoFixTimer(ExecAlgoBase):
             self.xtrade.working_vol =  min(self.max_vol, abs(self.xtrade.remaining_vol)) * direction
             self.xtrade.remaining_vol -= self.xtrade.working_vol
             next_inst = self.instIDs[0]
-            self.xtrade.order_dict[next_inst] = []
+            self.xtrade.clear_orders()
             next_vol = self.units[0] * self.xtrade.working_vol
             next_price = self.inst_objs[0].shift_price(next_vol, self.tick_num)
         if next_vol != 0:
             gway = self.agent.gateway_map(next_inst)
             new_orders = gway.book_order(next_inst, next_vol, self.price_type, next_price, trade_ref = self.xtrade.id, order_num = self.order_num)
-            if next_inst not in self.xtrade.order_dict:
-                self.xtrade.order_dict[next_inst] = []
-            self.xtrade.order_dict[next_inst] += new_orders
+            self.xtrade.add_orders(next_inst, new_orders)
             self.next_timer += self.timer_period
+            self.cancel_timer = None
             status = self.xtrade.status = trade.TradeStatus.OrderSent
         return status
-    
+
+    def wake_conditions(self):
+        status = self.xtrade.status
+        stop_price = self.stop_price if self.stop_price else None
+        if status == trade.TradeStatus.PFilled:
+            return self.agent.tick_id - 1, None
+        elif status in [trade.TradeStatus.OrderSent, trade.TradeStatus.Cancelled] and (self.agent.tick_id > self.next_timer):
+            if self.cancel_timer == None:
+                # the timer ran out before any cancel, as after a late send, cancel on the next tick
+                return self.agent.tick_id - 1, None
+            # the cancels are out and the order updates run the trade, resend them if nothing comes back
+            return self.agent.tick_id + self.timer_period, None
+        elif status in [trade.TradeStatus.Ready, trade.TradeStatus.OrderSent]:
+            return self.next_timer, stop_price
+        elif status == trade.TradeStatus.Cancelled:
+            return self.next_timer, None
+        return None, None
+
     def on_partial_cancel(self):
         direction = sign(self.xtrade.vol)
         fillvol = min([int(abs(filled/unit)) for (filled, unit) in zip(self.xtrade.order_filled, self.xtrade.units)]) * direction
@@ -2,19 +2,28 @@
 from trade import *
 from eventType import *
 from eventEngine import *
+import bisect
+import heapq
+import itertools
+import journal
+from collections import OrderedDict
 from bintrees import FastRBTree
 
+trade_header = ['id', 'insts', 'units', 'price_unit', 'vol', 'limitprice',
+                'filledvol', 'filledprice', 'order_dict', 'aggressive',
+                'start_time', 'end_time', 'strategy','book', 'status']
+
 class LinkedList(object):
     class Node(object):
-        def __init__(self, data, prev, next):
+        def __init__(self, data, prev_item = None, next_item = None):
             self.data = data
-            self.prev = prev
-            self.next = next
+            self.prev_item = prev_item
+            self.next_item = next_item
 
     def __init__(self):
         self.head_item = None  # first trade in the list
         self.tail_item = None  # last trade in the list
-        self.length = 0  # number of Orders in the list
+        self.length = 0  # number of trades in the list
         self.last = None  # helper for iterating 
 
     def __len__(self):
@@ -42,73 +51,61 @@ class LinkedList(object):
         return self.head_item
 
     def append_item(self, data):
-        item = LinkedList.Node(data, None, None)
-        if len(self) == 0:
-            item.next_item = None
-            item.prev_item = None
+        item = LinkedList.Node(data, self.tail_item, None)
+        if self.length == 0:
             self.head_item = item
-            self.tail_item = item
         else:
-            item.prev_item = self.tail_item
-            item.next_item = None
             self.tail_item.next_item = item
-            self.tail_item = item
+        self.tail_item = item
         self.length += 1
         return item
 
     def remove_item(self, item):
+        # relink the neighbours, the removed node keeps its next_item so a running iteration can carry on
+        if item.prev_item != None:
+            item.prev_item.next_item = item.next_item
+        else:
+            self.head_item = item.next_item
+        if item.next_item != None:
+            item.next_item.prev_item = item.prev_item
+        else:
+            self.tail_item = item.prev_item
+        item.prev_item = None
         self.length -= 1
-        if len(self) == 0:  # if there are no more Orders, stop/return
-            return
-
-        # Remove an Order from the TradeList. First grab next / prev trade
-        # from the Order we are removing. Then relink everything. Finally
-        # remove the Order.
-        next_item = item.next_trade
-        prev_item = item.prev_trade
-        if next_item != None and prev_item != None:
-            next_item.prev_trade = prev_item
-            prev_item.next_trade = next_item
-        elif next_item != None:  # There is no previous trade
-            next_item.prev_item = None
-            self.head_item = next_item  # The next trade becomes the first trade in the TradeList after this Order is removed
-        elif prev_item != None:  # There is no next trade
-            prev_item.next_item = None
-            self.tail_item = prev_item  # The previous trade becomes the last trade in the TradeList after this Order is removed
 
     def move_to_tail(self, item):
-        '''After updating the quantity of an existing Order, move it to the tail of the TradeList
-        Check to see that the quantity is larger than existing, update the quantities, then move to tail.
-        '''
-        if item.prev_item != None:  # This Order is not the first Order in the TradeList
-            item.prev_item.next_item = item.next_item  # Link the previous Order to the next Order, then move the Order to tail
-        else:  # This Order is the first Order in the TradeList
-            self.head_item = item.next_item  # Make next trade the first
-        item.next_item.prev_item = item.prev_item
-        # Move Order to the last position. Link up the previous last position Order.
-        self.tail_item.next_item = item
+        '''Move an item to the tail of the list, it loses its time priority '''
+        if item is self.tail_item:
+            return
+        self.remove_item(item)
+        item.next_item = None
+        item.prev_item = self.tail_item
+        if self.length == 0:
+            self.head_item = item
+        else:
+            self.tail_item.next_item = item
         self.tail_item = item
+        self.length += 1
 
 class TradeTree(object):
-    '''A red-black tree used to store TradeLists in price trade
-    The exchange will be using the TradeTree to hold bid and ask data (one TradeTree for each side).
-    Keeping the information in a red black tree makes it easier/faster to detect a match.
+    '''A red-black tree of price levels, each level is a LinkedList of trades in arrival order.
+    One tree per side, so insert, cancel and best price lookup are O(log n).
     '''
 
     def __init__(self):
         self.price_tree = FastRBTree()
         self.trade_map = {}
-        self.num_trades = 0 # Contains count of Orders in tree
-        self.depth = 0 # Number of different prices in tree (http://en.wikipedia.org/wiki/trade_book_(trading)#Book_depth)
+        self.num_trades = 0 # Contains count of trades in tree
+        self.depth = 0 # Number of different prices in tree
 
     def __len__(self):
         return len(self.trade_map)
 
     def get_price_list(self, price):
-        return self.price_tree.get(price, [])
+        return self.price_tree.get(price, None)
 
     def get_trade(self, trade_id):
-        return self.trade_map[trade_id] if trade_id in self.trade_map else None
+        return self.trade_map[trade_id].data if trade_id in self.trade_map else None
 
     def create_price(self, price):
         self.depth += 1 # Add a price depth level to the tree
@@ -131,15 +128,17 @@ class TradeTree(object):
         self.num_trades += 1
         if not self.price_exists(xtrade.limit_price):
             self.create_price(xtrade.limit_price) # If price not in Price Map, create a node in RBtree
-        self.trade_map[trade.id] = self.price_tree[xtrade.limit_price].append_item(xtrade) # Add the trade to the TradeList in Price Map return the reference
+        self.trade_map[xtrade.id] = self.price_tree[xtrade.limit_price].append_item(xtrade)
 
     def remove_trade(self, xtrade):
+        if not self.trade_exists(xtrade.id):
+            return
         self.num_trades -= 1
-        trade_node = self.trade_map[trade.id]
-        self.price_tree[trade.limit_price].remove_item(trade_node)
-        if len(self.price_tree[trade.limit_price]) == 0:
-            self.remove_price(trade.limit_price)
-        self.trade_map.pop(trade.id, None)        
+        trade_node = self.trade_map.pop(xtrade.id)
+        price_list = self.price_tree[xtrade.limit_price]
+        price_list.remove_item(trade_node)
+        if len(price_list) == 0:
+            self.remove_price(xtrade.limit_price)
 
     def max_price(self):
         if self.depth > 0:
@@ -166,6 +165,9 @@ class TradeTree(object):
             return None
 
 class FullTradeBook(object):
+    ''' price-time priority book of the alive trades of one underlying. A new trade first nets
+        against the resting opposite trades with a compatible limit price, from the best price and
+        oldest trade on, at the underlying mid price kept within both limits. The rest is queued.'''
     def __init__(self, ee, inst_obj):
         self.bids = TradeTree()
         self.asks = TradeTree()
@@ -174,6 +176,12 @@ class FullTradeBook(object):
     
     def get_all_trades(self):
         return self.bids.trade_map.keys() + self.asks.trade_map.keys()
+
+    def best_bid(self):
+        return self.bids.max_price()
+
+    def best_ask(self):
+        return self.asks.min_price()
         
     def remove_trade(self, xtrade):
         if xtrade.vol > 0:
@@ -182,85 +190,83 @@ class FullTradeBook(object):
             self.asks.remove_trade(xtrade)
 
     def add_trade(self, xtrade):
-        direction = 'bid' if xtrade.vol > 0 else 'ask'
-        if direction == 'bid':
-            while self.asks and (xtrade.limit_price >= self.asks.min_price()) and (abs(xtrade.remaining_vol)!= 0):
-                best_price_asks = self.asks.min_price_list()
-                self.process_trade_list('ask', best_price_asks, xtrade)
-        elif direction == 'ask':
-            while self.bids and (xtrade.limit_price <= self.bids.max_price()) and (abs(xtrade.filled_vol - xtrade.vol)!= 0):
-                best_price_bids = self.bids.max_price_list()
-                self.process_trade_list('bid', best_price_bids, xtrade)
-        if xtrade.status == TradeStatus.Done:
-            event = Event(type=EVENT_XTRADESTATUS)
-            event.dict['trade_ref'] = xtrade.id
-            self.eventEngine.put(event)
+        if xtrade.vol > 0:
+            while (self.asks.depth > 0) and (xtrade.limit_price >= self.asks.min_price()) and (xtrade.remaining_vol != 0):
+                if not self.process_trade_list(self.asks, self.asks.min_price(), xtrade):
+                    break
         else:
-            if direction == 'bid':
+            while (self.bids.depth > 0) and (xtrade.limit_price <= self.bids.max_price()) and (xtrade.remaining_vol != 0):
+                if not self.process_trade_list(self.bids, self.bids.max_price(), xtrade):
+                    break
+        if xtrade.status in Alive_Trade_Status:
+            if xtrade.vol > 0:
                 self.bids.insert_trade(xtrade)
             else:
                 self.asks.insert_trade(xtrade)
-            return
-        return
 
-    def process_trade_list(self, side, trade_list, xtrade):
-        curr_item = trade_list.get_head_item()
-        while (curr_item != None) and (abs(xtrade.remaining_vol) > 0):
+    def cross_price(self, bid_limit, ask_limit):
+        return min(max(self.instrument.mid_price, ask_limit), bid_limit)
+
+    def process_trade_list(self, tree, price, xtrade):
+        ''' nets xtrade against the trades queued at price, returns False if nothing could be matched'''
+        curr_item = tree.get_price_list(price).get_head_item()
+        if xtrade.vol > 0:
+            traded_price = self.cross_price(xtrade.limit_price, price)
+        else:
+            traded_price = self.cross_price(price, xtrade.limit_price)
+        matched = False
+        while (curr_item != None) and (xtrade.remaining_vol != 0):
             next_item = curr_item.next_item
             curr_xtrade = curr_item.data
-            traded_price = self.instrument.mid_price
-            diff = abs(xtrade.remaining_vol) - abs(curr_xtrade.remaining_vol)
-            if abs(xtrade.remaining_vol) - abs(curr_xtrade.remaining_vol) <= 0: 
-                curr_xtrade.on_trade(traded_price, -xtrade.remaining_vol)
-                xtrade.on_trade(traded_price, xtrade.remaining_vol)
-            else:
-                curr_xtrade.on_trade(traded_price, curr_xtrade.remaining_vol)
-                xtrade.on_trade(traded_price, -curr_xtrade.remaining_vol)                                   
-                if curr_xtrade.status == TradeStatus.Done:
-                    event = Event(type=EVENT_XTRADESTATUS)
-                    event.dict['trade_ref'] = xtrade.id
-                    self.eventEngine.put(event)                    
-                    if side == 'bid':
-                        self.bids.remove_trade(curr_xtrade)
-                    else:
-                        self.asks.remove_trade(curr_xtrade)                            
+            if curr_xtrade.remaining_vol != 0:
+                volume = min(abs(xtrade.remaining_vol), abs(curr_xtrade.remaining_vol))
+                direction = 1 if xtrade.vol > 0 else -1
+                # a trade done here is dropped from the tree through the manager status update
+                curr_xtrade.on_trade(traded_price, -volume * direction)
+                xtrade.on_trade(traded_price, volume * direction)
+                matched = True
             curr_item = next_item
+        return matched
+
+    def match_trades(self):
+        # crossing happens when a trade is added, there is nothing to do on ticks
+        pass
 
 class SimpleTradeBook(object):
     def __init__(self, ee, inst_obj):
-        self.bids = []
-        self.asks = []        
+        self.bids = OrderedDict()
+        self.asks = OrderedDict()
         self.eventEngine = ee
         self.instrument = inst_obj
     
     def get_all_trades(self):
-        return [xtrade.id for xtrade in self.bids + self.asks if xtrade.status in trade.Alive_Trade_Status]
+        return self.bids.keys() + self.asks.keys()
         
     def remove_trade(self, xtrade):
         if xtrade.vol > 0:
-            self.bids = [ x for x in self.bids if x.id != xtrade.id ]
+            self.bids.pop(xtrade.id, None)
         else:
-            self.asks = [ x for x in self.asks if x.id != xtrade.id ]
-
-    def filter_alive_trades(self):
-        self.bids = [ xtrade for xtrade in self.bids if xtrade.status in Alive_Trade_Status]
-        self.asks = [xtrade for xtrade in self.asks if xtrade.status in Alive_Trade_Status]
+            self.asks.pop(xtrade.id, None)
 
     def add_trade(self, xtrade):
         if xtrade.vol > 0:
-            self.bids.append(xtrade)
+            self.bids[xtrade.id] = xtrade
         else:
-            self.asks.append(xtrade)
+            self.asks[xtrade.id] = xtrade
     
     def match_trades(self):
-        nbid = len(self.bids)
-        nask = len(self.asks)
+        if (len(self.bids) == 0) or (len(self.asks) == 0):
+            return
+        bids = self.bids.values()
+        asks = self.asks.values()
+        nbid = len(bids)
+        nask = len(asks)
         n = 0
         m = 0
         traded_price = self.instrument.mid_price
         while (n < nbid) and (m < nask):
-            bid_trade = self.bids[n]
-            ask_trade = self.asks[m]
+            bid_trade = bids[n]
+            ask_trade = asks[m]
             if bid_trade.remaining_vol == 0:
                 n += 1
             elif ask_trade.remaining_vol == 0:
@@ -274,23 +280,116 @@ class SimpleTradeBook(object):
                     ask_trade.on_trade(traded_price, ask_trade.remaining_vol)
                     bid_trade.on_trade(traded_price, -ask_trade.remaining_vol)
                     m += 1
-            
+
+class PendingTrades(object):
+    ''' pending trades of one underlying sorted by limit price, a buy is triggered once the ask
+        reaches its limit and a sell once the bid falls to its limit'''
+    def __init__(self):
+        self.buy_keys = []
+        self.buy_trades = []
+        self.sell_keys = []
+        self.sell_trades = []
+
+    def __len__(self):
+        return len(self.buy_trades) + len(self.sell_trades)
+
+    def add_trade(self, xtrade, price = None):
+        if price == None:
+            price = xtrade.limit_price
+        keys, trades = (self.buy_keys, self.buy_trades) if xtrade.vol > 0 else (self.sell_keys, self.sell_trades)
+        idx = bisect.bisect_right(keys, price)
+        keys.insert(idx, price)
+        trades.insert(idx, xtrade)
+
+    def remove_trade(self, xtrade, price = None):
+        if price == None:
+            price = xtrade.limit_price
+        keys, trades = (self.buy_keys, self.buy_trades) if xtrade.vol > 0 else (self.sell_keys, self.sell_trades)
+        idx = bisect.bisect_left(keys, price)
+        while (idx < len(keys)) and (keys[idx] == price):
+            if trades[idx] is xtrade:
+                del keys[idx]
+                del trades[idx]
+                return True
+            idx += 1
+        return False
+
+    def triggered(self, bid_price, ask_price):
+        nbuy = bisect.bisect_right(self.buy_keys, ask_price)
+        nsell = bisect.bisect_left(self.sell_keys, bid_price)
+        return self.buy_trades[:nbuy] + self.sell_trades[nsell:]
+
+class ExecSchedule(object):
+    ''' wake up conditions of the working trades of one underlying, a trade is due once tick_id passes
+        its timer or the price hits its stop, so the idle trades cost nothing on ticks'''
+    def __init__(self):
+        self.timers = []
+        self.seq = itertools.count()
+        self.trades = {}
+        self.wake_timers = {}
+        self.stops = PendingTrades()
+        self.stop_prices = {}
+
+    def __len__(self):
+        return len(self.trades)
+
+    def add_trade(self, xtrade, timer = None, stop_price = None):
+        self.remove_trade(xtrade)
+        if (timer == None) and (stop_price == None):
+            return
+        self.trades[xtrade.id] = xtrade
+        if timer != None:
+            self.wake_timers[xtrade.id] = timer
+            heapq.heappush(self.timers, (timer, next(self.seq), xtrade.id))
+        if stop_price != None:
+            self.stop_prices[xtrade.id] = stop_price
+            self.stops.add_trade(xtrade, stop_price)
+
+    def remove_trade(self, xtrade):
+        # the heap entry is left behind and dropped when it comes up
+        self.trades.pop(xtrade.id, None)
+        self.wake_timers.pop(xtrade.id, None)
+        if xtrade.id in self.stop_prices:
+            self.stops.remove_trade(xtrade, self.stop_prices.pop(xtrade.id))
+
+    def due_trades(self, tick_id, price):
+        due = []
+        while (len(self.timers) > 0) and (self.timers[0][0] < tick_id):
+            timer, _, trade_id = heapq.heappop(self.timers)
+            if self.wake_timers.get(trade_id, None) == timer:
+                due.append(self.trades[trade_id])
+                self.remove_trade(due[-1])
+        if len(self.stop_prices) > 0:
+            for xtrade in self.stops.triggered(price, price):
+                due.append(xtrade)
+                self.remove_trade(xtrade)
+        return due
+
+tradebook_map = {'simple': SimpleTradeBook, 'full': FullTradeBook}
+
 class TradeManager(object):
-    def __init__(self, agent):
+    def __init__(self, agent, book_type = 'full'):
         self.agent = agent        
+        self.book_class = tradebook_map[book_type]
         self.tradebooks = {}
         self.pending_trades = {}
         self.ref2trade = {}
+        self.status_trades = {}
+        self.key_trades = {}
+        self.exec_schedules = {}
+        self.updated_trades = set()
+        self.trade_journal = None
 
     def initialize(self):
         if self.agent.eod_flag:
             return
-        self.ref2trade = self.load_trade_list(self.agent.scur_day, self.agent.folder)
-        for trade_id in self.ref2trade:
-            xtrade = self.ref2trade[trade_id]
+        ref2trade = self.load_trade_list(self.agent.scur_day, self.agent.folder)
+        for trade_id in ref2trade:
+            xtrade = ref2trade[trade_id]
             orderdict = xtrade.order_dict
-            for inst in orderdict:
-                xtrade.order_dict[inst] = [ self.agent.ref2order[order_ref] for order_ref in orderdict[inst] ]
+            xtrade.order_dict = {}
+            xtrade.set_orders(dict([(inst, [self.agent.ref2order[order_ref] for order_ref in orderdict[inst]]) \
+                                    for inst in orderdict]))
             xtrade.refresh()
             self.add_trade(xtrade)
 
@@ -303,7 +402,7 @@ class TradeManager(object):
             xtrade.refresh()
             if xtrade.status in [TradeStatus.Pending, TradeStatus.Ready]:
                 xtrade.status = TradeStatus.Done
-                xtrade.order_dict = {}
+                xtrade.clear_orders()
                 xtrade.filled_vol = 0
                 xtrade.remaining_vol = xtrade.vol - xtrade.filled_vol
                 strat = self.agent.strategies[xtrade.strategy]
@@ -316,9 +415,15 @@ class TradeManager(object):
             file_prefix = self.agent.folder + 'PFILLED_'
             self.save_trade_list(self.agent.scur_day, pfilled_dict, file_prefix)
         self.save_trade_list(scur_day, self.ref2trade, file_prefix)
+        self.close_journal()
+        for xtrade in self.ref2trade.values():
+            xtrade.manager = None
         self.tradebooks = {}
         self.pending_trades = {}
         self.ref2trade = {}
+        self.status_trades = {}
+        self.key_trades = {}
+        self.exec_schedules = {}
 
     def get_trade(self, trade_id):
         return self.ref2trade[trade_id] if trade_id in self.ref2trade else None
@@ -326,104 +431,176 @@ class TradeManager(object):
     def get_trades_by_strat(self, strat_name):
         return [xtrade for xtrade in self.ref2trade.values() if xtrade.strategy == strat_name]
 
+    def get_trades_by_status(self, status):
+        return [self.ref2trade[trade_id] for trade_id in self.status_trades.get(status, [])]
+
+    def get_alive_trades(self, key):
+        return self.key_trades.get(key, {}).values()
+
     def add_trade(self, xtrade):
         if xtrade.id not in self.ref2trade:
             self.ref2trade[xtrade.id] = xtrade
+        if xtrade.manager != self:
+            xtrade.manager = self
+            self.on_trade_status(xtrade, None)
+
+    def remove_trade(self, xtrade):
+        self.unindex_trade(xtrade, xtrade.status)
+        if xtrade.underlying.name in self.exec_schedules:
+            self.exec_schedules[xtrade.underlying.name].remove_trade(xtrade)
+        xtrade.manager = None
+
+    def index_trade(self, xtrade, status):
         key = xtrade.underlying.name
-        if xtrade.status == TradeStatus.Pending:
+        self.status_trades.setdefault(status, set()).add(xtrade.id)
+        if status == TradeStatus.Pending:
             if key not in self.pending_trades:
-                self.pending_trades[key] = []
-            self.pending_trades[key].append(xtrade)
-        elif xtrade.status in Alive_Trade_Status:
-            key = xtrade.underlying.name
-            if key in self.agent.instruments:
-                inst_obj = self.agent.instruments[key]
-            else:
-                inst_obj = self.agent.spread_data[key]
+                self.pending_trades[key] = PendingTrades()
+            self.pending_trades[key].add_trade(xtrade)
+        elif status in Alive_Trade_Status:
             if key not in self.tradebooks:
-                self.tradebooks[key] = SimpleTradeBook(self.agent.eventEngine, inst_obj)
+                if key in self.agent.instruments:
+                    inst_obj = self.agent.instruments[key]
+                else:
+                    inst_obj = self.agent.spread_data[key]
+                self.tradebooks[key] = self.book_class(self.agent.eventEngine, inst_obj)
+                self.key_trades[key] = OrderedDict()
+            self.key_trades[key][xtrade.id] = xtrade
+            # the book may cross the trade right away, which updates the indices again
             self.tradebooks[key].add_trade(xtrade)
 
-    def remove_trade(self, xtrade):
-        key = xtrade.name
-        if xtrade.status == TradeStatus.Pending:
-            self.pending_trades[key].remove(xtrade, None)
-        elif xtrade.status in Alive_Trade_Status:
-            self.tradebooks[key].remove_trade(xtrade)
+    def unindex_trade(self, xtrade, status):
+        key = xtrade.underlying.name
+        if status in self.status_trades:
+            self.status_trades[status].discard(xtrade.id)
+        if status == TradeStatus.Pending:
+            if key in self.pending_trades:
+                self.pending_trades[key].remove_trade(xtrade)
+        elif status in Alive_Trade_Status:
+            if key in self.tradebooks:
+                self.tradebooks[key].remove_trade(xtrade)
+                self.key_trades[key].pop(xtrade.id, None)
+
+    def on_trade_status(self, xtrade, old_status):
+        ''' called by XTrade on each status change, moves the trade between the indices '''
+        new_status = xtrade.status
+        self.updated_trades.add(xtrade.id)
+        if old_status != None:
+            if (old_status in Alive_Trade_Status) and (new_status in Alive_Trade_Status):
+                self.status_trades[old_status].discard(xtrade.id)
+                self.status_trades.setdefault(new_status, set()).add(xtrade.id)
+                self.schedule_trade(xtrade)
+                return
+            self.unindex_trade(xtrade, old_status)
+        self.index_trade(xtrade, new_status)
+        self.schedule_trade(xtrade)
+
+    def schedule_trade(self, xtrade):
+        ''' (re)register the wake up conditions of the trade algo '''
+        key = xtrade.underlying.name
+        if (xtrade.status in Alive_Trade_Status) and (xtrade.algo != None) and (xtrade.manager == self):
+            if key not in self.exec_schedules:
+                self.exec_schedules[key] = ExecSchedule()
+            timer, stop_price = xtrade.algo.wake_conditions()
+            self.exec_schedules[key].add_trade(xtrade, timer, stop_price)
+        elif key in self.exec_schedules:
+            self.exec_schedules[key].remove_trade(xtrade)
 
     def check_pending_trades(self, key):
-        alive_trades = []
-        if key not in self.pending_trades:
+        if (key not in self.pending_trades) or (len(self.pending_trades[key]) == 0):
             return
-        for xtrade in self.pending_trades[key]:
-            curr_price = xtrade.underlying.ask_price1 if xtrade.vol > 0 else xtrade.underlying.bid_price1 
-            if (curr_price - xtrade.limit_price) * xtrade.vol >= 0:
-                xtrade.status = TradeStatus.Ready
-                alive_trades.append(xtrade)
-        self.pending_trades[key] = [xtrade for xtrade in self.pending_trades[key] if xtrade.status == TradeStatus.Pending]
-        [self.add_trade(xtrade) for xtrade in alive_trades]
+        underlying = self.pending_trades[key].buy_trades[0].underlying if len(self.pending_trades[key].buy_trades) > 0 \
+                        else self.pending_trades[key].sell_trades[0].underlying
+        for xtrade in self.pending_trades[key].triggered(underlying.bid_price1, underlying.ask_price1):
+            xtrade.status = TradeStatus.Ready
 
     def process_trades(self, key):
-        if key not in self.tradebooks:
+        if (key not in self.tradebooks) or (len(self.key_trades[key]) == 0):
             return
         self.tradebooks[key].match_trades()
-        for trade_id in self.tradebooks[key].get_all_trades():
-            xtrade = self.ref2trade[trade_id]
-            xtrade.execute()
-        self.tradebooks[key].filter_alive_trades()
+        if (key not in self.exec_schedules) or (len(self.exec_schedules[key]) == 0):
+            return
+        underlying = self.tradebooks[key].instrument
+        for xtrade in self.exec_schedules[key].due_trades(self.agent.tick_id, underlying.mid_price):
+            if xtrade.status in Alive_Trade_Status:
+                xtrade.execute()
+
+    def trade_row(self, xtrade):
+        insts = ' '.join(xtrade.instIDs)
+        units = ' '.join([str(i) for i in xtrade.units])
+        if len(xtrade.order_dict)>0:
+            order_dict = ' '.join([inst +':'+'_'.join([str(o.order_ref) for o in xtrade.order_dict[inst] if o.volume > 0])
+                                for inst in xtrade.order_dict])
+        else:
+            order_dict = ''
+        return [xtrade.id, insts, units, xtrade.price_unit, xtrade.vol, xtrade.limit_price,
+                xtrade.filled_vol, xtrade.filled_price, order_dict, xtrade.aggressive_level,
+                xtrade.start_time, xtrade.end_time, xtrade.strategy, xtrade.book, xtrade.status]
+
+    def get_trade_journal(self, curr_date, file_prefix):
+        filename = file_prefix + 'trade_' + curr_date.strftime('%y%m%d')+'.csv'
+        if (self.trade_journal == None) or (self.trade_journal.filename != filename):
+            self.close_journal()
+            self.trade_journal = journal.StateJournal(filename, trade_header)
+            self.trade_journal.load()
+        return self.trade_journal
+
+    def close_journal(self):
+        if self.trade_journal != None:
+            self.trade_journal.close()
+            self.trade_journal = None
+
+    def journal_trades(self, curr_date, file_prefix):
+        ''' append the trades changed since the last call, the alive trades are checked as their fills move '''
+        trade_journal = self.get_trade_journal(curr_date, file_prefix)
+        trade_ids = self.updated_trades
+        for status in Alive_Trade_Status:
+            trade_ids = trade_ids.union(self.status_trades.get(status, set()))
+        for trade_id in trade_ids:
+            if trade_id in self.ref2trade:
+                trade_journal.update(self.trade_row(self.ref2trade[trade_id]))
+        self.updated_trades = set()
 
     def save_trade_list(self, curr_date, trade_list, file_prefix):
         filename = file_prefix + 'trade_' + curr_date.strftime('%y%m%d')+'.csv'
-        with open(filename,'wb') as log_file:
-            file_writer = csv.writer(log_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL);
-            file_writer.writerow(['id', 'insts', 'units', 'price_unit', 'vol', 'limitprice',
-                                  'filledvol', 'filledprice', 'order_dict', 'aggressive',
-                                  'start_time', 'end_time', 'strategy','book', 'status'])
-            for xtrade in trade_list.values():
-                insts = ' '.join(xtrade.instIDs)
-                units = ' '.join([str(i) for i in xtrade.units])
-                if len(xtrade.order_dict)>0:
-                    order_dict = ' '.join([inst +':'+'_'.join([str(o.order_ref) for o in xtrade.order_dict[inst] if o.volume > 0])
-                                        for inst in xtrade.order_dict])
-                else:
-                    order_dict = ''
-                file_writer.writerow([xtrade.id, insts, units, xtrade.price_unit, xtrade.vol, xtrade.limit_price,
-                                      xtrade.filled_vol, xtrade.filled_price, order_dict, xtrade.aggressive_level,
-                                      xtrade.start_time, xtrade.end_time, xtrade.strategy, xtrade.book, xtrade.status])
+        rows = [self.trade_row(xtrade) for xtrade in trade_list.values()]
+        if (self.trade_journal != None) and (self.trade_journal.filename == filename):
+            for row in rows:
+                self.trade_journal.update(row)
+            self.trade_journal.compact()
+        else:
+            journal.write_csv_file(filename, rows, trade_header)
 
     def load_trade_list(self, curr_date, file_prefix):
-        logfile = file_prefix + 'trade_' + curr_date.strftime('%y%m%d')+'.csv'
-        if not os.path.isfile(logfile):
+        rows = self.get_trade_journal(curr_date, file_prefix).load()
+        if len(rows) == 0:
             return {}
         trade_dict = {}
-        with open(logfile, 'rb') as f:
-            reader = csv.reader(f)
-            for idx, row in enumerate(reader):
-                if idx > 0:
-                    instIDs = row[1].split(' ')
-                    units = [ int(n) for n in row[2].split(' ')]
-                    price_unit = None if len(row[3]) == 0 else float(row[3])
-                    vol = int(row[4])
-                    limit_price = float(row[5])
-                    filled_vol = int(row[6])
-                    filled_price = float(row[7])
-                    aggressiveness = float(row[9])
-                    start_time = int(row[10])
-                    end_time = int(row[11])
-                    order_dict = {}
-                    if ':' in row[8]:
-                        str_dict =  dict([tuple(s.split(':')) for s in row[8].split(' ')])
-                        for inst in str_dict:
-                            if len(str_dict[inst])>0:
-                                order_dict[inst] = [int(o_id) for o_id in str_dict[inst].split('_')]
-                    strategy = row[12]
-                    book = row[13]
-                    xtrade = XTrade(instIDs = instIDs, units = units, vol = vol, \
-                                    limit_price = limit_price, price_unit = price_unit, \
-                                    strategy = strategy, book = book, \
-                                    filled_vol = filled_vol, filled_price = filled_price, \
-                                    start_time = start_time, end_time = end_time, aggressiveness = aggressiveness, \
-                                    tradeid = int(row[0]), status = int(row[14]), order_dict = order_dict)
-                    xtrade.set_agent(self.agent)
-                    trade_dict[xtrade.id] = xtrade
+        for row in rows:
+            instIDs = row[1].split(' ')
+            units = [ int(n) for n in row[2].split(' ')]
+            price_unit = None if len(row[3]) == 0 else float(row[3])
+            vol = int(row[4])
+            limit_price = float(row[5])
+            filled_vol = int(row[6])
+            filled_price = float(row[7])
+            aggressiveness = float(row[9])
+            start_time = int(row[10])
+            end_time = int(row[11])
+            order_dict = {}
+            if ':' in row[8]:
+                str_dict =  dict([tuple(s.split(':')) for s in row[8].split(' ')])
+                for inst in str_dict:
+                    if len(str_dict[inst])>0:
+                        order_dict[inst] = [int(o_id) for o_id in str_dict[inst].split('_')]
+            strategy = row[12]
+            book = row[13]
+            xtrade = XTrade(instIDs = instIDs, units = units, vol = vol, \
+                            limit_price = limit_price, price_unit = price_unit, \
+                            strategy = strategy, book = book, \
+                            filled_vol = filled_vol, filled_price = filled_price, \
+                            start_time = start_time, end_time = end_time, aggressiveness = aggressiveness, \
+                            id = int(row[0]), status = int(row[14]), order_dict = order_dict)
+            xtrade.set_agent(self.agent)
+            trade_dict[xtrade.id] = xtrade
         return trade_dict
@@ -57,6 +57,7 @@ orderStatusMapReverse[defineDict["DFITC_SPD_PARTIAL_CANCELED"]] = STATUS_CANCELL
 ########################################################################
 class XspeedGateway(VtGateway):
     """XSPEED接口"""
+    route_exchanges = ['CZCE', 'DCE', 'SHFE', 'CFFEX']
 
     #----------------------------------------------------------------------
     def __init__(self, eventEngine, gatewayName='XSPEED'):